@@ -3,7 +3,17 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta, datetime, date
+from functools import wraps
+
+from dataset import (CalendarGrid, Dataset, DayIndex, FilterSpec, FirstSeenIndex, MonthlyRanks, RollupCube, TopTotals,
+                     day_bitmaps, sessionize)
+from ingest import (append_to_store, decode_track_ids, first_listen_tables, from_day,
+                    load_exports, load_history_json, load_store, new_store_key, store_version,
+                    month_index, month_labels, to_day)
 
 # ----------------------------
 # Page Configuration
@@ -14,6 +24,7 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="collapsed"
 )
+_page_started = time.perf_counter()
 
 # ----------------------------
 # Design System
@@ -151,6 +162,17 @@ st.markdown(f"""
     .kpi-accent {{
         color: {SPOTIFY["green"]};
     }}
+    .kpi-delta {{
+        font-size: 0.65rem;
+        margin-top: 2px;
+        color: {SPOTIFY["text_muted"]};
+    }}
+    .kpi-delta.up {{
+        color: {SPOTIFY["green"]};
+    }}
+    .kpi-delta.down {{
+        color: #F87171;
+    }}
     
     /* ---- Section header ---- */
     .section-header {{
@@ -297,16 +319,6 @@ st.markdown(f"""
 # ----------------------------
 # Helper Functions
 # ----------------------------
-def clean_string(s):
-    if pd.isna(s): return None
-    s = str(s).strip()
-    return None if s.lower() in ["nan", "none", "undefined", "null", ""] else s
-
-def _to_bool(x):
-    if isinstance(x, bool): return x
-    if pd.isna(x): return False
-    return str(x).strip().lower() in ["true", "t", "1", "yes", "y"]
-
 def section_header(icon, title, help_text=None):
     st.markdown(f'''<div class="section-header">
         <span style="font-size:1.1rem;">{icon}</span>
@@ -344,40 +356,139 @@ HEATMAP_CONFIG = {
     "showEditInChartStudio": False,
 }
 
-@st.cache_data(show_spinner=False)
-def load_csv(uploaded_file=None, path=None):
-    if uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
-    elif path is not None:
-        df = pd.read_csv(path)
-    else:
+@st.cache_data(show_spinner="Loading listening history…")
+def load_csv(uploaded_files=None, path=None):
+    sources = uploaded_files or ([path] if path is not None else [])
+    if not sources:
         return pd.DataFrame()
-    
-    df["ts"] = pd.to_datetime(df["ts"], utc=True, errors="coerce")
-    df = df.dropna(subset=["ts"])
-    df["ms_played"] = pd.to_numeric(df["ms_played"], errors="coerce").fillna(0).astype(int)
-    df["skipped"] = df["skipped"].apply(_to_bool)
-    df["artist_popularity"] = pd.to_numeric(df["artist_popularity"], errors="coerce")
-    df["date"] = df["ts"].dt.date
-    df["year"] = df["ts"].dt.year
-    df["month"] = df["ts"].dt.to_period("M").astype(str)
-    df["dow"] = df["ts"].dt.dayofweek
-    df["hour"] = df["ts"].dt.hour
-    df["start_ts"] = df["ts"] - pd.to_timedelta(df["ms_played"], unit="ms")
-    
-    for c in ["master_metadata_track_name", "master_metadata_album_artist_name",
-              "master_metadata_album_album_name", "genre_bucket", "artist_genres"]:
-        if c in df.columns:
-            df[c] = df[c].apply(clean_string)
-    
-    df["track_id"] = df.apply(
-        lambda r: f"{r['master_metadata_album_artist_name']}§{r['master_metadata_track_name']}"
-        if r.get('master_metadata_track_name') and r.get('master_metadata_album_artist_name') else None, axis=1)
+    # Large exports are parsed in chunks and several files in parallel; show how far
+    # along we are under the spinner
+    progress_bar = st.empty()
+    df = load_exports(sources, progress=lambda frac: progress_bar.progress(
+        frac, text=f"Parsing listening history… {frac:.0%}"))
+    progress_bar.empty()
     return df
 
+@st.cache_data(show_spinner="Loading streaming history…")
+def load_history(uploaded_files):
+    """Raw Spotify extended-history JSON files (or zips of them), parsed in parallel."""
+    return load_history_json(uploaded_files)
+
+@st.cache_data(show_spinner="Loading saved history…")
+def load_profile(store_key, version):
+    """Plays and first-listen tables of a saved history; `version` (see `store_version`)
+    changes on every append, so the cached copy is replaced only when new rows arrive."""
+    return load_store(store_key)
+
 def measure_value(df, measure):
     return pd.Series(np.ones(len(df)), index=df.index) if measure == "Streams" else df["ms_played"] / 60000
 
+def cell_measure(cells, measure):
+    """`measure_value` for tables whose rows hold many plays each (rollup cube, top totals)."""
+    return cells["streams"].astype(float) if measure == "Streams" else cells["ms_played"] / 60000
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def rollup_cube(version, _df):
+    """Rollup cube of a loaded dataset: built once per dataset version, shared by reruns."""
+    return RollupCube(_df)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def first_seen_index(version, _df, _first_tables=None):
+    """First-seen index of a loaded dataset (from its saved first-listen tables when it
+    has them): built once per dataset version, shared by reruns."""
+    return FirstSeenIndex(_df, *(_first_tables or first_listen_tables(_df)))
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def artist_days(version, _df):
+    """Day bitmaps of a loaded dataset's artists: built once per dataset version."""
+    return day_bitmaps(_df)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def session_index(version, gap_minutes, _df):
+    """Sessions of a loaded dataset for one inactivity gap, by start day: sessionized once
+    per (dataset version, gap) over the whole history and sliced per range."""
+    return DayIndex(sessionize(_df, gap_minutes))
+
+def monthly_totals(data, spec, measure, kind):
+    """Totals of `measure` per (month, entity) over the days of `spec`, for `MonthlyRanks`:
+    "artists" from the cube's artist view, "tracks" (by `track_id`) from the plays."""
+    if kind == "artists":
+        cells = data.cube_in(spec).by("master_metadata_album_artist_name")
+        return (cell_measure(cells, measure)
+                .groupby([cells["month"], cells["master_metadata_album_artist_name"]], observed=True).sum())
+    plays = data.plays_in(spec)
+    return measure_value(plays, measure).groupby([plays["month"], plays["track_id"]]).sum()
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def monthly_ranks(version, measure, _data):
+    """Monthly artist and track (`track_id`) rankings of a loaded dataset by `measure`:
+    built once per (dataset version, measure), shared by the rank sparklines."""
+    plays = _data.plays
+    history = FilterSpec(int(plays["day"].iloc[0]), int(plays["day"].iloc[-1]))
+    return {kind: MonthlyRanks(monthly_totals(_data, history, measure, kind)) for kind in ("artists", "tracks")}
+
+def rank_series(data, measure, kind, entity, spec):
+    """(months, totals, ranks) of `entity` in each month of `spec`'s range, ranked on the
+    plays in the range. Whole months come from the cached `monthly_ranks`; a first or
+    last month the range covers only in part is ranked on its days in the range."""
+    def month_start(m):
+        return to_day(date(m // 12, m % 12 + 1, 1))
+
+    def ranked_on(part_first, part_last):
+        if part_first > part_last: return None
+        totals = monthly_totals(data, FilterSpec(part_first, part_last), measure, kind)
+        return MonthlyRanks(totals).series(entity, *months) if len(totals) else None
+
+    first, last = from_day(spec.first), from_day(spec.last)
+    months = month_index(first), month_index(last)
+    whole_first = months[0] + (first.day > 1)
+    whole_last = months[1] - ((last + timedelta(days=1)).day > 1)
+    head = ranked_on(spec.first, min(spec.last, month_start(whole_first) - 1))
+    tail = ranked_on(max(spec.first, month_start(whole_first), month_start(whole_last + 1)), spec.last)
+    whole = monthly_ranks(data.version, measure, data)[kind].series(entity, whole_first, whole_last)
+    parts = [p for p in (head, whole, tail) if p is not None]
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+class FigureCache:
+    """Finished Plotly figures by key, each sized by its JSON; once they add up to more
+    than `max_bytes`, the least recently used are dropped. Shared by every session, so a
+    figure is never modified after it is stored."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._figures = OrderedDict()  # key -> (figure or None, JSON bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """The figure stored under `key`, or `build()`'s (None when there is nothing to
+        draw), stored for next time."""
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                return self._figures[key][0]
+        fig = build()
+        nbytes = 0 if fig is None else len(fig.to_json())
+        with self._lock:
+            if key not in self._figures:
+                self._figures[key] = (fig, nbytes)
+                self.size += nbytes
+            while self.size > self.max_bytes and len(self._figures) > 1:
+                _, (_, dropped) = self._figures.popitem(last=False)
+                self.size -= dropped
+        return fig
+
+FIGURE_CACHE_BYTES = 64 * 2**20
+
+@st.cache_resource(show_spinner=False)
+def figure_cache():
+    """Figures of every panel, shared by all sessions and reruns (see `cached_figure`)."""
+    return FigureCache(FIGURE_CACHE_BYTES)
+
+# Cached computations take a Dataset and a FilterSpec; the dataset is keyed on its version
+# so that a cache lookup never hashes the play frame
+DATASET_KEY = {Dataset: lambda data: data.version}
+
 def fmt_number(n):
     try:
         if abs(n) >= 1e6: return f"{n/1e6:.1f}M"
@@ -385,6 +496,25 @@ def fmt_number(n):
         return f"{int(n):,}" if float(n).is_integer() else f"{n:.1f}"
     except: return str(n)
 
+def distinct_counts(period_cube, period_plays, exact):
+    """(tracks, artists, albums) played in a period: exact counts over its plays, or
+    HyperLogLog estimates merged from the cube's per-day sketches."""
+    if exact:
+        return (period_plays["track_id"].dropna().nunique(),
+                period_plays["master_metadata_album_artist_name"].dropna().nunique(),
+                period_plays["master_metadata_album_album_name"].dropna().nunique())
+    return tuple(period_cube.distinct(name) for name in ("tracks", "artists", "albums"))
+
+def kpi_delta(current, previous, period):
+    """Change vs the previous period as a KPI-card line ('' if that period had no data)."""
+    if not previous:
+        return ""
+    change = (current - previous) / previous * 100
+    if abs(change) < 0.5:
+        return f'<div class="kpi-delta">≈ same as previous {period}</div>'
+    arrow, cls = ("▲", "up") if change > 0 else ("▼", "down")
+    return f'<div class="kpi-delta {cls}">{arrow} {abs(change):.0f}% vs previous {period}</div>'
+
 def fmt_hours(minutes):
     """Format minutes as Xh Ym for readability."""
     h = int(minutes // 60)
@@ -393,117 +523,58 @@ def fmt_hours(minutes):
         return f"{h}h {m}m"
     return f"{m}m"
 
-@st.cache_data
-def compute_discovery(df_full, df_filtered):
-    first_artist = df_full.dropna(subset=["master_metadata_album_artist_name"]).groupby("master_metadata_album_artist_name")["ts"].min()
-    first_track = df_full.dropna(subset=["track_id"]).groupby("track_id")["ts"].min()
-    period_start = df_filtered["ts"].min()
-    period_end = df_filtered["ts"].max()
-    new_artists = first_artist[(first_artist >= period_start) & (first_artist <= period_end)]
-    new_tracks = first_track[(first_track >= period_start) & (first_track <= period_end)]
-    period_artists = df_filtered["master_metadata_album_artist_name"].dropna().nunique()
+@st.cache_data(hash_funcs=DATASET_KEY)
+def compute_discovery(data, spec):
+    df_filtered = data.plays_in(spec)
+    # Plays are in ts order, so the period starts at the first row and ends at the last
+    new_artists, new_tracks = data.first_seen.first_heard(df_filtered["ts"].iloc[0], df_filtered["ts"].iloc[-1])
+    period_artists = data.cube_in(spec).by("master_metadata_album_artist_name")["master_metadata_album_artist_name"].nunique()
     period_tracks = df_filtered["track_id"].dropna().nunique()
-    pct_new_artists = (len(new_artists) / period_artists * 100) if period_artists > 0 else 0
-    pct_new_tracks = (len(new_tracks) / period_tracks * 100) if period_tracks > 0 else 0
-    return pct_new_artists, pct_new_tracks, len(new_artists), len(new_tracks)
-
-@st.cache_data
-def compute_old_vs_new_monthly(df_full, start_date, end_date):
-    df_clean = df_full.dropna(subset=["track_id"]).copy()
-    if len(df_clean) == 0: return pd.DataFrame()
-    first_listen = df_clean.groupby("track_id")["ts"].min().reset_index()
-    first_listen.columns = ["track_id", "first_listen_ts"]
-    first_listen["first_listen_month"] = pd.to_datetime(first_listen["first_listen_ts"]).dt.to_period("M").astype(str)
-    track_months = df_clean.groupby(["month", "track_id"]).size().reset_index(name="play_count")
-    track_months = track_months.merge(first_listen[["track_id", "first_listen_month"]], on="track_id")
-    track_months["is_new"] = track_months["month"] == track_months["first_listen_month"]
-    monthly_counts = track_months.groupby(["month", "is_new"]).agg(unique_tracks=("track_id", "nunique")).reset_index()
-    pivot = monthly_counts.pivot(index="month", columns="is_new", values="unique_tracks").fillna(0)
-    if False in pivot.columns and True in pivot.columns:
-        pivot.columns = ["Revisited tracks", "New discoveries"]
-    elif True in pivot.columns:
-        pivot.columns = ["New discoveries"]
-        pivot["Revisited tracks"] = 0
-    elif False in pivot.columns:
-        pivot.columns = ["Revisited tracks"]
-        pivot["New discoveries"] = 0
-    pivot = pivot.reset_index()
-    start_month = pd.Timestamp(start_date).to_period("M").strftime("%Y-%m")
-    end_month = pd.Timestamp(end_date).to_period("M").strftime("%Y-%m")
-    pivot = pivot[(pivot["month"] >= start_month) & (pivot["month"] <= end_month)]
-    return pivot
-
-@st.cache_data
-def compute_genre_evolution(df_filtered, measure="Minutes"):
-    """Compute genre proportions over time for the stream-graph."""
-    gdf = df_filtered.dropna(subset=["genre_bucket"]).copy()
+    pct_new_artists = (new_artists / period_artists * 100) if period_artists > 0 else 0
+    pct_new_tracks = (new_tracks / period_tracks * 100) if period_tracks > 0 else 0
+    return pct_new_artists, pct_new_tracks, new_artists, new_tracks, period_artists, period_tracks
+
+@st.cache_data(hash_funcs=DATASET_KEY)
+def compute_old_vs_new_monthly(data, start_date, end_date):
+    months, new, revisited = data.first_seen.monthly_tracks(month_index(start_date), month_index(end_date))
+    if len(months) == 0: return pd.DataFrame()
+    return pd.DataFrame({"month": months, "Revisited tracks": revisited, "New discoveries": new})
+
+@st.cache_data(hash_funcs=DATASET_KEY)
+def compute_genre_evolution(data, spec, measure="Minutes"):
+    """Compute genre proportions over time for the stream-graph (from the day × genre rollup)."""
+    cells = data.cube_in(spec).by("genre_bucket")
+    gdf = cells.dropna(subset=["genre_bucket"])
     if len(gdf) == 0: return pd.DataFrame()
-    if measure == "Minutes":
-        gdf["val"] = gdf["ms_played"] / 60000
-    else:
-        gdf["val"] = 1  # count streams
-    monthly = gdf.groupby(["month", "genre_bucket"], as_index=False)["val"].sum()
+    monthly = (cell_measure(gdf, measure).rename("val")
+               .groupby([gdf["month"], gdf["genre_bucket"]], observed=True).sum().reset_index())
     pivot = monthly.pivot(index="month", columns="genre_bucket", values="val").fillna(0)
+    pivot.columns = pivot.columns.astype(str)
     for g in GENRE_ORDER:
         if g not in pivot.columns:
             pivot[g] = 0
     pivot = pivot[GENRE_ORDER].reset_index()
     return pivot
 
-@st.cache_data
-def sessionize(df, gap_minutes=15):
-    if len(df) == 0: return df
-    d = df.sort_values("start_ts").copy()
-    gap = pd.Timedelta(minutes=gap_minutes)
-    prev_end = d["ts"].shift(1)
-    new_session = (d["start_ts"] - prev_end) > gap
-    d["session_id"] = new_session.cumsum().fillna(0).astype(int)
-    session_len = d.groupby("session_id")["ms_played"].sum() / 60000
-    d["session_minutes"] = d["session_id"].map(session_len)
-    return d
-
-@st.cache_data
-def compute_streaks(df_filtered):
-    """Compute the longest listening streak (consecutive days)."""
-    dates_active = sorted(df_filtered["date"].unique())
-    if len(dates_active) == 0: return 0, 0
-    max_streak = 1; current_streak = 1
-    for i in range(1, len(dates_active)):
-        if (dates_active[i] - dates_active[i-1]).days == 1:
-            current_streak += 1
-            max_streak = max(max_streak, current_streak)
-        else:
-            current_streak = 1
-    return max_streak, current_streak
-
-@st.cache_data
-def compute_bump_chart(df_filtered, measure="Streams", top_n=10):
-    """Compute monthly rankings for top artists — for a bump (F1-style) chart."""
-    adf = df_filtered.dropna(subset=["master_metadata_album_artist_name"]).copy()
-    if len(adf) == 0:
-        return pd.DataFrame()
-    if measure == "Minutes":
-        adf["val"] = adf["ms_played"] / 60000
-    else:
-        adf["val"] = 1
-    monthly = adf.groupby(["month", "master_metadata_album_artist_name"], as_index=False)["val"].sum()
-    # Determine top N artists overall
-    top_artists = monthly.groupby("master_metadata_album_artist_name")["val"].sum().nlargest(top_n).index.tolist()
-    monthly = monthly[monthly["master_metadata_album_artist_name"].isin(top_artists)]
-    # Rank per month (1 = best)
-    monthly["rank"] = monthly.groupby("month")["val"].rank(ascending=False, method="min").astype(int)
-    return monthly
-
-def bins_session_minutes(x):
-    """Finer session bins based on peer feedback."""
-    if x < 15: return "<15m"
-    if x < 30: return "15–30m"
-    if x < 60: return "30m–1h"
-    if x < 120: return "1–2h"
-    if x < 240: return "2–4h"
-    return "4h+"
-
+def compute_streaks(data, spec, top_n=3):
+    """Longest and current (most recent) listening streaks in days, and the `top_n`
+    longest as (first date, last date, days), from the cube's runs of active days."""
+    starts, lengths = data.cube_in(spec).runs()
+    if len(lengths) == 0: return 0, 0, []
+    top = np.argsort(-lengths, kind="stable")[:top_n]
+    return (int(lengths.max()), int(lengths[-1]),
+            [(from_day(starts[i]), from_day(starts[i] + lengths[i] - 1), int(lengths[i])) for i in top])
+
+# Finer session bins based on peer feedback: upper edges in minutes, then labels
+SESSION_BIN_EDGES = [15, 30, 60, 120, 240]
 SESSION_BIN_ORDER = ["<15m", "15–30m", "30m–1h", "1–2h", "2–4h", "4h+"]
+SESSION_GAPS = [5, 10, 15, 30, 60]
+
+# Calendar heatmap granularity: a cell per day for ranges of up to this many days, then
+# per ISO week up to the second limit, then per month
+CALENDAR_DAILY_MAX_DAYS = 5 * 366
+CALENDAR_WEEKLY_MAX_DAYS = 20 * 366
+CALENDAR_PERIODS = {"day": "Daily", "week": "Weekly", "month": "Monthly"}
 
 # ----------------------------
 # Life Events System
@@ -642,32 +713,74 @@ with filter_col1:
     selected_time = st.radio("Time", time_options, index=4, horizontal=True, label_visibility="collapsed")
 
 with filter_col4:
-    fc4a, fc4b = st.columns(2)
-    with fc4a:
-        use_demo = st.checkbox("Demo data", value=True)
-    with fc4b:
-        show_events = st.checkbox("Life events", value=False)
+    use_demo = st.checkbox("Demo data", value=True)
     if not use_demo:
-        uploaded_file = st.file_uploader("Music CSV", type=["csv"], label_visibility="collapsed")
+        uploaded_files = st.file_uploader("Music CSV", type=["csv", "json", "zip"], accept_multiple_files=True,
+                                          label_visibility="collapsed",
+                                          help="One or more enriched CSVs, or Spotify's Streaming_History_Audio_*.json files (or the zip they came in)")
+        append_mode = st.checkbox("Save & append", value=False,
+                                  help="Keep uploads in a saved history; newer exports only add the plays after the last saved one")
+        if append_mode:
+            # A saved history is opened by a random key, shown once when it is created
+            if st.button("New saved history", help="Start a saved history and get the key that opens it"):
+                st.session_state["store_key"] = new_store_key()
+                st.session_state["show_store_key"] = True
+            store_key = st.text_input("Key", key="store_key", type="password", label_visibility="collapsed",
+                                      placeholder="Saved-history key",
+                                      help="The key your saved history was created with")
+            if st.session_state.pop("show_store_key", False):
+                st.warning("Your saved history's key. Copy it now: it is not shown again, "
+                           "and nobody can recover the history without it.")
+                st.code(store_key, language=None)
         events_file = st.file_uploader("Life events CSV", type=["csv"], label_visibility="collapsed",
                                        help="Columns: start_date, end_date, label, category (semester/exam/travel/personal)")
     else:
-        uploaded_file = None
+        uploaded_files = []
         events_file = None
+        append_mode = False
 
 try:
+    first_tables = None
     if use_demo:
         df = load_csv(path="music_data.csv")
-    elif uploaded_file:
-        df = load_csv(uploaded_file=uploaded_file)
+    elif append_mode:
+        if not store_key:
+            st.info("🔑 Enter the key of your saved history, or start a new one.")
+            st.stop()
+        # Files stay in the uploader across reruns: append each set of uploads once
+        upload_set = (store_key, tuple(f.file_id for f in uploaded_files))
+        if uploaded_files and st.session_state.get("appended_uploads") != upload_set:
+            with st.spinner("Adding new plays to the saved history…"):
+                added = append_to_store(store_key, uploaded_files)
+            st.session_state["appended_uploads"] = upload_set
+            if added:
+                st.toast(f"Added {added:,} new plays to your saved history.")
+        df, *first_tables = load_profile(store_key, store_version(store_key))
+        if len(df) == 0:
+            st.info("📂 Nothing saved under this key yet — upload an export to start it.")
+            st.stop()
+    elif uploaded_files:
+        csv_files = [f for f in uploaded_files if f.name.lower().endswith(".csv")]
+        if csv_files:
+            if len(csv_files) < len(uploaded_files):
+                st.caption("CSV and JSON uploads can't be combined — using the CSV files only.")
+            df = load_csv(uploaded_files=csv_files)
+        else:
+            df = load_history(uploaded_files)
     else:
-        st.info("📂 Upload your enriched Spotify CSV or enable demo data to explore.")
+        st.info("📂 Upload your enriched Spotify CSV or your Streaming_History_Audio JSON files, or enable demo data to explore.")
         st.stop()
 except Exception as e:
     st.error(f"Error loading data: {e}")
     st.stop()
 
-min_date, max_date = df["date"].min(), df["date"].max()
+if df.attrs.get("duplicates_dropped"):
+    st.caption(f"Skipped {df.attrs['duplicates_dropped']:,} duplicate plays (same time, track and duration).")
+
+min_date, max_date = from_day(df["day"].min()), from_day(df["day"].max())
+version = df.attrs["version"]
+data = Dataset(df, version, first_seen_index(version, df, first_tables), rollup_cube(version, df),
+               artist_days(version, df))
 
 with filter_col2:
     today = max_date
@@ -686,116 +799,155 @@ with filter_col2:
     start_date, end_date = (date_range[0], date_range[1]) if len(date_range) == 2 else (default_start, default_end)
 
 with filter_col3:
-    measure = st.selectbox("Measure", ["Streams", "Minutes"], label_visibility="collapsed")
+    exact_counts = st.toggle("Exact", value=False,
+                             help="Count unique tracks, artists and albums exactly. Off, they are "
+                                  "HyperLogLog estimates (typically within ±5%), which stay fast on long ranges.")
 
-mask = (df["date"] >= start_date) & (df["date"] <= end_date)
-df_f = df[mask].copy()
+# Frames come back sorted by ts, so the date range is a binary-searched row slice (a
+# read-only view of df). Sums and per-day/hour/genre/artist breakdowns come from the
+# rollup cube instead.
+spec = FilterSpec(to_day(start_date), to_day(end_date))
+df_f = data.plays_in(spec)
+cube_f = data.cube_in(spec)
 
 if len(df_f) == 0:
     st.warning("No data in the selected range.")
     st.stop()
 
 # ----------------------------
-# Life Events loading
+# Life Events source
 # ----------------------------
-if show_events:
-    if use_demo:
-        events_df = load_events(path="life_events.csv")
-    elif events_file:
-        events_df = load_events(uploaded_file=events_file)
-    else:
-        events_df = pd.DataFrame()
+# Loaded by the charts over time when their overlay is switched on (see `over_time`)
+if use_demo:
+    events_source = {"path": "life_events.csv"}
 else:
-    events_df = pd.DataFrame()
+    events_source = {"uploaded_file": events_file} if events_file else None
 
 # ====================================================
 # KPI ROW
 # ====================================================
-total_streams = len(df_f)
-total_minutes = df_f["ms_played"].sum() / 60000
+# The equally long period just before the range, for the KPI deltas. When it runs past
+# the start of the history there is no like-for-like comparison, so it is left empty.
+first_day, last_day = to_day(start_date), to_day(end_date)
+n_days = last_day - first_day + 1
+prev_first, prev_last = first_day - n_days, first_day - 1
+if prev_first < to_day(min_date):
+    prev_last = prev_first - 1
+prev_spec = FilterSpec(prev_first, prev_last)
+prev_cube = data.cube_in(prev_spec)
+prev_totals = prev_cube.totals
+prev_period = f"{n_days} days"
+
+# Totals are prefix-sum lookups on the cube
+total_streams = int(cube_f.total("streams"))
+total_minutes = cube_f.total("ms_played") / 60000
 total_hours = total_minutes / 60
-n_tracks = df_f["track_id"].dropna().nunique()
-n_artists = df_f["master_metadata_album_artist_name"].dropna().nunique()
-n_albums = df_f["master_metadata_album_album_name"].dropna().nunique()
-avg_skip_time = df_f[df_f["skipped"]]["ms_played"].mean() / 1000 if df_f["skipped"].any() else 0
-max_streak, current_streak = compute_streaks(df_f)
+n_tracks, n_artists, n_albums = distinct_counts(cube_f, df_f, exact_counts)
+prev_tracks, prev_artists, prev_albums = distinct_counts(
+    prev_cube, data.plays_in(prev_spec), exact_counts)
+total_skips = cube_f.total("skips")
+avg_skip_time = cube_f.total("skip_ms") / total_skips / 1000 if total_skips else 0
+prev_skip_time = prev_totals["skip_ms"] / prev_totals["skips"] / 1000 if prev_totals["skips"] else 0
+max_streak, current_streak, top_streaks = compute_streaks(data, spec)
+prev_streak, _, _ = compute_streaks(data, prev_spec)
+streak_tip = "Longest streaks:&#10;" + "&#10;".join(
+    f"{days} days · {first:%b %d, %Y} → {last:%b %d, %Y}" for first, last, days in top_streaks)
+count_note = "" if exact_counts else "≈ "
 
 st.markdown(f"""
 <div class="kpi-container">
     <div class="kpi-card">
         <div class="kpi-label">Streams</div>
         <div class="kpi-value">{fmt_number(total_streams)}</div>
-        <div class="kpi-trend">total plays</div>
+        <div class="kpi-trend">total plays</div>{kpi_delta(total_streams, prev_totals["streams"], prev_period)}
     </div>
     <div class="kpi-card">
         <div class="kpi-label">Listening Time</div>
         <div class="kpi-value">{total_hours:,.0f}<span style="font-size:0.9rem;color:{SPOTIFY['text_muted']};"> hrs</span></div>
-        <div class="kpi-trend">{total_minutes:,.0f} minutes</div>
+        <div class="kpi-trend">{total_minutes:,.0f} minutes</div>{kpi_delta(cube_f.total("ms_played"), prev_totals["ms_played"], prev_period)}
     </div>
     <div class="kpi-card">
         <div class="kpi-label">Unique Tracks</div>
         <div class="kpi-value">{fmt_number(n_tracks)}</div>
-        <div class="kpi-trend">distinct songs</div>
+        <div class="kpi-trend">{count_note}distinct songs</div>{kpi_delta(n_tracks, prev_tracks, prev_period)}
     </div>
     <div class="kpi-card">
         <div class="kpi-label">Artists</div>
         <div class="kpi-value">{fmt_number(n_artists)}</div>
-        <div class="kpi-trend">discovered</div>
+        <div class="kpi-trend">{count_note}discovered</div>{kpi_delta(n_artists, prev_artists, prev_period)}
     </div>
     <div class="kpi-card">
         <div class="kpi-label">Albums</div>
         <div class="kpi-value">{fmt_number(n_albums)}</div>
-        <div class="kpi-trend">explored</div>
+        <div class="kpi-trend">{count_note}explored</div>{kpi_delta(n_albums, prev_albums, prev_period)}
     </div>
     <div class="kpi-card">
         <div class="kpi-label">Skip Time</div>
         <div class="kpi-value">{avg_skip_time:.1f}<span style="font-size:0.9rem;color:{SPOTIFY['text_muted']};"> sec</span></div>
-        <div class="kpi-trend">avg before skip</div>
+        <div class="kpi-trend">avg before skip</div>{kpi_delta(avg_skip_time, prev_skip_time, prev_period)}
     </div>
-    <div class="kpi-card">
+    <div class="kpi-card" title="{streak_tip}">
         <div class="kpi-label">Best Streak</div>
         <div class="kpi-value">{max_streak}<span style="font-size:0.9rem;color:{SPOTIFY['text_muted']};"> days</span></div>
-        <div class="kpi-trend">consecutive listening</div>
+        <div class="kpi-trend">consecutive listening</div>{kpi_delta(max_streak, prev_streak, prev_period)}
     </div>
 </div>
 """, unsafe_allow_html=True)
 
 # ====================================================
-# ADAPTIVE LAYOUT — changes based on time range
+# DASHBOARD — everything below the KPI row
 # ====================================================
+# The panels are drawn by fragments (`st.fragment`): a widget inside one reruns only that
+# fragment, with the arguments it was last called with, instead of the whole script. The
+# measure and a heatmap selection redraw the dashboard but not the data load or KPI row, the
+# session gap only the Sessions panel, the life-events toggle only the charts over time.
+# Builders take everything they draw from as arguments and declare it as their cache key.
 is_lifetime = selected_time == "Lifetime"
 
-# ── Shared computations ──
-# Listening Clock data
-by_hour = df_f.copy()
-by_hour["m"] = measure_value(by_hour, measure)
-hour_agg = by_hour.groupby("hour", as_index=False)["m"].sum()
-hour_mins = by_hour.groupby("hour", as_index=False)["ms_played"].agg(total_minutes=lambda s: s.sum() / 60000)
-hour_agg = pd.DataFrame({"hour": range(24)}).merge(hour_agg, on="hour", how="left").fillna(0)
-hour_agg = hour_agg.merge(hour_mins, on="hour", how="left").fillna(0)
-
-# Heatmap data
-daily = df_f.groupby("date", as_index=False).agg(
-    streams=("ts", "count"), minutes=("ms_played", lambda s: s.sum()/60000))
-daily["value"] = daily["streams"] if measure == "Streams" else daily["minutes"]
-all_dates = pd.date_range(start=start_date, end=end_date, freq='D')
-
-# Use ISO week numbering to avoid year-boundary gaps
-_iso = all_dates.isocalendar()
-full_grid = pd.DataFrame({
-    'date': all_dates.date,
-    'week': [f"{y}-W{w:02d}" for y, w in zip(_iso.year, _iso.week)],
-    'dow': all_dates.dayofweek,
-    'month_label': all_dates.strftime("%b %y"),
-})
-full_grid = full_grid.merge(daily[['date', 'value', 'minutes']], on='date', how='left').fillna(0)
-day_names = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-full_grid["day_name"] = full_grid["dow"].apply(lambda x: day_names[x])
-full_grid["date_str"] = full_grid["date"].astype(str)
-grid_dates = full_grid["date"].tolist()
+def timed_fragment(name):
+    """`st.fragment` that times each run of the decorated panel function. The last run's
+    milliseconds are kept in `st.session_state["render_ms"][name]`, and shown under the
+    panel when the page is opened with `?timings`.
+
+    Streamlit (1.37) keeps the closure of a fragment's first call, arguments included,
+    and replays it on every rerun of the fragment, so a rerun would draw the range, data
+    and options of that first call. Each call therefore files its arguments under
+    `st.session_state["fragment_args"][name]` and the fragment reads them from there:
+    a fragment rerun gets those of the latest full run (or of the latest run of the
+    fragment it is nested in)."""
+    def decorate(func):
+        @wraps(func)
+        def timed():
+            args, kwargs = st.session_state["fragment_args"][name]
+            started = time.perf_counter()
+            func(*args, **kwargs)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            st.session_state.setdefault("render_ms", {})[name] = elapsed_ms
+            if "timings" in st.query_params:
+                st.caption(f"⏱ {name}: {elapsed_ms:,.0f} ms")
+        fragment = st.fragment(timed)
+
+        @wraps(func)
+        def call(*args, **kwargs):
+            st.session_state.setdefault("fragment_args", {})[name] = (args, kwargs)
+            fragment()
+        return call
+    return decorate
+
+def cached_figure(panel, build, *inputs):
+    """A panel's figure from the shared figure cache, built by `build()` on a miss. Keyed by
+    the panel and the `inputs` it is drawn from (dataset version, filter, measure, ...), which
+    each call lists for itself."""
+    return figure_cache().get((panel, *inputs), build)
 
 # ── Reusable chart builders ──
-def _build_clock_fig():
+def hour_totals(cube, measure):
+    """Listening Clock data: `measure` and minutes played per hour of the day."""
+    by_hour = cube.by("hour").groupby("hour")[["streams", "ms_played"]].sum().reindex(range(24), fill_value=0)
+    return pd.DataFrame({"hour": range(24), "m": cell_measure(by_hour, measure).to_numpy(),
+                         "total_minutes": by_hour["ms_played"].to_numpy() / 60000})
+
+def _build_clock_fig(hour_agg, measure):
     fig = go.Figure(go.Barpolar(
         r=hour_agg["m"], theta=hour_agg["hour"] * 15, width=[14] * 24,
         marker_color=SPOTIFY["green"], marker_line_color=SPOTIFY["green_light"], marker_line_width=1, opacity=0.85,
@@ -821,51 +973,117 @@ def _build_clock_fig():
     )
     return style_fig(fig, height=220)
 
-def _build_sessions_fig():
-    df_s = sessionize(df_f, gap_minutes=15)
-    if len(df_s) == 0: return None
-    sess = df_s.groupby("session_id", as_index=False).agg(session_minutes=("session_minutes", "first"))
-    sess["bin"] = sess["session_minutes"].apply(bins_session_minutes)
-    sess_bins = sess.groupby("bin", as_index=False).size().rename(columns={"size": "sessions"})
-    sess_bins["bin"] = pd.Categorical(sess_bins["bin"], categories=SESSION_BIN_ORDER, ordered=True)
-    sess_bins = sess_bins.sort_values("bin")
+def _build_sessions_fig(data, spec, gap_minutes=15):
+    sessions = spec.slice(session_index(data.version, gap_minutes, data.plays))
+    if len(sessions) == 0: return None
+    counts = np.bincount(np.searchsorted(SESSION_BIN_EDGES, sessions["minutes"].to_numpy(), side="right"),
+                         minlength=len(SESSION_BIN_ORDER))
+    sess_bins = pd.DataFrame({"bin": SESSION_BIN_ORDER, "sessions": counts})
+    sess_bins = sess_bins[sess_bins["sessions"] > 0]
     fig = px.bar(sess_bins, x="bin", y="sessions", color_discrete_sequence=[SPOTIFY["green"]])
     fig.update_traces(
         marker_line_color=SPOTIFY["green_light"], marker_line_width=1,
         hovertemplate="<b>%{x}</b><br>%{y} sessions<extra></extra>"
     )
     fig.update_layout(xaxis_title="Duration", yaxis_title="Sessions")
-    return fig
+    return style_fig(fig, height=220)
 
-def _build_heatmap_fig(cal_height=220):
+@timed_fragment("sessions")
+def sessions_panel(data, spec):
+    """Session-length histogram; moving its gap slider reruns only this panel."""
+    section_header("⏱️", "Sessions", "Listening session durations")
+    gap_minutes = st.select_slider("Session gap", SESSION_GAPS, value=15, key="session_gap",
+                                   format_func=lambda m: f"{m} min",
+                                   help="A session ends after this long without listening.")
+    # Sessions count plays, whatever the measure
+    sfig = cached_figure("sessions", lambda: _build_sessions_fig(data, spec, gap_minutes),
+                         data.version, spec, gap_minutes)
+    if sfig is not None:
+        st.plotly_chart(sfig, use_container_width=True, key="sessions", config=PLOTLY_CONFIG)
+
+def _pick_calendar_artist(top_totals):
+    """Artist whose days the heatmap shows instead of overall listening (None for all)."""
+    options = ["All listening", *top_totals.artists(50)["master_metadata_album_artist_name"]]
+    choice = st.selectbox("Calendar of", options, key="calendar_artist", label_visibility="collapsed",
+                          help="Show the days one of your top artists was played")
+    return None if choice == options[0] else choice
+
+def _build_rank_fig(series, fillcolor, hovertemplate):
+    """Compact rank-over-time sparkline of a `rank_series`, or None when it has fewer than
+    two months."""
+    months, _, ranks = series
+    if len(months) <= 1: return None
+    rank = pd.DataFrame({"month": month_labels(months), "rank": ranks})
+    _max_r = max(rank["rank"].max(), 4)
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=rank["month"], y=rank["rank"],
+        mode="lines+markers", fill="tozeroy",
+        line=dict(width=2, color=SPOTIFY["green"]),
+        marker=dict(size=4, color=SPOTIFY["green_light"]),
+        fillcolor=fillcolor,
+        hovertemplate=hovertemplate,
+    ))
+    fig.update_yaxes(autorange="reversed", title="", range=[0.5, _max_r + 0.5],
+                     tickmode="linear", dtick=max(1, _max_r // 3),
+                     gridcolor="rgba(64,64,64,0.15)",
+                     tickfont=dict(size=8, color=SPOTIFY["text_muted"]))
+    # Show ~5 x-axis ticks
+    _n_ticks = min(5, len(rank))
+    _step = max(1, len(rank) // _n_ticks)
+    _tick_idx = rank.iloc[::_step]
+    fig.update_xaxes(title="", tickmode="array",
+                     tickvals=_tick_idx["month"].tolist(),
+                     ticktext=[m[-5:] for m in _tick_idx["month"].tolist()],
+                     tickangle=-45, tickfont=dict(size=7, color=SPOTIFY["text_muted"]))
+    fig.update_layout(margin=dict(l=25, r=5, t=5, b=25),
+                      paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)")
+    return style_fig(fig, height=100)
+
+def _build_heatmap_fig(data, cube, calendar, measure, cal_height=220, artist=None):
+    # Hover text is formatted by Plotly from the cell's axis labels, so the figure carries
+    # only the value matrices, whatever the length of the range
+    where = {"day": "<b>%{y}</b> · week of %{x|%b %d, %Y}", "week": "<b>Week %{x}, %{y}</b>",
+             "month": "<b>%{x} %{y}</b>"}[calendar.mode]
+    daily = cube.by()
+    day_pos = daily["day"].to_numpy() - calendar.days[0]
+    customdata = None
+    if artist is None:
+        day_minutes = np.zeros(len(calendar.days))
+        day_minutes[day_pos] = daily["ms_played"].to_numpy() / 60000
+        if measure == "Streams":
+            day_streams = np.zeros(len(calendar.days))
+            day_streams[day_pos] = daily["streams"].to_numpy()
+            z, customdata = calendar.values(day_streams), calendar.values(day_minutes).round()
+            value_lines = "Streams: %{z:,.0f}<br>Time: %{customdata:,.0f} min"
+        else:
+            z, value_lines = calendar.values(day_minutes), "Minutes: %{z:,.0f}"
+    else:
+        # One artist's days, straight from its day bitmap
+        z = calendar.values(np.isin(calendar.days, data.artist_days.days(artist)))
+        value_lines = f"Days playing {artist}: " + "%{z}"
     fig_cal = go.Figure(go.Heatmap(
-        x=full_grid["week"], y=full_grid["dow"], z=full_grid["value"],
+        x=calendar.x, y=calendar.y, z=z, customdata=customdata,
         colorscale=[
             [0, SPOTIFY["bg_elevated"]], [0.15, "#0d3320"], [0.35, "#166534"],
             [0.6, "#22c55e"], [1, SPOTIFY["green_light"]]
         ],
-        showscale=True,
+        showscale=artist is None,
         colorbar=dict(
             thickness=8, len=0.9, y=0.5, yanchor="middle",
             tickfont=dict(size=8, color=SPOTIFY["text_muted"]),
             title=dict(text=measure, font=dict(size=8, color=SPOTIFY["text_muted"])),
             bgcolor="rgba(0,0,0,0)", borderwidth=0,
         ),
-        ygap=2, xgap=2,
-        hovertemplate=(
-            "<b>%{customdata[0]}</b> (%{customdata[1]})<br>"
-            + measure + ": %{z:,.0f}<br>"
-            "Time: %{customdata[2]}<extra></extra>"
-        ),
-        customdata=[[d, dn, fmt_hours(m)] for d, dn, m in zip(
-            full_grid["date_str"], full_grid["day_name"], full_grid["minutes"]
-        )]
+        ygap=2, xgap=2, hoverongaps=False,
+        hovertemplate=where + "<br>" + value_lines + "<extra></extra>",
     ))
-    fig_cal.update_yaxes(tickvals=list(range(7)), ticktext=day_names, autorange="reversed")
-    month_ticks = full_grid.drop_duplicates(subset=["month_label"], keep="first")
+    fig_cal.update_yaxes(type="category", autorange="reversed")
+    if calendar.mode == "day":
+        fig_cal.update_xaxes(type="date", tickformat="%b %y")
+    else:
+        fig_cal.update_xaxes(type="category")
     fig_cal.update_xaxes(
-        tickvals=month_ticks["week"].tolist(),
-        ticktext=month_ticks["month_label"].tolist(),
         showticklabels=True,
         tickfont=dict(size=8, color=SPOTIFY["text_muted"]),
         tickangle=-45,
@@ -873,15 +1091,13 @@ def _build_heatmap_fig(cal_height=220):
     fig_cal.update_layout(margin=dict(l=40, r=60, t=10, b=20), dragmode="select")
     return style_fig(fig_cal, height=cal_height)
 
-def _render_no1():
+def _render_no1(top_totals, df_f):
     section_header("👑", "No. 1 Artist", "Most played by listening time")
-    top_artist_df = (df_f.dropna(subset=["master_metadata_album_artist_name"])
-                     .groupby("master_metadata_album_artist_name")["ms_played"].sum()
-                     .sort_values(ascending=False))
+    top_artist_df = top_totals.artists(1)
     if len(top_artist_df) > 0:
-        artist_name = top_artist_df.index[0]
-        artist_streams = df_f[df_f['master_metadata_album_artist_name'] == artist_name].shape[0]
-        artist_mins = top_artist_df.iloc[0] / 60000
+        artist_name = top_artist_df["master_metadata_album_artist_name"].iloc[0]
+        artist_streams = top_artist_df["streams"].iloc[0]
+        artist_mins = top_artist_df["ms_played"].iloc[0] / 60000
         st.markdown(f"""<div class="top-item-card">
             <div class="rank-badge">🎧</div>
             <div style="flex:1;min-width:0;">
@@ -891,13 +1107,10 @@ def _render_no1():
         </div>""", unsafe_allow_html=True)
     
     section_header("🎵", "No. 1 Track", "Most played song")
-    top_track_df = (df_f.dropna(subset=["master_metadata_track_name", "master_metadata_album_artist_name"])
-                    .groupby(["master_metadata_track_name", "master_metadata_album_artist_name"])["ms_played"]
-                    .sum().sort_values(ascending=False))
+    top_track_df = top_totals.tracks(1)
     if len(top_track_df) > 0:
-        (track_name, track_artist) = top_track_df.index[0]
-        track_streams = df_f[(df_f['master_metadata_track_name'] == track_name) &
-                             (df_f['master_metadata_album_artist_name'] == track_artist)].shape[0]
+        (track_name,), (track_artist,) = decode_track_ids(df_f, top_track_df["track_id"])
+        track_streams = top_track_df["streams"].iloc[0]
         st.markdown(f"""<div class="top-item-card">
             <div class="rank-badge">🎧</div>
             <div style="flex:1;min-width:0;">
@@ -906,398 +1119,142 @@ def _render_no1():
             </div>
         </div>""", unsafe_allow_html=True)
 
-def _render_old_vs_new(chart_height=250):
-    section_header("🆕", "Old vs New", "Unique songs each month: first listens vs revisits")
-    old_new_data = compute_old_vs_new_monthly(df, start_date, end_date)
-    if len(old_new_data) > 0 and "Revisited tracks" in old_new_data.columns:
-        fig = go.Figure()
+def _build_old_vs_new_fig(data, start_date, end_date, events_df, chart_height=280):
+    old_new_data = compute_old_vs_new_monthly(data, start_date, end_date)
+    if len(old_new_data) == 0 or "Revisited tracks" not in old_new_data.columns: return None
+    old_new_data["month"] = month_labels(old_new_data["month"])
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=old_new_data["month"], y=old_new_data["Revisited tracks"],
+        name="Revisited", stackgroup="one",
+        line=dict(width=0.5, color=SPOTIFY["text_muted"]),
+        fillcolor="rgba(114,114,114,0.3)",
+        hovertemplate="<b>%{x}</b><br>Revisited: %{y} tracks<extra></extra>",
+    ))
+    if "New discoveries" in old_new_data.columns:
         fig.add_trace(go.Scatter(
-            x=old_new_data["month"], y=old_new_data["Revisited tracks"],
-            name="Revisited", stackgroup="one",
-            line=dict(width=0.5, color=SPOTIFY["text_muted"]),
-            fillcolor="rgba(114,114,114,0.3)",
-            hovertemplate="<b>%{x}</b><br>Revisited: %{y} tracks<extra></extra>",
+            x=old_new_data["month"], y=old_new_data["New discoveries"],
+            name="New discoveries", stackgroup="one",
+            line=dict(width=0.5, color=SPOTIFY["green"]),
+            fillcolor="rgba(29,185,84,0.4)",
+            hovertemplate="<b>%{x}</b><br>New: %{y} tracks<extra></extra>",
         ))
-        if "New discoveries" in old_new_data.columns:
-            fig.add_trace(go.Scatter(
-                x=old_new_data["month"], y=old_new_data["New discoveries"],
-                name="New discoveries", stackgroup="one",
-                line=dict(width=0.5, color=SPOTIFY["green"]),
-                fillcolor="rgba(29,185,84,0.4)",
-                hovertemplate="<b>%{x}</b><br>New: %{y} tracks<extra></extra>",
-            ))
-        fig.update_layout(xaxis_title="Month", yaxis_title="Unique tracks", hovermode="x unified")
-        if show_events and len(events_df) > 0:
-            fig = add_event_overlays(fig, events_df, start_date, end_date, axis_type="month")
-        st.plotly_chart(style_fig(fig, height=chart_height, show_legend=True), use_container_width=True, key="oldnew", config=PLOTLY_CONFIG)
-    else:
-        st.info("Not enough data for this view.")
+    fig.update_layout(xaxis_title="Month", yaxis_title="Unique tracks", hovermode="x unified")
+    if len(events_df) > 0:
+        fig = add_event_overlays(fig, events_df, start_date, end_date, axis_type="month")
+    return style_fig(fig, height=chart_height, show_legend=True)
 
 
-# ╔════════════════════════════════════════════════════╗
-# ║  LIFETIME LAYOUT — heatmap gets full width         ║
-# ╚════════════════════════════════════════════════════╝
-if is_lifetime:
-    # Row 1: Clock | Sessions | No.1 | Rank sparklines
-    col1, col2, col3, col4 = st.columns([1, 1, 1, 1.5])
-    
-    with col1:
-        section_header("🕐", "Listening Clock", "When you listen most")
-        st.plotly_chart(_build_clock_fig(), use_container_width=True, key="clock", config=PLOTLY_CONFIG)
-    
-    with col2:
-        section_header("⏱️", "Sessions", "Listening session durations")
-        sfig = _build_sessions_fig()
-        if sfig:
-            st.plotly_chart(style_fig(sfig, height=220), use_container_width=True, key="sessions", config=PLOTLY_CONFIG)
-    
-    with col3:
-        _render_no1()
-    
-    with col4:
-        # Two compact rank-over-time sparklines for the No.1 artist and track
-        # --- No.1 Artist rank over time ---
-        top_artist_df_lt = (df_f.dropna(subset=["master_metadata_album_artist_name"])
-                         .groupby("master_metadata_album_artist_name")["ms_played"].sum()
-                         .sort_values(ascending=False))
-        if len(top_artist_df_lt) > 0:
-            no1_artist = top_artist_df_lt.index[0]
-            adf = df_f.dropna(subset=["master_metadata_album_artist_name"]).copy()
-            adf["val"] = adf["ms_played"] / 60000 if measure == "Minutes" else 1
-            monthly_a = adf.groupby(["month", "master_metadata_album_artist_name"], as_index=False)["val"].sum()
-            monthly_a["rank"] = monthly_a.groupby("month")["val"].rank(ascending=False, method="min").astype(int)
-            artist_rank = monthly_a[monthly_a["master_metadata_album_artist_name"] == no1_artist].sort_values("month")
-            
-            if len(artist_rank) > 1:
-                st.caption("👑 **Artist rank over time**")
-                _max_r = max(artist_rank["rank"].max(), 4)
-                fig = go.Figure()
-                fig.add_trace(go.Scatter(
-                    x=artist_rank["month"], y=artist_rank["rank"],
-                    mode="lines+markers", fill="tozeroy",
-                    line=dict(width=2, color=SPOTIFY["green"]),
-                    marker=dict(size=4, color=SPOTIFY["green_light"]),
-                    fillcolor="rgba(29,185,84,0.15)",
-                    hovertemplate="<b>%{x}</b><br>Rank #%{y}<extra></extra>",
-                ))
-                fig.update_yaxes(autorange="reversed", title="", range=[0.5, _max_r + 0.5],
-                                 tickmode="linear", dtick=max(1, _max_r // 3),
-                                 gridcolor="rgba(64,64,64,0.15)",
-                                 tickfont=dict(size=8, color=SPOTIFY["text_muted"]))
-                # Show ~5 x-axis ticks
-                _n_ticks_a = min(5, len(artist_rank))
-                _step_a = max(1, len(artist_rank) // _n_ticks_a)
-                _tick_idx_a = artist_rank.iloc[::_step_a]
-                fig.update_xaxes(title="", tickmode="array",
-                                 tickvals=_tick_idx_a["month"].tolist(),
-                                 ticktext=[m[-5:] for m in _tick_idx_a["month"].tolist()],
-                                 tickangle=-45, tickfont=dict(size=7, color=SPOTIFY["text_muted"]))
-                fig.update_layout(margin=dict(l=25, r=5, t=5, b=25),
-                                  paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)")
-                st.plotly_chart(style_fig(fig, height=100), use_container_width=True,
-                                key="rank_artist", config=PLOTLY_CONFIG)
-        
-        # --- No.1 Track rank over time ---
-        top_track_df_lt = (df_f.dropna(subset=["master_metadata_track_name", "master_metadata_album_artist_name"])
-                        .groupby(["master_metadata_track_name", "master_metadata_album_artist_name"])["ms_played"]
-                        .sum().sort_values(ascending=False))
-        if len(top_track_df_lt) > 0:
-            (no1_track, no1_track_artist) = top_track_df_lt.index[0]
-            tdf = df_f.dropna(subset=["master_metadata_track_name"]).copy()
-            tdf["val"] = tdf["ms_played"] / 60000 if measure == "Minutes" else 1
-            monthly_t = tdf.groupby(["month", "master_metadata_track_name"], as_index=False)["val"].sum()
-            monthly_t["rank"] = monthly_t.groupby("month")["val"].rank(ascending=False, method="min").astype(int)
-            track_rank = monthly_t[monthly_t["master_metadata_track_name"] == no1_track].sort_values("month")
-            
-            if len(track_rank) > 1:
-                st.caption("🎵 **Track rank over time**")
-                _max_r_t = max(track_rank["rank"].max(), 4)
-                fig = go.Figure()
-                fig.add_trace(go.Scatter(
-                    x=track_rank["month"], y=track_rank["rank"],
-                    mode="lines+markers", fill="tozeroy",
-                    line=dict(width=2, color=SPOTIFY["green"]),
-                    marker=dict(size=4, color=SPOTIFY["green_light"]),
-                    fillcolor="rgba(29,185,84,0.1)",
-                    hovertemplate=f"<b>{no1_track}</b><br>" + "%{x}<br>Rank #%{y}<extra></extra>",
-                ))
-                fig.update_yaxes(autorange="reversed", title="", range=[0.5, _max_r_t + 0.5],
-                                 tickmode="linear", dtick=max(1, _max_r_t // 3),
-                                 gridcolor="rgba(64,64,64,0.15)",
-                                 tickfont=dict(size=8, color=SPOTIFY["text_muted"]))
-                _n_ticks_t = min(5, len(track_rank))
-                _step_t = max(1, len(track_rank) // _n_ticks_t)
-                _tick_idx_t = track_rank.iloc[::_step_t]
-                fig.update_xaxes(title="", tickmode="array",
-                                 tickvals=_tick_idx_t["month"].tolist(),
-                                 ticktext=[m[-5:] for m in _tick_idx_t["month"].tolist()],
-                                 tickangle=-45, tickfont=dict(size=7, color=SPOTIFY["text_muted"]))
-                fig.update_layout(margin=dict(l=25, r=5, t=5, b=25),
-                                  paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)")
-                st.plotly_chart(style_fig(fig, height=100), use_container_width=True,
-                                key="rank_track", config=PLOTLY_CONFIG)
+# ====================================================
+# Sunburst | Genre Treemap
+# ====================================================
+def _build_sunburst_fig(top_totals, df_f, measure):
+    top_by = "streams" if measure == "Streams" else "ms_played"
+    top3 = top_totals.track_artists(3, top_by)["master_metadata_album_artist_name"]
+    sun_totals = [top_totals.tracks(4, top_by, artist=artist) for artist in top3]
+    sun_totals = pd.concat(sun_totals, ignore_index=True) if sun_totals else top_totals.tracks(0)
+    sun_tracks, sun_artists = decode_track_ids(df_f, sun_totals["track_id"])
+    sun_agg = (pd.DataFrame({"master_metadata_album_artist_name": sun_artists,
+                             "master_metadata_track_name": sun_tracks, "m": cell_measure(sun_totals, measure)})
+               .sort_values("m", ascending=False, kind="stable")
+               .reset_index(drop=True))
+    if len(sun_agg) == 0: return None
     
-    # Row 2: Full-width heatmap (finally readable for lifetime!)
-    section_header("📅", "Commit-ment to Music", "Daily listening — drag-select days to filter the whole dashboard")
-    cal_event = st.plotly_chart(
-        _build_heatmap_fig(cal_height=180),
-        use_container_width=True, key="calendar",
-        on_select="rerun", selection_mode=["box", "points"], config=HEATMAP_CONFIG,
+    # Spotify-themed green palette
+    palette = ["#1DB954", "#15803D", "#166534"]
+    fig = px.sunburst(sun_agg, path=["master_metadata_album_artist_name", "master_metadata_track_name"],
+                      values="m", color="master_metadata_album_artist_name",
+                      color_discrete_sequence=palette)
+    fig.update_traces(
+        textinfo="label", insidetextorientation="radial",
+        hovertemplate="<b>%{label}</b><br>%{value:,.0f} " + measure.lower() + " (%{percentParent:.1%})<extra></extra>",
     )
+    fig.update_layout(margin=dict(l=5, r=5, t=5, b=5))
+    return style_fig(fig, height=320)
+
+def _build_treemap_fig(data, cube, measure):
+    # Totals per (genre, artist_genres) value from the cube, each split evenly over the
+    # value's subgenres via the cube's precomputed weight table
+    genre_cells = cube.by("genre_bucket", "artist_genres")
+    genre_cells = genre_cells[genre_cells["genre_bucket"].notna()]
+    combos = (cell_measure(genre_cells, measure)
+              .groupby([genre_cells["genre_bucket"], genre_cells["artist_genres"]], observed=True, dropna=False)
+              .sum().reset_index(name="m"))
+    rows, subgenres, weights = data.cube.subgenres.spread(combos["artist_genres"])
+    if len(rows) == 0: return None
     
-    # Row 3: Full-width Old vs New (with events)
-    _render_old_vs_new(chart_height=280)
-
-# ╔════════════════════════════════════════════════════╗
-# ║  FILTERED LAYOUT — compact with discovery cards    ║
-# ╚════════════════════════════════════════════════════╝
-else:
-    # Row 1: Clock | Sessions | Heatmap
-    col1, col2, col3 = st.columns([1, 1, 2])
-    
-    with col1:
-        section_header("🕐", "Listening Clock", "When you listen most")
-        st.plotly_chart(_build_clock_fig(), use_container_width=True, key="clock", config=PLOTLY_CONFIG)
-    
-    with col2:
-        section_header("⏱️", "Sessions", "Listening session durations")
-        sfig = _build_sessions_fig()
-        if sfig:
-            st.plotly_chart(style_fig(sfig, height=220), use_container_width=True, key="sessions", config=PLOTLY_CONFIG)
-    
-    with col3:
-        section_header("📅", "Commit-ment to Music", "Daily listening — drag-select days to filter")
-        cal_event = st.plotly_chart(
-            _build_heatmap_fig(cal_height=220),
-            use_container_width=True, key="calendar",
-            on_select="rerun", selection_mode=["box", "points"], config=HEATMAP_CONFIG,
-        )
-
-# ------------------------------------------------------------------
-# PROCESS HEATMAP SELECTION → day-level filter for everything below
-# ------------------------------------------------------------------
-selected_dates = None
-week_dow_to_date = dict(zip(
-    zip(full_grid["week"], full_grid["dow"]),
-    full_grid["date"]
-))
-
-if cal_event and cal_event.selection:
-    sel = cal_event.selection
-    resolved = []
+    treemap_df = (pd.DataFrame({"genre_bucket": combos["genre_bucket"].astype(str).to_numpy()[rows],
+                                "subgenre": subgenres, "m": combos["m"].to_numpy()[rows] * weights})
+                  .groupby(["genre_bucket", "subgenre"], as_index=False)["m"].sum())
     
-    if sel.points:
-        for p in sel.points:
-            week_val = p.get("x")
-            dow_val = p.get("y")
-            if dow_val is not None:
-                dow_val = int(round(dow_val)) if isinstance(dow_val, float) else dow_val
-            if week_val is not None and dow_val is not None:
-                d = week_dow_to_date.get((week_val, dow_val))
-                if d is not None:
-                    resolved.append(d)
+    # Add percentage to bucket names
+    bucket_totals = treemap_df.groupby("genre_bucket")["m"].sum()
+    grand_total = bucket_totals.sum()
+    bucket_pct = {b: f"{b} ({v / grand_total * 100:.0f}%)" for b, v in bucket_totals.items()}
+    treemap_df["genre_bucket_label"] = treemap_df["genre_bucket"].map(bucket_pct)
     
-    if not resolved and hasattr(sel, "box") and sel.box:
-        for box in sel.box:
-            x0 = box.get("x", [None, None])
-            y0 = box.get("y", [None, None])
-            if x0 and y0 and len(x0) == 2 and len(y0) == 2:
-                y_min, y_max = sorted([int(round(y0[0])), int(round(y0[1]))])
-                for _, row in full_grid.iterrows():
-                    if y_min <= row["dow"] <= y_max:
-                        w = row["week"]
-                        if (x0[0] is None or w >= str(x0[0])) and (x0[1] is None or w <= str(x0[1])):
-                            resolved.append(row["date"])
+    # Top-N subgenres per bucket + Others (peer feedback)
+    TOP_N_SUBGENRES = 8
+    result_parts = []
+    for bucket, bgroup in treemap_df.groupby("genre_bucket"):
+        if len(bgroup) <= TOP_N_SUBGENRES:
+            result_parts.append(bgroup)
+        else:
+            top = bgroup.nlargest(TOP_N_SUBGENRES, "m")
+            others_m = bgroup[~bgroup.index.isin(top.index)]["m"].sum()
+            others_row = pd.DataFrame([{"genre_bucket": bucket, "subgenre": "Other " + bucket,
+                                        "m": others_m, "genre_bucket_label": bucket_pct.get(bucket, bucket)}])
+            result_parts.append(pd.concat([top, others_row], ignore_index=True))
+    treemap_df = pd.concat(result_parts, ignore_index=True)
     
-    if not resolved and hasattr(sel, "point_indices") and sel.point_indices:
-        grid_dates_list = full_grid["date"].tolist()
-        for idx in sel.point_indices:
-            if 0 <= idx < len(grid_dates_list):
-                resolved.append(grid_dates_list[idx])
+    # Color map
+    def hex_to_rgb(h):
+        h = h.lstrip('#')
+        return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
+    def rgb_to_hex(rgb):
+        return '#{:02x}{:02x}{:02x}'.format(int(rgb[0]), int(rgb[1]), int(rgb[2]))
+    def gradient_color(base_hex, intensity):
+        base = hex_to_rgb(base_hex)
+        dark = (25, 25, 25)
+        return rgb_to_hex(tuple(dark[i] + (base[i] - dark[i]) * intensity for i in range(3)))
     
-    if resolved:
-        selected_dates = sorted(set(resolved))
-
-if selected_dates and len(selected_dates) > 0:
-    df_f = df_f[df_f["date"].isin(selected_dates)].copy()
-    date_min_s = min(selected_dates).strftime("%b %d")
-    date_max_s = max(selected_dates).strftime("%b %d, %Y")
-    st.markdown(f"""
-    <div style="
-        background: linear-gradient(90deg, rgba(29,185,84,0.15) 0%, rgba(29,185,84,0.03) 100%);
-        border: 1px solid rgba(29,185,84,0.3);
-        border-radius: 8px; padding: 8px 16px; margin-bottom: 12px;
-        display: flex; align-items: center; justify-content: space-between;
-    ">
-        <span style="color:{SPOTIFY['green']}; font-size:0.85rem;">
-            📌 Showing <strong>{len(selected_dates)} selected day{'s' if len(selected_dates)>1 else ''}</strong>
-            ({date_min_s} → {date_max_s}) · All charts below are filtered
-        </span>
-        <span style="color:{SPOTIFY['text_muted']}; font-size:0.75rem;">
-            Double-click the heatmap to clear
-        </span>
-    </div>
-    """, unsafe_allow_html=True)
-    if len(df_f) == 0:
-        st.warning("No listening data on the selected days.")
-        st.stop()
-
-# ── Row after heatmap: Discovery + Old vs New (filtered layout only) ──
-if not is_lifetime:
-    pct_new_artists, pct_new_tracks, new_artists_count, new_tracks_count = compute_discovery(df, df_f)
+    color_map = {"(?)": "#1a1a1a", "All Genres": "#1a1a1a"}
+    for bucket in GENRE_COLORS:
+        # Map both original and labelled names
+        color_map[bucket] = GENRE_COLORS[bucket]
+        for lbl in bucket_pct.values():
+            if lbl.startswith(bucket):
+                color_map[lbl] = GENRE_COLORS[bucket]
     
-    col1, col2, col3 = st.columns([1, 1, 2])
+    for bucket in treemap_df["genre_bucket"].unique():
+        bdata = treemap_df[treemap_df["genre_bucket"] == bucket]
+        max_m, min_m = bdata["m"].max(), bdata["m"].min()
+        base = GENRE_COLORS.get(bucket, SPOTIFY["green"])
+        for _, row in bdata.iterrows():
+            intensity = 0.35 + 0.65 * ((row["m"] - min_m) / (max_m - min_m)) if max_m > min_m else 1.0
+            color_map[row["subgenre"]] = gradient_color(base, intensity)
     
-    with col1:
-        _render_no1()
-    
-    with col2:
-        section_header("🔍", "Discovery Rate", "What share of your listening was brand-new music?")
-        st.markdown(f"""
-        <div style="display:flex; gap:12px; margin-bottom: 12px;">
-            <div class="discovery-card" style="flex:1;">
-                <div class="discovery-big">{pct_new_artists:.0f}%</div>
-                <div class="discovery-label">New Artists</div>
-                <div class="discovery-detail">
-                    {new_artists_count} of {n_artists} artists<br>
-                    heard <b>for the first time ever</b>
-                </div>
-            </div>
-            <div class="discovery-card" style="flex:1;">
-                <div class="discovery-big">{pct_new_tracks:.0f}%</div>
-                <div class="discovery-label">New Tracks</div>
-                <div class="discovery-detail">
-                    {new_tracks_count} of {n_tracks} tracks<br>
-                    played <b>for the first time ever</b>
-                </div>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col3:
-        _render_old_vs_new(chart_height=250)
-
-# ====================================================
-# Sunburst | Genre Treemap
-# ====================================================
-col1, col2 = st.columns([1, 2])
-
-with col1:
-    section_header("🌞", "Top Artists → Tracks", "Your top 3 artists and their most-played tracks")
-    sun_df = df_f.dropna(subset=["master_metadata_album_artist_name", "master_metadata_track_name"]).copy()
-    sun_df["m"] = measure_value(sun_df, measure)
-    artist_totals = sun_df.groupby("master_metadata_album_artist_name")["m"].sum()
-    top3 = artist_totals.nlargest(3).index.tolist()
-    sun_df = sun_df[sun_df["master_metadata_album_artist_name"].isin(top3)]
-    sun_agg = sun_df.groupby(["master_metadata_album_artist_name", "master_metadata_track_name"])["m"].sum().reset_index()
-    sun_agg = (sun_agg
-               .sort_values("m", ascending=False)
-               .groupby("master_metadata_album_artist_name", group_keys=False)
-               .head(4)
-               .reset_index(drop=True))
-    
-    if len(sun_agg) > 0:
-        # Spotify-themed green palette
-        palette = ["#1DB954", "#15803D", "#166534"]
-        fig = px.sunburst(sun_agg, path=["master_metadata_album_artist_name", "master_metadata_track_name"],
-                          values="m", color="master_metadata_album_artist_name",
-                          color_discrete_sequence=palette)
-        fig.update_traces(
-            textinfo="label", insidetextorientation="radial",
-            hovertemplate="<b>%{label}</b><br>%{value:,.0f} " + measure.lower() + " (%{percentParent:.1%})<extra></extra>",
-        )
-        fig.update_layout(margin=dict(l=5, r=5, t=5, b=5))
-        st.plotly_chart(style_fig(fig, height=320), use_container_width=True, key="sunburst", config=PLOTLY_CONFIG)
-
-with col2:
-    section_header("🎨", "Genre Map", "Click a genre to drill into sub-genres; click center to go back")
-    
-    genre_df = df_f.dropna(subset=["genre_bucket"]).copy()
-    genre_df["m"] = measure_value(genre_df, measure)
-    
-    genre_df["subgenres"] = genre_df["artist_genres"].apply(
-        lambda x: [g.strip() for g in str(x).split(",") if g.strip() and clean_string(g.strip())] if x else ["(no subgenre)"]
+    treemap_df["color_key"] = treemap_df["subgenre"]
+    fig = px.treemap(treemap_df, path=[px.Constant("All Genres"), "genre_bucket_label", "subgenre"],
+                     values="m", color="color_key", color_discrete_map=color_map)
+    fig.update_traces(
+        textinfo="label+percent parent", textfont=dict(size=12),
+        marker=dict(cornerradius=5),
+        hovertemplate="<b>%{label}</b><br>%{value:,.0f} " + measure.lower() + "<extra></extra>",
+        root_color="#1a1a1a"
     )
-    
-    rows = []
-    for _, r in genre_df.iterrows():
-        bucket = r["genre_bucket"]
-        m_val = r["m"]
-        subgenres = r["subgenres"] if r["subgenres"] else ["(no subgenre)"]
-        for sg in subgenres:
-            rows.append({"genre_bucket": bucket, "subgenre": sg, "m": m_val / len(subgenres)})
-    
-    if rows:
-        treemap_df = pd.DataFrame(rows).groupby(["genre_bucket", "subgenre"], as_index=False)["m"].sum()
-        
-        # Add percentage to bucket names
-        bucket_totals = treemap_df.groupby("genre_bucket")["m"].sum()
-        grand_total = bucket_totals.sum()
-        bucket_pct = {b: f"{b} ({v / grand_total * 100:.0f}%)" for b, v in bucket_totals.items()}
-        treemap_df["genre_bucket_label"] = treemap_df["genre_bucket"].map(bucket_pct)
-        
-        # Top-N subgenres per bucket + Others (peer feedback)
-        TOP_N_SUBGENRES = 8
-        result_parts = []
-        for bucket, bgroup in treemap_df.groupby("genre_bucket"):
-            if len(bgroup) <= TOP_N_SUBGENRES:
-                result_parts.append(bgroup)
-            else:
-                top = bgroup.nlargest(TOP_N_SUBGENRES, "m")
-                others_m = bgroup[~bgroup.index.isin(top.index)]["m"].sum()
-                others_row = pd.DataFrame([{"genre_bucket": bucket, "subgenre": "Other " + bucket,
-                                            "m": others_m, "genre_bucket_label": bucket_pct.get(bucket, bucket)}])
-                result_parts.append(pd.concat([top, others_row], ignore_index=True))
-        treemap_df = pd.concat(result_parts, ignore_index=True)
-        
-        # Color map
-        def hex_to_rgb(h):
-            h = h.lstrip('#')
-            return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
-        def rgb_to_hex(rgb):
-            return '#{:02x}{:02x}{:02x}'.format(int(rgb[0]), int(rgb[1]), int(rgb[2]))
-        def gradient_color(base_hex, intensity):
-            base = hex_to_rgb(base_hex)
-            dark = (25, 25, 25)
-            return rgb_to_hex(tuple(dark[i] + (base[i] - dark[i]) * intensity for i in range(3)))
-        
-        color_map = {"(?)": "#1a1a1a", "All Genres": "#1a1a1a"}
-        for bucket in GENRE_COLORS:
-            # Map both original and labelled names
-            color_map[bucket] = GENRE_COLORS[bucket]
-            for lbl in bucket_pct.values():
-                if lbl.startswith(bucket):
-                    color_map[lbl] = GENRE_COLORS[bucket]
-        
-        for bucket in treemap_df["genre_bucket"].unique():
-            bdata = treemap_df[treemap_df["genre_bucket"] == bucket]
-            max_m, min_m = bdata["m"].max(), bdata["m"].min()
-            base = GENRE_COLORS.get(bucket, SPOTIFY["green"])
-            for _, row in bdata.iterrows():
-                intensity = 0.35 + 0.65 * ((row["m"] - min_m) / (max_m - min_m)) if max_m > min_m else 1.0
-                color_map[row["subgenre"]] = gradient_color(base, intensity)
-        
-        treemap_df["color_key"] = treemap_df["subgenre"]
-        fig = px.treemap(treemap_df, path=[px.Constant("All Genres"), "genre_bucket_label", "subgenre"],
-                         values="m", color="color_key", color_discrete_map=color_map)
-        fig.update_traces(
-            textinfo="label+percent parent", textfont=dict(size=12),
-            marker=dict(cornerradius=5),
-            hovertemplate="<b>%{label}</b><br>%{value:,.0f} " + measure.lower() + "<extra></extra>",
-            root_color="#1a1a1a"
-        )
-        fig.update_layout(margin=dict(l=5, r=5, t=5, b=5))
-        st.plotly_chart(style_fig(fig, height=320), use_container_width=True, key="treemap", config=PLOTLY_CONFIG)
+    fig.update_layout(margin=dict(l=5, r=5, t=5, b=5))
+    return style_fig(fig, height=320)
 
 
 # ====================================================
-# Genre Evolution (full width — under the treemap)
+# Genre Evolution
 # ====================================================
-_ge_unit = "min" if measure == "Minutes" else "streams"
-section_header("🌊", "Genre Evolution", f"How your taste shifted over time — {measure.lower()} per month by genre")
-
-genre_evo = compute_genre_evolution(df_f, measure=measure)
-if len(genre_evo) > 1:
+def _build_genre_evo_fig(data, spec, measure, events_df):
+    unit = "min" if measure == "Minutes" else "streams"
+    genre_evo = compute_genre_evolution(data, spec, measure=measure)
+    if len(genre_evo) <= 1: return None
+    genre_evo["month"] = month_labels(genre_evo["month"])
     fig = go.Figure()
     for genre in GENRE_ORDER:
         if genre in genre_evo.columns and genre_evo[genre].sum() > 0:
@@ -1306,7 +1263,7 @@ if len(genre_evo) > 1:
                 name=genre, stackgroup="one",
                 line=dict(width=0.5, color=GENRE_COLORS.get(genre, "#6B7280")),
                 fillcolor=GENRE_COLORS.get(genre, "#6B7280"),
-                hovertemplate=f"<b>{genre}</b>: " + "%{y:,.0f} " + _ge_unit + "<extra></extra>",
+                hovertemplate=f"<b>{genre}</b>: " + "%{y:,.0f} " + unit + "<extra></extra>",
             ))
     fig.update_layout(
         xaxis_title="Month", yaxis_title=measure,
@@ -1314,150 +1271,399 @@ if len(genre_evo) > 1:
         legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5,
                     font=dict(size=9), bgcolor="rgba(0,0,0,0)")
     )
-    if show_events and len(events_df) > 0:
-        fig = add_event_overlays(fig, events_df, start_date, end_date, axis_type="month")
-    st.plotly_chart(style_fig(fig, height=300, show_legend=True), use_container_width=True, key="genre_evo", config=PLOTLY_CONFIG)
-else:
-    st.info("Need at least 2 months of data for genre evolution.")
+    if len(events_df) > 0:
+        fig = add_event_overlays(fig, events_df, from_day(spec.first), from_day(spec.last), axis_type="month")
+    return style_fig(fig, height=300, show_legend=True)
+
+
+@timed_fragment("over time")
+def over_time(data, spec, measure, events_source):
+    """Old vs New and Genre Evolution, the charts with a time axis. The life-events overlay
+    is drawn on these alone, so its toggle reruns only this fragment."""
+    head, toggle = st.columns([5, 1])
+    with toggle:
+        show_events = st.checkbox("Life events", value=False, key="show_events",
+                                  help="Shade semesters, exams and trips on the charts over time")
+    events_df = load_events(**events_source) if show_events and events_source else pd.DataFrame()
+    # Overlays change the figures they are drawn on, so the events shown are part of their key
+    events_key = int(pd.util.hash_pandas_object(events_df, index=False).sum()) if len(events_df) else None
+    
+    with head:
+        section_header("🆕", "Old vs New", "Unique songs each month: first listens vs revisits")
+    # Counts tracks over the whole range, whatever the measure or the selected days
+    start_date, end_date = from_day(spec.first), from_day(spec.last)
+    fig = cached_figure("oldnew", lambda: _build_old_vs_new_fig(data, start_date, end_date, events_df),
+                        data.version, spec.first, spec.last, events_key)
+    if fig is not None:
+        st.plotly_chart(fig, use_container_width=True, key="oldnew", config=PLOTLY_CONFIG)
+    else:
+        st.info("Not enough data for this view.")
+    
+    section_header("🌊", "Genre Evolution", f"How your taste shifted over time — {measure.lower()} per month by genre")
+    fig = cached_figure("genre_evo", lambda: _build_genre_evo_fig(data, spec, measure, events_df),
+                        data.version, spec, measure, events_key)
+    if fig is not None:
+        st.plotly_chart(fig, use_container_width=True, key="genre_evo", config=PLOTLY_CONFIG)
+    else:
+        st.info("Need at least 2 months of data for genre evolution.")
 
 # ====================================================
 # Niche | Billboard
 # ====================================================
-col1, col2 = st.columns(2)
-
-with col1:
-    section_header("🎯", "Niche Score", "Your artists: Spotify popularity vs your play count")
-    
+def _build_niche_fig(df_f, measure):
     niche_df = df_f.dropna(subset=["master_metadata_album_artist_name", "artist_popularity"]).copy()
     niche_df["m"] = measure_value(niche_df, measure)
-    artist_agg = niche_df.groupby(["master_metadata_album_artist_name", "artist_popularity"], as_index=False).agg(
+    artist_agg = niche_df.groupby(["master_metadata_album_artist_name", "artist_popularity"], as_index=False, observed=True).agg(
         val=("m", "sum"), streams=("ts", "count"))
+    if len(artist_agg) == 0: return None
     
-    if len(artist_agg) > 0:
-        fig = px.scatter(artist_agg, x="artist_popularity", y="val", size="streams", size_max=20,
-                         hover_name="master_metadata_album_artist_name",
-                         hover_data={"artist_popularity": ":.0f", "val": False, "streams": True},
-                         labels={"artist_popularity": "Spotify Popularity (0–100)", "streams": "Streams"},
-                         color_discrete_sequence=[SPOTIFY["green"]])
-        fig.update_traces(marker=dict(opacity=0.7, line=dict(width=1, color=SPOTIFY["green_light"])))
+    fig = px.scatter(artist_agg, x="artist_popularity", y="val", size="streams", size_max=20,
+                     hover_name="master_metadata_album_artist_name",
+                     hover_data={"artist_popularity": ":.0f", "val": False, "streams": True},
+                     labels={"artist_popularity": "Spotify Popularity (0–100)", "streams": "Streams"},
+                     color_discrete_sequence=[SPOTIFY["green"]])
+    fig.update_traces(marker=dict(opacity=0.7, line=dict(width=1, color=SPOTIFY["green_light"])))
+    
+    # Clearer quadrant lines (peer feedback)
+    fig.add_vline(x=50, line_dash="dash", line_color=SPOTIFY["border"], opacity=0.5)
+    max_y = artist_agg["val"].max()
+    fig.add_vrect(x0=0, x1=50, fillcolor="rgba(29,185,84,0.04)", line_width=0)
+    fig.add_annotation(x=25, y=max_y*0.92, text="🎯 Niche gems", showarrow=False,
+                      font=dict(size=10, color=SPOTIFY["green"]))
+    fig.add_annotation(x=75, y=max_y*0.92, text="🌟 Mainstream faves", showarrow=False,
+                      font=dict(size=10, color=SPOTIFY["text_muted"]))
+    fig.update_xaxes(title="Spotify Popularity", range=[-5, 105])
+    fig.update_yaxes(title=measure)
+    # The quick stat under the chart rides along in the layout's free-form `meta`, so a
+    # cached figure brings it back without regrouping the plays
+    fig.update_layout(meta={"niche_pct": (artist_agg["artist_popularity"] < 50).mean() * 100})
+    return style_fig(fig, height=350)
+
+
+# ====================================================
+# DASHBOARD FRAGMENT
+# ====================================================
+@timed_fragment("dashboard")
+def dashboard(data, spec, prev_spec, is_lifetime, events_source):
+    """Every panel below the KPI row, for the days in `spec`. The measure, the calendar
+    artist and a heatmap selection rerun only this fragment; Sessions and the charts over
+    time are fragments of their own inside it."""
+    measure_col, _ = st.columns([1, 5])
+    with measure_col:
+        measure = st.selectbox("Measure", ["Streams", "Minutes"], key="measure", label_visibility="collapsed",
+                               help="Count the charts below in plays or in minutes listened")
+    top_by = "streams" if measure == "Streams" else "ms_played"
+    df_f = data.plays_in(spec)
+    cube_f = data.cube_in(spec)
+    # Per-artist and per-track totals behind every top-N list (No. 1, Billboard, Sunburst)
+    top_totals = TopTotals(df_f, cube_f.by("master_metadata_album_artist_name"))
+    # The takeaways' daily average is over the whole range, whatever days are selected
+    range_minutes = cube_f.total("ms_played") / 60000
+    range_days = spec.last - spec.first + 1
+    
+    # ── Shared computations ──
+    hour_agg = hour_totals(cube_f, measure)
+    # Heatmap data: the calendar's cells (per day, or per week / month on long ranges)
+    calendar = CalendarGrid(spec.first, spec.last, CALENDAR_DAILY_MAX_DAYS, CALENDAR_WEEKLY_MAX_DAYS)
+    
+    # ╔════════════════════════════════════════════════════╗
+    # ║  LIFETIME LAYOUT — heatmap gets full width         ║
+    # ╚════════════════════════════════════════════════════╝
+    if is_lifetime:
+        # Row 1: Clock | Sessions | No.1 | Rank sparklines
+        col1, col2, col3, col4 = st.columns([1, 1, 1, 1.5])
         
-        # Clearer quadrant lines (peer feedback)
-        fig.add_vline(x=50, line_dash="dash", line_color=SPOTIFY["border"], opacity=0.5)
-        max_y = artist_agg["val"].max()
-        fig.add_vrect(x0=0, x1=50, fillcolor="rgba(29,185,84,0.04)", line_width=0)
-        fig.add_annotation(x=25, y=max_y*0.92, text="🎯 Niche gems", showarrow=False,
-                          font=dict(size=10, color=SPOTIFY["green"]))
-        fig.add_annotation(x=75, y=max_y*0.92, text="🌟 Mainstream faves", showarrow=False,
-                          font=dict(size=10, color=SPOTIFY["text_muted"]))
-        fig.update_xaxes(title="Spotify Popularity", range=[-5, 105])
-        fig.update_yaxes(title=measure)
-        st.plotly_chart(style_fig(fig, height=350), use_container_width=True, key="niche", config=PLOTLY_CONFIG)
+        with col1:
+            section_header("🕐", "Listening Clock", "When you listen most")
+            st.plotly_chart(cached_figure("clock", lambda: _build_clock_fig(hour_agg, measure), data.version, spec, measure),
+                            use_container_width=True, key="clock", config=PLOTLY_CONFIG)
         
-        # Quick stat
-        niche_pct = (artist_agg["artist_popularity"] < 50).mean() * 100
-        st.caption(f"**{niche_pct:.0f}%** of your artists have a Spotify popularity below 50 — {'a true underground explorer!' if niche_pct > 50 else 'you balance mainstream and niche well.'}")
-
-with col2:
-    section_header("📈", "Billboard", "Your top artists & tracks ranked")
+        with col2:
+            sessions_panel(data, spec)
+        
+        with col3:
+            _render_no1(top_totals, df_f)
+        
+        with col4:
+            # Two compact rank-over-time sparklines for the No.1 artist and track
+            # --- No.1 Artist rank over time ---
+            top_artist_df_lt = top_totals.artists(1)
+            if len(top_artist_df_lt) > 0:
+                no1_artist = top_artist_df_lt["master_metadata_album_artist_name"].iloc[0]
+                fig = cached_figure("rank_artist", lambda: _build_rank_fig(
+                    rank_series(data, measure, "artists", no1_artist, spec),
+                    "rgba(29,185,84,0.15)", "<b>%{x}</b><br>Rank #%{y}<extra></extra>"),
+                    data.version, measure, no1_artist, spec)
+                if fig is not None:
+                    st.caption("👑 **Artist rank over time**")
+                    st.plotly_chart(fig, use_container_width=True, key="rank_artist", config=PLOTLY_CONFIG)
+            
+            # --- No.1 Track rank over time ---
+            top_track_df_lt = top_totals.tracks(1)
+            if len(top_track_df_lt) > 0:
+                no1_track_id = top_track_df_lt["track_id"].iloc[0]
+                (no1_track,), (no1_track_artist,) = decode_track_ids(df_f, top_track_df_lt["track_id"])
+                fig = cached_figure("rank_track", lambda: _build_rank_fig(
+                    rank_series(data, measure, "tracks", no1_track_id, spec),
+                    "rgba(29,185,84,0.1)", f"<b>{no1_track}</b><br>" + "%{x}<br>Rank #%{y}<extra></extra>"),
+                    data.version, measure, no1_track_id, spec)
+                if fig is not None:
+                    st.caption("🎵 **Track rank over time**")
+                    st.plotly_chart(fig, use_container_width=True, key="rank_track", config=PLOTLY_CONFIG)
+        
+        # Row 2: Full-width heatmap (finally readable for lifetime!)
+        section_header("📅", "Commit-ment to Music", f"{CALENDAR_PERIODS[calendar.mode]} listening — drag-select days to filter the whole dashboard")
+        calendar_artist = _pick_calendar_artist(top_totals)
+        cal_event = st.plotly_chart(
+            cached_figure("calendar", lambda: _build_heatmap_fig(data, cube_f, calendar, measure, 180, calendar_artist),
+                          data.version, spec, measure, 180, calendar_artist),
+            use_container_width=True, key="calendar",
+            on_select="rerun", selection_mode=["box", "points"], config=HEATMAP_CONFIG,
+        )
     
-    tab1, tab2 = st.tabs(["🎤 Artists", "🎵 Songs"])
+    # ╔════════════════════════════════════════════════════╗
+    # ║  FILTERED LAYOUT — compact with discovery cards    ║
+    # ╚════════════════════════════════════════════════════╝
+    else:
+        # Row 1: Clock | Sessions | Heatmap
+        col1, col2, col3 = st.columns([1, 1, 2])
+        
+        with col1:
+            section_header("🕐", "Listening Clock", "When you listen most")
+            st.plotly_chart(cached_figure("clock", lambda: _build_clock_fig(hour_agg, measure), data.version, spec, measure),
+                            use_container_width=True, key="clock", config=PLOTLY_CONFIG)
+        
+        with col2:
+            sessions_panel(data, spec)
+        
+        with col3:
+            section_header("📅", "Commit-ment to Music", f"{CALENDAR_PERIODS[calendar.mode]} listening — drag-select days to filter")
+            calendar_artist = _pick_calendar_artist(top_totals)
+            cal_event = st.plotly_chart(
+                cached_figure("calendar", lambda: _build_heatmap_fig(data, cube_f, calendar, measure, 220, calendar_artist),
+                              data.version, spec, measure, 220, calendar_artist),
+                use_container_width=True, key="calendar",
+                on_select="rerun", selection_mode=["box", "points"], config=HEATMAP_CONFIG,
+            )
     
-    bill_df = df_f.dropna(subset=["master_metadata_album_artist_name"]).copy()
-    bill_df["m"] = measure_value(bill_df, measure)
-    unit_label = "min" if measure == "Minutes" else ""
+    # ------------------------------------------------------------------
+    # PROCESS HEATMAP SELECTION → day-level filter for everything below
+    # ------------------------------------------------------------------
+    selected_days = None
     
-    with tab1:
-        bill_artists = bill_df.groupby("master_metadata_album_artist_name", as_index=False)["m"].sum().sort_values("m", ascending=False).head(8)
-        if len(bill_artists) > 0:
-            max_val = bill_artists["m"].max()
-            html = ""
-            for idx, (_, row) in enumerate(bill_artists.iterrows()):
-                pct = (row["m"] / max_val) * 100
-                val_str = f"{row['m']:,.0f} {unit_label}".strip() if measure == "Minutes" else fmt_number(row['m'])
-                html += f"""<div class="billboard-item">
-                    <span class="billboard-rank">{idx+1}</span>
-                    <span class="billboard-name">{row['master_metadata_album_artist_name']}</span>
-                    <div class="billboard-bar"><div class="billboard-bar-fill" style="width:{pct}%;"></div></div>
-                    <span class="billboard-value">{val_str}</span>
-                </div>"""
-            st.markdown(html, unsafe_allow_html=True)
+    if cal_event and cal_event.selection:
+        sel = cal_event.selection
+        # Cells resolve to day ordinals on the grid's integer row/column positions
+        resolved = calendar.points([(p["x"], p["y"]) for p in sel.points
+                                    if p.get("x") is not None and p.get("y") is not None])
+        
+        if not len(resolved) and sel.box:
+            boxes = [box for box in sel.box if len(box.get("x", [])) == 2 and len(box.get("y", [])) == 2]
+            if boxes:
+                resolved = np.concatenate([calendar.box(box["x"], box["y"]) for box in boxes])
+        
+        if len(resolved):
+            selected_days = resolved
     
-    with tab2:
-        bill_tracks = df_f.dropna(subset=["master_metadata_track_name", "master_metadata_album_artist_name"]).copy()
-        bill_tracks["m"] = measure_value(bill_tracks, measure)
-        bill_tracks = bill_tracks.groupby(["master_metadata_track_name", "master_metadata_album_artist_name"],
-                                          as_index=False)["m"].sum().sort_values("m", ascending=False).head(8)
-        if len(bill_tracks) > 0:
-            max_val = bill_tracks["m"].max()
-            html = ""
-            for idx, (_, row) in enumerate(bill_tracks.iterrows()):
-                pct = (row["m"] / max_val) * 100
-                name = row['master_metadata_track_name'][:25] + "…" if len(row['master_metadata_track_name']) > 25 else row['master_metadata_track_name']
-                val_str = f"{row['m']:,.0f} {unit_label}".strip() if measure == "Minutes" else fmt_number(row['m'])
-                html += f"""<div class="billboard-item">
-                    <span class="billboard-rank">{idx+1}</span>
-                    <span class="billboard-name" title="{row['master_metadata_track_name']} — {row['master_metadata_album_artist_name']}">{name}</span>
-                    <div class="billboard-bar"><div class="billboard-bar-fill" style="width:{pct}%;"></div></div>
-                    <span class="billboard-value">{val_str}</span>
-                </div>"""
-            st.markdown(html, unsafe_allow_html=True)
-
-# ====================================================
-# KEY TAKEAWAYS — narrative style
-# ====================================================
-st.markdown("---")
-section_header("💡", "Your Listening Profile", "A summary of your musical fingerprint")
+    if selected_days is not None:
+        spec = spec.narrow(selected_days)
+        df_f = data.plays_in(spec)
+        cube_f = data.cube_in(spec)
+        top_totals = TopTotals(df_f, cube_f.by("master_metadata_album_artist_name"))
+        date_min_s = from_day(spec.days[0]).strftime("%b %d")
+        date_max_s = from_day(spec.days[-1]).strftime("%b %d, %Y")
+        # Selection ∩ the calendar artist's days, intersected on the day bitmaps
+        artist_note = (f" · {calendar_artist} played on {data.artist_days.count(calendar_artist, spec.days)}"
+                       if calendar_artist else "")
+        st.markdown(f"""
+        <div style="
+            background: linear-gradient(90deg, rgba(29,185,84,0.15) 0%, rgba(29,185,84,0.03) 100%);
+            border: 1px solid rgba(29,185,84,0.3);
+            border-radius: 8px; padding: 8px 16px; margin-bottom: 12px;
+            display: flex; align-items: center; justify-content: space-between;
+        ">
+            <span style="color:{SPOTIFY['green']}; font-size:0.85rem;">
+                📌 Showing <strong>{len(spec.days)} selected day{'s' if len(spec.days)>1 else ''}</strong>
+                ({date_min_s} → {date_max_s}){artist_note} · All charts below are filtered
+            </span>
+            <span style="color:{SPOTIFY['text_muted']}; font-size:0.75rem;">
+                Double-click the heatmap to clear
+            </span>
+        </div>
+        """, unsafe_allow_html=True)
+        if len(df_f) == 0:
+            st.warning("No listening data on the selected days.")
+            st.stop()
+    
+    # ── Row after heatmap: No.1 + Discovery (filtered layout only) ──
+    if not is_lifetime:
+        (pct_new_artists, pct_new_tracks, new_artists_count, new_tracks_count,
+         period_artists, period_tracks) = compute_discovery(data, spec)
+    
+        col1, col2 = st.columns([1, 2])
+    
+        with col1:
+            _render_no1(top_totals, df_f)
+    
+        with col2:
+            section_header("🔍", "Discovery Rate", "What share of your listening was brand-new music?")
+            st.markdown(f"""
+            <div style="display:flex; gap:12px; margin-bottom: 12px;">
+                <div class="discovery-card" style="flex:1;">
+                    <div class="discovery-big">{pct_new_artists:.0f}%</div>
+                    <div class="discovery-label">New Artists</div>
+                    <div class="discovery-detail">
+                        {new_artists_count} of {period_artists} artists<br>
+                        heard <b>for the first time ever</b>
+                    </div>
+                </div>
+                <div class="discovery-card" style="flex:1;">
+                    <div class="discovery-big">{pct_new_tracks:.0f}%</div>
+                    <div class="discovery-label">New Tracks</div>
+                    <div class="discovery-detail">
+                        {new_tracks_count} of {period_tracks} tracks<br>
+                        played <b>for the first time ever</b>
+                    </div>
+                </div>
+            </div>
+            """, unsafe_allow_html=True)
+    
+    # ====================================================
+    # Sunburst | Genre Treemap
+    # ====================================================
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        section_header("🌞", "Top Artists → Tracks", "Your top 3 artists and their most-played tracks")
+        fig = cached_figure("sunburst", lambda: _build_sunburst_fig(top_totals, df_f, measure), data.version, spec, measure)
+        if fig is not None:
+            st.plotly_chart(fig, use_container_width=True, key="sunburst", config=PLOTLY_CONFIG)
+    
+    with col2:
+        section_header("🎨", "Genre Map", "Click a genre to drill into sub-genres; click center to go back")
+        fig = cached_figure("treemap", lambda: _build_treemap_fig(data, cube_f, measure), data.version, spec, measure)
+        if fig is not None:
+            st.plotly_chart(fig, use_container_width=True, key="treemap", config=PLOTLY_CONFIG)
+    
+    # ====================================================
+    # Old vs New | Genre Evolution (full width, with events)
+    # ====================================================
+    over_time(data, spec, measure, events_source)
+    
+    # ====================================================
+    # Niche | Billboard
+    # ====================================================
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        section_header("🎯", "Niche Score", "Your artists: Spotify popularity vs your play count")
+        
+        fig = cached_figure("niche", lambda: _build_niche_fig(df_f, measure), data.version, spec, measure)
+        if fig is not None:
+            st.plotly_chart(fig, use_container_width=True, key="niche", config=PLOTLY_CONFIG)
+            
+            # Quick stat
+            niche_pct = fig.layout.meta["niche_pct"]
+            st.caption(f"**{niche_pct:.0f}%** of your artists have a Spotify popularity below 50 — {'a true underground explorer!' if niche_pct > 50 else 'you balance mainstream and niche well.'}")
+    
+    with col2:
+        section_header("📈", "Billboard", "Your top artists & tracks ranked")
+        
+        tab1, tab2 = st.tabs(["🎤 Artists", "🎵 Songs"])
+        
+        unit_label = "min" if measure == "Minutes" else ""
+    
+        with tab1:
+            bill_artists = top_totals.artists(8, top_by)
+            bill_artists["m"] = cell_measure(bill_artists, measure)
+            if len(bill_artists) > 0:
+                max_val = bill_artists["m"].max()
+                html = ""
+                for idx, (_, row) in enumerate(bill_artists.iterrows()):
+                    pct = (row["m"] / max_val) * 100
+                    val_str = f"{row['m']:,.0f} {unit_label}".strip() if measure == "Minutes" else fmt_number(row['m'])
+                    html += f"""<div class="billboard-item">
+                        <span class="billboard-rank">{idx+1}</span>
+                        <span class="billboard-name">{row['master_metadata_album_artist_name']}</span>
+                        <div class="billboard-bar"><div class="billboard-bar-fill" style="width:{pct}%;"></div></div>
+                        <span class="billboard-value">{val_str}</span>
+                    </div>"""
+                st.markdown(html, unsafe_allow_html=True)
+    
+        with tab2:
+            track_totals = top_totals.tracks(8, top_by)
+            top_tracks, top_track_artists = decode_track_ids(df_f, track_totals["track_id"])
+            bill_tracks = pd.DataFrame({"master_metadata_track_name": top_tracks,
+                                        "master_metadata_album_artist_name": top_track_artists,
+                                        "m": cell_measure(track_totals, measure).to_numpy()})
+            if len(bill_tracks) > 0:
+                max_val = bill_tracks["m"].max()
+                html = ""
+                for idx, (_, row) in enumerate(bill_tracks.iterrows()):
+                    pct = (row["m"] / max_val) * 100
+                    name = row['master_metadata_track_name'][:25] + "…" if len(row['master_metadata_track_name']) > 25 else row['master_metadata_track_name']
+                    val_str = f"{row['m']:,.0f} {unit_label}".strip() if measure == "Minutes" else fmt_number(row['m'])
+                    html += f"""<div class="billboard-item">
+                        <span class="billboard-rank">{idx+1}</span>
+                        <span class="billboard-name" title="{row['master_metadata_track_name']} — {row['master_metadata_album_artist_name']}">{name}</span>
+                        <div class="billboard-bar"><div class="billboard-bar-fill" style="width:{pct}%;"></div></div>
+                        <span class="billboard-value">{val_str}</span>
+                    </div>"""
+                st.markdown(html, unsafe_allow_html=True)
+    
+    # ====================================================
+    # KEY TAKEAWAYS — narrative style
+    # ====================================================
+    st.markdown("---")
+    section_header("💡", "Your Listening Profile", "A summary of your musical fingerprint")
+    
+    prev_totals = data.cube_in(prev_spec).totals
+    avg_pop = df_f["artist_popularity"].dropna().mean() if df_f["artist_popularity"].notna().any() else 50
+    skip_rate = cube_f.total("skips") / cube_f.total("streams") * 100 if len(cube_f) > 0 else 0
+    peak_hour = hour_agg.loc[hour_agg["m"].idxmax(), "hour"] if len(hour_agg) > 0 else 12
 
-# Ensure discovery metrics are always available
-try:
-    _ = pct_new_artists
-except NameError:
-    pct_new_artists, pct_new_tracks, new_artists_count, new_tracks_count = compute_discovery(df, df_f)
+    pop_label = "Mainstream 🌟" if avg_pop > 60 else ("Balanced 🎭" if avg_pop > 40 else "Indie 🎯")
+    skip_label = "Picky 🎯" if skip_rate > 20 else ("Selective 👀" if skip_rate > 10 else "Loyal 💚")
+    hour_label = "Night owl 🦉" if peak_hour >= 22 or peak_hour < 6 else ("Early bird 🌅" if peak_hour < 12 else "Afternoon listener ☀️")
 
-avg_pop = df_f["artist_popularity"].dropna().mean() if df_f["artist_popularity"].notna().any() else 50
-skip_rate = df_f["skipped"].mean() * 100 if len(df_f) > 0 else 0
-peak_hour = hour_agg.loc[hour_agg["m"].idxmax(), "hour"] if len(hour_agg) > 0 else 12
+    # Top genre
+    top_genre_series = cube_f.by("genre_bucket").groupby("genre_bucket", observed=True)["ms_played"].sum().sort_values(ascending=False)
+    top_genre = top_genre_series.index[0] if len(top_genre_series) > 0 else "Unknown"
 
-pop_label = "Mainstream 🌟" if avg_pop > 60 else ("Balanced 🎭" if avg_pop > 40 else "Indie 🎯")
-skip_label = "Picky 🎯" if skip_rate > 20 else ("Selective 👀" if skip_rate > 10 else "Loyal 💚")
-hour_label = "Night owl 🦉" if peak_hour >= 22 or peak_hour < 6 else ("Early bird 🌅" if peak_hour < 12 else "Afternoon listener ☀️")
+    avg_daily_min = range_minutes / range_days
 
-# Top genre
-top_genre_series = df_f.dropna(subset=["genre_bucket"]).groupby("genre_bucket")["ms_played"].sum().sort_values(ascending=False)
-top_genre = top_genre_series.index[0] if len(top_genre_series) > 0 else "Unknown"
+    st.markdown(f"""
+    <div class="kpi-container">
+        <div class="kpi-card">
+            <div class="kpi-label">Taste Profile</div>
+            <div class="kpi-value" style="font-size:1.2rem;">{pop_label}</div>
+            <div class="kpi-trend">avg popularity {avg_pop:.0f}/100</div>
+        </div>
+        <div class="kpi-card">
+            <div class="kpi-label">Skip Behavior</div>
+            <div class="kpi-value" style="font-size:1.2rem;">{skip_label}</div>
+            <div class="kpi-trend">{skip_rate:.1f}% skip rate</div>
+        </div>
+        <div class="kpi-card">
+            <div class="kpi-label">Peak Time</div>
+            <div class="kpi-value" style="font-size:1.2rem;">{hour_label}</div>
+            <div class="kpi-trend">most active at {int(peak_hour):02d}:00</div>
+        </div>
+        <div class="kpi-card">
+            <div class="kpi-label">Top Genre</div>
+            <div class="kpi-value" style="font-size:1.2rem;">{top_genre}</div>
+            <div class="kpi-trend">dominant genre bucket</div>
+        </div>
+        <div class="kpi-card">
+            <div class="kpi-label">Daily Average</div>
+            <div class="kpi-value">{fmt_hours(avg_daily_min)}</div>
+            <div class="kpi-trend">per day</div>{kpi_delta(range_minutes, prev_totals["ms_played"] / 60000, f"{range_days} days")}
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
 
-days_in_range = (end_date - start_date).days + 1
-avg_daily_min = total_minutes / days_in_range if days_in_range > 0 else 0
 
-st.markdown(f"""
-<div class="kpi-container">
-    <div class="kpi-card">
-        <div class="kpi-label">Taste Profile</div>
-        <div class="kpi-value" style="font-size:1.2rem;">{pop_label}</div>
-        <div class="kpi-trend">avg popularity {avg_pop:.0f}/100</div>
-    </div>
-    <div class="kpi-card">
-        <div class="kpi-label">Skip Behavior</div>
-        <div class="kpi-value" style="font-size:1.2rem;">{skip_label}</div>
-        <div class="kpi-trend">{skip_rate:.1f}% skip rate</div>
-    </div>
-    <div class="kpi-card">
-        <div class="kpi-label">Peak Time</div>
-        <div class="kpi-value" style="font-size:1.2rem;">{hour_label}</div>
-        <div class="kpi-trend">most active at {int(peak_hour):02d}:00</div>
-    </div>
-    <div class="kpi-card">
-        <div class="kpi-label">Top Genre</div>
-        <div class="kpi-value" style="font-size:1.2rem;">{top_genre}</div>
-        <div class="kpi-trend">dominant genre bucket</div>
-    </div>
-    <div class="kpi-card">
-        <div class="kpi-label">Daily Average</div>
-        <div class="kpi-value">{fmt_hours(avg_daily_min)}</div>
-        <div class="kpi-trend">per day</div>
-    </div>
-</div>
-""", unsafe_allow_html=True)
+dashboard(data, spec, prev_spec, is_lifetime, events_source)
 
 # ====================================================
 # FOOTER
@@ -1467,3 +1673,5 @@ st.markdown(f"""
     🎧 Musical Fingerprint · {start_date} → {end_date} · {total_streams:,} plays · Built with Streamlit & Plotly
 </div>
 """, unsafe_allow_html=True)
+if "timings" in st.query_params:
+    st.caption(f"⏱ full run: {(time.perf_counter() - _page_started) * 1000:,.0f} ms")
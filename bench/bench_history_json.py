@@ -0,0 +1,53 @@
+"""Loading many Spotify extended-history JSON files: one at a time vs `load_history_json`.
+
+    python bench/bench_history_json.py [rows] [files]
+
+Splits a synthetic history (see `tests/synthetic.py`) into `Streaming_History_Audio_*.json`
+payloads, checks the pooled load matches parsing them one by one, and reports the cold
+(process pool) and warm (frame cache) load of all files.
+"""
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pandas as pd  # noqa: E402
+
+import ingest  # noqa: E402
+from tests.synthetic import history_json_payloads, synthetic_export  # noqa: E402
+
+
+def uploads(payloads):
+    files = []
+    for name, data in payloads:
+        f = io.BytesIO(data)
+        f.name = name
+        files.append(f)
+    return files
+
+
+def main(n_rows=1_000_000, n_files=12):
+    payloads = history_json_payloads(synthetic_export(n_rows), n_files)
+    megabytes = sum(len(data) for _, data in payloads) / 2**20
+    print(f"{n_rows:,} plays in {n_files} files ({megabytes:,.0f} MB of JSON)")
+
+    started = time.perf_counter()
+    expected = ingest.merge_sorted_parts([ingest.parse_history_json(data) for _, data in payloads])
+    t_seq = time.perf_counter() - started
+    print(f"one at a time   {t_seq:6.2f} s  {n_rows / t_seq:>12,.0f} rows/s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ingest.CACHE_DIR = Path(tmp)
+        for label in ("process pool", "frame cache"):
+            started = time.perf_counter()
+            df = ingest.load_history_json(uploads(payloads))
+            elapsed = time.perf_counter() - started
+            pd.testing.assert_frame_equal(df, expected)
+            print(f"{label:<15} {elapsed:6.2f} s  {n_rows / elapsed:>12,.0f} rows/s  ({t_seq / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
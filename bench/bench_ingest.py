@@ -0,0 +1,47 @@
+"""Ingest throughput in rows per second: the row-wise reference vs `ingest.prepare_frame`.
+
+    python bench/bench_ingest.py [rows]
+
+Runs on a synthetic export (see `tests/synthetic.py`), checks both produce the same
+plays, and reports the prepare step alone and the whole uncached CSV load.
+"""
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import ingest  # noqa: E402
+from tests.reference import reference_prepare  # noqa: E402
+from tests.synthetic import synthetic_export  # noqa: E402
+from tests.test_ingest import assert_same_plays  # noqa: E402
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main(n_rows=500_000):
+    warnings.simplefilter("ignore")  # the reference's own pandas warnings
+    export = synthetic_export(n_rows)
+    expected, t_ref = timed(reference_prepare, export.copy())
+    df, t_new = timed(ingest.prepare_frame, export.copy())
+    assert_same_plays(expected, df)
+    print(f"{n_rows:,} rows")
+    print(f"prepare  reference  {n_rows / t_ref:>12,.0f} rows/s  ({t_ref:.2f} s)")
+    print(f"prepare  engine     {n_rows / t_new:>12,.0f} rows/s  ({t_new:.2f} s, {t_ref / t_new:.0f}x)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "export.csv"
+        export.to_csv(path, index=False)
+        _, t_load = timed(lambda: ingest.sort_by_ts(ingest.drop_duplicate_plays(
+            ingest.prepare_frame(ingest._read_export(path)))))
+    print(f"CSV load (uncached) {n_rows / t_load:>12,.0f} rows/s  ({t_load:.2f} s)")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,669 @@
+"""Query structures over a prepared play frame (see `ingest`).
+
+Loaders return frames sorted by `ts`, so the `day` column is non-decreasing and the
+plays of any run of days form one contiguous block of rows.
+"""
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from ingest import ARTIST_COL, TRACK_COL, clean_string, day_months, fmix64, name_hashes
+
+GENRE_COL = "genre_bucket"
+SUBGENRES_COL = "artist_genres"
+ALBUM_COL = "master_metadata_album_album_name"
+NO_SUBGENRE = "(no subgenre)"
+NS_PER_DAY = 86_400 * 10**9
+
+
+class DayIndex:
+    """Row ranges by day ordinal over a frame sorted by `ts`.
+
+    Lookups are binary searches on the `day` column. Range slices are `iloc` views that
+    share memory with the frame, so callers must treat them as read-only.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.days = df["day"].to_numpy()
+
+    def bounds(self, first, last):
+        """(start, stop) row offsets covering days `first` through `last`."""
+        start = int(np.searchsorted(self.days, first, side="left"))
+        return start, max(start, int(np.searchsorted(self.days, last, side="right")))
+
+    def range(self, first, last):
+        """Plays from day `first` through `last`, as a zero-copy view."""
+        start, stop = self.bounds(first, last)
+        return self.df.iloc[start:stop]
+
+    def rows(self, days):
+        """Row positions of the plays on any of `days`, in frame order."""
+        days = np.unique(np.asarray(days, dtype=self.days.dtype))
+        starts = np.searchsorted(self.days, days, side="left")
+        counts = np.searchsorted(self.days, days, side="right") - starts
+        # Concatenated aranges: each row's offset within its day, plus that day's start
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(starts, counts) + offsets
+
+    def select(self, days):
+        """Plays on any of `days`; a view when the matching rows are contiguous."""
+        rows = self.rows(days)
+        if len(rows) and rows[-1] - rows[0] == len(rows) - 1:
+            return self.df.iloc[rows[0]:rows[-1] + 1]
+        return self.df.take(rows)
+
+
+
+class RollupCube:
+    """Plays pre-aggregated by day, hour, genre and artist.
+
+    The base `cells` hold `streams`, `ms_played`, `skips` and `skip_ms` (time played on
+    skipped streams) per (day, hour, genre, artist). Coarser views — per day, and per
+    day and one of hour/genre/artist — are rolled up from them once, so each panel sums
+    over the smallest table that answers it. Every table is ordered by day, so a date
+    range or day selection is a binary-searched slice (see `DayIndex`), and name columns
+    keep the play frame's dictionaries. Anything that needs individual plays (sessions,
+    tracks, albums) still reads the play frame. A per-day (genre, `artist_genres`) view,
+    rolled up from the plays, feeds the subgenre breakdown together with `subgenres`, the
+    split of each `artist_genres` value into weighted subgenres.
+
+    Cumulative per-day sums of every measure answer range totals with two lookups
+    (`totals`), whatever the range length. Per-day HyperLogLog sketches of the tracks,
+    artists and albums played merge into distinct-count estimates for any set of days
+    (`CubeSlice.distinct`). A run-length table of the days with plays gives the listening
+    streaks of any range by clipping its first and last runs (`runs`).
+    """
+
+    def __init__(self, df):
+        plays = {"streams": None, "ms_played": df["ms_played"].to_numpy(),
+                 "skips": df["skipped"].to_numpy(),
+                 "skip_ms": np.where(df["skipped"].to_numpy(), df["ms_played"].to_numpy(), 0)}
+        self.cells = rollup(df, ["hour", GENRE_COL, ARTIST_COL], plays)
+        sums = {name: self.cells[name].to_numpy() for name in CUBE_MEASURES}
+        views = {(): rollup(self.cells, [], sums)}
+        for dim in ("hour", GENRE_COL, ARTIST_COL):
+            views[(dim,)] = rollup(self.cells, [dim], sums)
+        views[("hour", GENRE_COL, ARTIST_COL)] = self.cells
+        views[(GENRE_COL, SUBGENRES_COL)] = rollup(df, [GENRE_COL, SUBGENRES_COL], plays)
+        self.subgenres = SubgenreWeights(df[SUBGENRES_COL].cat.categories)
+        self.indexes = {dims: DayIndex(view) for dims, view in views.items()}
+        # prefix[m][i] = sum of measure m over the first i days with plays
+        self.prefix = {m: np.concatenate(([0], np.cumsum(views[()][m].to_numpy())))
+                       for m in CUBE_MEASURES}
+        self.sketches = _day_sketches(df, views[()]["day"].to_numpy())
+        self.run_starts, self.run_lengths = day_runs(views[()]["day"].to_numpy())
+
+    def totals(self, first, last):
+        """{measure: total} over days `first` through `last`, from the prefix sums."""
+        start, stop = self.indexes[()].bounds(first, last)
+        return {m: int(p[stop] - p[start]) for m, p in self.prefix.items()}
+
+    def runs(self, first, last):
+        """`day_runs` of the days with plays from `first` through `last`, from the run table."""
+        ends = self.run_starts + self.run_lengths - 1
+        start = np.searchsorted(ends, first, side="left")
+        stop = np.searchsorted(self.run_starts, last, side="right")
+        starts = np.maximum(self.run_starts[start:stop], first)
+        lengths = np.minimum(ends[start:stop], last) - starts + 1
+        return starts[lengths > 0], lengths[lengths > 0]
+
+    def range(self, first, last):
+        """`CubeSlice` of days `first` through `last`."""
+        start, stop = self.indexes[()].bounds(first, last)
+        return CubeSlice({dims: ix.range(first, last) for dims, ix in self.indexes.items()},
+                         {name: regs[start:stop] for name, regs in self.sketches.items()},
+                         self.totals(first, last), self.runs(first, last))
+
+    def select(self, days):
+        """`CubeSlice` of the given days."""
+        rows = self.indexes[()].rows(days)
+        return CubeSlice({dims: ix.select(days) for dims, ix in self.indexes.items()},
+                         {name: regs[rows] for name, regs in self.sketches.items()})
+
+
+class CubeSlice:
+    """The cube's tables restricted to some days (read-only views)."""
+
+    def __init__(self, views, sketches, totals=None, runs=None):
+        self.views = views
+        self.sketches = sketches
+        self.totals = totals
+        self._runs = runs
+
+    def by(self, *dims):
+        """Table with one row per day and combination of `dims` (all three for cells)."""
+        return self.views[dims]
+
+    def total(self, measure):
+        if self.totals is not None:
+            return self.totals[measure]
+        return int(self.views[()][measure].sum())
+
+    def distinct(self, name):
+        """Estimated number of distinct `name` ("tracks", "artists" or "albums") played."""
+        return hll_estimate(self.sketches[name].max(axis=0, initial=0))
+
+    def runs(self):
+        """`day_runs` of the days with plays."""
+        if self._runs is not None:
+            return self._runs
+        return day_runs(self.views[()]["day"].to_numpy())
+
+    def __len__(self):
+        return len(self.views[()])
+
+
+class SubgenreWeights:
+    """The comma-separated subgenres of every `artist_genres` value, each weighted 1/n
+    for a value listing n of them (`NO_SUBGENRE` when it lists none or is missing).
+
+    Rows are grouped by category code, so `spread` maps any table of (value, amount) rows
+    onto subgenres with a repeat instead of splitting strings per row.
+    """
+
+    def __init__(self, categories):
+        counts, subgenres = [], []
+        for value in [None, *categories]:
+            names = [g.strip() for g in str(value).split(",")
+                     if g.strip() and clean_string(g.strip())] if value is not None else []
+            names = names or [NO_SUBGENRE]
+            counts.append(len(names))
+            subgenres.extend(names)
+        self.counts = np.array(counts)
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.subgenres = np.array(subgenres, dtype=object)
+        self.weights = np.repeat(1 / self.counts, self.counts)
+
+    def spread(self, values):
+        """(rows, subgenres, weights) for a Categorical column of `artist_genres` values:
+        each row position repeated once per subgenre of its value."""
+        codes = np.asarray(values.cat.codes) + 1
+        rows = np.repeat(np.arange(len(codes)), self.counts[codes])
+        # Position of each output row within its value's block of subgenres
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(self.counts[codes]) - self.counts[codes],
+                                                   self.counts[codes])
+        table = self.starts[codes[rows]] + offsets
+        return rows, self.subgenres[table], self.weights[table]
+
+
+class TopTotals:
+    """Streams and time played per artist and per track over some plays, for top-N lists.
+
+    Artists are totalled from the cube's per-day artist view and tracks from the plays in
+    one `factorize` and `bincount` pass, so every panel ranking artists or tracks by
+    either measure shares one computation per range. Lists come from a partial sort
+    (`np.argpartition`) and carry both measures.
+    """
+
+    def __init__(self, plays, artist_cells):
+        self.artist_names = plays[ARTIST_COL].cat.categories
+        codes = artist_cells[ARTIST_COL].cat.codes.to_numpy()
+        known = codes >= 0
+        self.artist_codes, self.artist_sums = _totals(
+            codes[known], artist_cells["streams"].to_numpy()[known], artist_cells["ms_played"].to_numpy()[known])
+        ids = plays["track_id"]
+        known = ids.notna().to_numpy()
+        codes, self.track_ids = pd.factorize(ids.to_numpy(dtype=np.int64, na_value=0)[known])
+        streams = np.bincount(codes, minlength=len(self.track_ids))
+        ms = np.bincount(codes, weights=plays["ms_played"].to_numpy()[known], minlength=len(self.track_ids))
+        self.track_sums = {"streams": streams, "ms_played": ms.astype(np.int64)}
+
+    def artists(self, n, by="ms_played"):
+        """Top `n` artists by `by` ("streams" or "ms_played"), largest first."""
+        top = _top(self.artist_sums[by], n)
+        return pd.DataFrame({ARTIST_COL: self.artist_names.take(self.artist_codes[top]),
+                             **{m: v[top] for m, v in self.artist_sums.items()}})
+
+    def tracks(self, n, by="ms_played", artist=None):
+        """Top `n` tracks (by `track_id`), optionally of one artist only, largest first."""
+        rows = np.arange(len(self.track_ids))
+        if artist is not None:
+            rows = np.flatnonzero(self.track_ids >> 32 == self.artist_names.get_loc(artist))
+        top = rows[_top(self.track_sums[by][rows], n)]
+        return pd.DataFrame({"track_id": self.track_ids[top], **{m: v[top] for m, v in self.track_sums.items()}})
+
+    def track_artists(self, n, by="ms_played"):
+        """Top `n` artists counting only plays with a known track, largest first."""
+        codes, sums = _totals(self.track_ids >> 32, self.track_sums["streams"], self.track_sums["ms_played"])
+        top = _top(sums[by], n)
+        return pd.DataFrame({ARTIST_COL: self.artist_names.take(codes[top]), **{m: v[top] for m, v in sums.items()}})
+
+
+def _totals(codes, streams, ms):
+    """(codes present, {measure: total}) summing per-row `streams` and `ms` by code."""
+    streams = np.bincount(codes, weights=streams)
+    ms = np.bincount(codes, weights=ms)
+    present = np.flatnonzero(streams)
+    return present, {"streams": streams[present].astype(np.int64), "ms_played": ms[present].astype(np.int64)}
+
+def _top(values, n):
+    """Positions of the `n` largest `values`, largest first (ties in position order)."""
+    if n < len(values):
+        # A partition picks arbitrarily among values tied with the n-th: keep the first
+        kth = -np.partition(-values, n - 1)[n - 1]
+        above = np.flatnonzero(values > kth)
+        part = np.sort(np.concatenate([above, np.flatnonzero(values == kth)[:n - len(above)]]))
+    else:
+        part = np.arange(len(values))
+    return part[np.argsort(-values[part], kind="stable")]
+
+
+class DayBitmaps:
+    """Days each entity was played on, as chunked bitsets.
+
+    Days are cut into 64-day words counted from `first_day`, and each entity keeps only
+    its non-empty words (word number and bits), stored by entity in one pair of arrays,
+    so an entity heard on a handful of days costs a handful of words. Membership tests
+    and intersections with a set of days are word-wise ANDs and popcounts.
+    """
+
+    def __init__(self, labels, codes, days):
+        self.labels = pd.Index(labels)
+        known = codes >= 0
+        codes, days = codes[known].astype(np.int64), days[known].astype(np.int64)
+        self.first_day = int(days.min()) if len(days) else 0
+        offsets = days - self.first_day
+        n_words = int(offsets.max()) // 64 + 1 if len(days) else 1
+        key = codes * n_words + offsets // 64
+        order = np.argsort(key, kind="stable")
+        key, bits = key[order], np.left_shift(np.uint64(1), (offsets[order] % 64).astype(np.uint64))
+        firsts = np.flatnonzero(np.diff(key, prepend=-1))
+        entities, self.words = np.divmod(key[firsts], n_words)
+        self.bits = np.bitwise_or.reduceat(bits, firsts) if len(firsts) else bits
+        self.starts = np.searchsorted(entities, np.arange(len(self.labels) + 1))
+
+    def _entity(self, label):
+        code = self.labels.get_loc(label)
+        return slice(self.starts[code], self.starts[code + 1])
+
+    def days(self, label):
+        """Sorted day ordinals `label` was played on."""
+        rows = self._entity(label)
+        bits = np.unpackbits(self.bits[rows].astype("<u8").view(np.uint8), bitorder="little")
+        word, bit = np.divmod(np.flatnonzero(bits), 64)
+        return self.first_day + self.words[rows][word] * 64 + bit
+
+    def count(self, label, days=None):
+        """Number of days `label` was played on, or of `days` it was played on."""
+        rows = self._entity(label)
+        words, bits = self.words[rows], self.bits[rows]
+        if days is not None:
+            mask_words, mask_bits = self.mask(days)
+            words, mine, theirs = np.intersect1d(words, mask_words, assume_unique=True, return_indices=True)
+            bits = bits[mine] & mask_bits[theirs]
+        return int(np.bitwise_count(bits).sum())
+
+    def mask(self, days):
+        """(words, bits) of a set of day ordinals on this index's word grid."""
+        offsets = np.asarray(days, dtype=np.int64) - self.first_day
+        offsets = offsets[offsets >= 0]
+        words, inverse = np.unique(offsets // 64, return_inverse=True)
+        bits = np.zeros(len(words), dtype=np.uint64)
+        np.bitwise_or.at(bits, inverse, np.left_shift(np.uint64(1), (offsets % 64).astype(np.uint64)))
+        return words, bits
+
+
+def day_bitmaps(df):
+    """`DayBitmaps` of the days each artist was played on, by artist name."""
+    return DayBitmaps(df[ARTIST_COL].cat.categories, df[ARTIST_COL].cat.codes.to_numpy(), df["day"].to_numpy())
+
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+class CalendarGrid:
+    """Cells of the listening calendar for days `first` through `last` (day ordinals).
+
+    Ranges of up to `daily_max_days` days get a cell per day: a column per week, labelled
+    with its Monday's date, and a row per weekday. Longer ones get a cell per ISO week
+    (week-number columns, a row per ISO year) or, past `weekly_max_days`, per month
+    (month columns, a row per year), so the figure stays about the same size however long
+    the history gets. `cols` and `rows` give each day's cell as positions on the heatmap's
+    axes; `x` and `y` are the axis labels.
+
+    Every cell covers a run of consecutive days, so `starts` and `lengths`, (rows, cols)
+    arrays of each cell's first day ordinal (-1 when outside the range) and day count,
+    turn selected cells back into days without a lookup per day. On the daily grid,
+    `starts` is the (weekday, week) → day ordinal table itself.
+    """
+
+    def __init__(self, first, last, daily_max_days, weekly_max_days):
+        self.days = np.arange(first, last + 1)
+        if len(self.days) <= daily_max_days:
+            self.mode = "day"
+            dow = (self.days + 3) % 7  # day 0, 1970-01-01, was a Thursday
+            self.first_monday = int(self.days[0] - dow[0])
+            self.cols, self.rows = (self.days - dow - self.first_monday) // 7, dow
+            mondays = np.arange(self.cols[-1] + 1) * 7 + self.first_monday
+            self.x = mondays.astype("datetime64[D]").astype(str).tolist()
+            self.y = DAY_NAMES
+        else:
+            if len(self.days) <= weekly_max_days:
+                self.mode = "week"
+                iso = pd.DatetimeIndex(self.days.astype("datetime64[D]")).isocalendar()
+                years, self.cols = iso["year"].to_numpy(), iso["week"].to_numpy() - 1
+                self.x = [str(w) for w in range(1, 54)]
+            else:
+                self.mode = "month"
+                years, self.cols = np.divmod(day_months(self.days).astype(np.int64), 12)
+                self.x = MONTH_NAMES
+            self.rows = years - years[0]
+            self.y = [str(y) for y in range(years[0], years[-1] + 1)]
+        self.shape = (len(self.y), len(self.x))
+        self.cells = self.rows * self.shape[1] + self.cols
+        cells, firsts, counts = np.unique(self.cells, return_index=True, return_counts=True)
+        self.starts = np.full(self.shape, -1, dtype=np.int64)
+        self.lengths = np.zeros(self.shape, dtype=np.int64)
+        self.starts.flat[cells], self.lengths.flat[cells] = self.days[firsts], counts
+        self._x_index = {label: i for i, label in enumerate(self.x)}
+        self._y_index = {label: i for i, label in enumerate(self.y)}
+
+    def values(self, day_values):
+        """Per-day values (aligned with `days`) summed into a (rows, cols) matrix. Cells
+        without a day of the range are NaN, which Plotly leaves blank."""
+        size = self.shape[0] * self.shape[1]
+        sums = np.bincount(self.cells, weights=day_values, minlength=size)
+        return np.where(np.bincount(self.cells, minlength=size) > 0, sums, np.nan).reshape(self.shape)
+
+    def x_position(self, x):
+        """Column position of a value on the x axis (a date on the daily grid's axis), or
+        NaN for a value off this grid's axis, as a selection kept from another mode has."""
+        try:
+            if self.mode == "day":
+                return (pd.Timestamp(x).value / NS_PER_DAY - self.first_monday) / 7
+            return float(x)
+        except (TypeError, ValueError, OverflowError):
+            return np.nan
+
+    def box(self, x_range, y_range):
+        """Day ordinals of the cells a box selection covers (its edges in axis values,
+        rounded to the nearest cell like Plotly's highlight)."""
+        cols = [self.x_position(x) for x in x_range]
+        if not np.all(np.isfinite(cols)):
+            return self.days[:0]
+        col_min, col_max = sorted(round(c) for c in cols)
+        row_min, row_max = sorted(round(y) for y in y_range)
+        return self.days[(self.cols >= col_min) & (self.cols <= col_max)
+                         & (self.rows >= row_min) & (self.rows <= row_max)]
+
+    def points(self, labels):
+        """Day ordinals of the cells at the given (x, y) axis labels, in that order."""
+        cols, rows = [], []
+        for x, y in labels:
+            if self.mode == "day":
+                col = self.x_position(x)
+                col = round(col) if np.isfinite(col) else None
+            else:
+                col = self._x_index.get(str(x))
+            row = self._y_index.get(str(y))
+            if col is not None and row is not None and 0 <= col < self.shape[1]:
+                cols.append(col)
+                rows.append(row)
+        starts, lengths = self.starts[rows, cols], self.lengths[rows, cols]
+        # Concatenated aranges: each cell's first day plus the offsets within its run
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(starts, lengths) + offsets
+
+
+class FirstSeenIndex:
+    """When each artist and track was first played, as sorted arrays.
+
+    `artist_ts` and `track_ts` hold first-play times (ns since the epoch), so the number
+    of artists or tracks first heard in a time range is two binary searches. The tracks'
+    first-play months (`track_months`) and the number of distinct tracks played in each
+    month (`months`, `month_tracks`) split any month into new and revisited tracks the
+    same way.
+    """
+
+    def __init__(self, df, first_artist, first_track):
+        self.artist_ts = np.sort(_ns(first_artist))
+        self.track_ts = np.sort(_ns(first_track))
+        self.track_months = day_months(self.track_ts // NS_PER_DAY)
+        per_month = df["track_id"].groupby(df["month"]).nunique()
+        per_month = per_month[per_month > 0]
+        self.months = per_month.index.to_numpy()
+        self.month_tracks = per_month.to_numpy()
+
+    def first_heard(self, start, end):
+        """(artists, tracks) first played between timestamps `start` and `end` inclusive."""
+        start, end = _ns(pd.Series([start, end]))
+        return tuple(int(np.searchsorted(ts, end, side="right") - np.searchsorted(ts, start, side="left"))
+                     for ts in (self.artist_ts, self.track_ts))
+
+    def monthly_tracks(self, first_month, last_month):
+        """(months, new, revisited): months from `first_month` through `last_month` with
+        track plays, and how many of the distinct tracks played in each were first played
+        that month (new) or before it (revisited)."""
+        start = np.searchsorted(self.months, first_month, side="left")
+        stop = np.searchsorted(self.months, last_month, side="right")
+        months = self.months[start:stop]
+        new = (np.searchsorted(self.track_months, months, side="right")
+               - np.searchsorted(self.track_months, months, side="left"))
+        return months, new, self.month_tracks[start:stop] - new
+
+
+class MonthlyRanks:
+    """Entities ranked by a measure within each month.
+
+    Built from per-month totals with a sorted (month, entity) index. An entity's rank in
+    a month is 1 + the number of entities with a larger total (pandas' `method="min"`),
+    counted in one pass for all the months it appears in, so nothing is sorted.
+    """
+
+    def __init__(self, totals):
+        self.entities = totals.index.get_level_values(1)
+        self.values = totals.to_numpy(dtype=float)
+        self.months, starts = np.unique(totals.index.get_level_values(0).to_numpy(), return_index=True)
+        self.segment = np.repeat(np.arange(len(self.months)), np.diff(np.append(starts, len(self.values))))
+
+    def series(self, entity, first_month, last_month):
+        """(months, totals, ranks) of `entity` from `first_month` through `last_month`,
+        for the months it has a total in."""
+        rows = np.flatnonzero(self.entities == entity)
+        rows = rows[(self.months[self.segment[rows]] >= first_month)
+                    & (self.months[self.segment[rows]] <= last_month)]
+        segment = self.segment[rows]
+        threshold = np.full(len(self.months), np.inf)
+        threshold[segment] = self.values[rows]
+        above = np.bincount(self.segment[self.values > threshold[self.segment]], minlength=len(self.months))
+        return self.months[segment], self.values[rows], 1 + above[segment]
+
+
+def _ns(ts):
+    """Nanoseconds since the epoch of a datetime Series, whatever its unit."""
+    return ts.array.as_unit("ns").asi8
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """Days a view covers: `first` through `last` (day ordinals), narrowed to `days`
+    (sorted ordinals) when only some of them are selected."""
+
+    first: int
+    last: int
+    days: tuple = None
+
+    def narrow(self, days):
+        """This spec restricted to the given days (those outside the range are dropped)."""
+        days = np.unique(np.asarray(days, dtype=np.int64))
+        return FilterSpec(self.first, self.last,
+                          tuple(days[(days >= self.first) & (days <= self.last)].tolist()))
+
+    def slice(self, index):
+        """What `index` (a `DayIndex` or `RollupCube`) holds for the spec's days."""
+        if self.days is None:
+            return index.range(self.first, self.last)
+        return index.select(self.days)
+
+
+@dataclass(frozen=True, eq=False)
+class Dataset:
+    """A loaded play frame with its first-seen index, rollup cube and the day bitmaps of
+    its artists (see `day_bitmaps`).
+
+    `version` (the loader's `attrs["version"]`) changes whenever the plays do, so it
+    stands in for the frame as a cache key: cached functions take a `Dataset` and a
+    `FilterSpec` and are keyed on the version and the spec's days, never on the frame's
+    contents. Handles and their tables are never modified.
+    """
+
+    plays: pd.DataFrame
+    version: str
+    first_seen: FirstSeenIndex
+    cube: RollupCube
+    artist_days: DayBitmaps
+
+    @cached_property
+    def day_index(self):
+        return DayIndex(self.plays)
+
+    def plays_in(self, spec):
+        """Plays covered by `spec` (a read-only view when they are contiguous)."""
+        return spec.slice(self.day_index)
+
+    def cube_in(self, spec):
+        """`CubeSlice` covered by `spec`."""
+        return spec.slice(self.cube)
+
+
+def sessionize(df, gap_minutes):
+    """Listening sessions of a play frame: runs of plays, in start order, where each play
+    starts at most `gap_minutes` after the previous one ended.
+
+    One row per session, ordered by start, with the `day` ordinal it starts on (a range
+    or day selection takes whole sessions by start day), its `start` and `end` times,
+    `minutes` played, `plays` and `skips`.
+    """
+    start, end = _ns(df["start_ts"]), _ns(df["ts"])
+    order = np.argsort(start, kind="stable")
+    start, end = start[order], end[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = start[1:] - end[:-1] > gap_minutes * 60 * 10**9
+    firsts = np.flatnonzero(is_first)
+    ms = df["ms_played"].to_numpy()[order].astype(np.int64)
+    skips = df["skipped"].to_numpy()[order].astype(np.int64)
+    return pd.DataFrame({
+        "day": (start[firsts] // NS_PER_DAY).astype(np.int32),
+        "start": pd.to_datetime(start[firsts], utc=True),
+        "end": pd.to_datetime(np.maximum.reduceat(end, firsts), utc=True),
+        "minutes": np.add.reduceat(ms, firsts) / 60000,
+        "plays": np.diff(np.append(firsts, len(order))),
+        "skips": np.add.reduceat(skips, firsts),
+    })
+
+
+CUBE_MEASURES = ("streams", "ms_played", "skips", "skip_ms")
+
+def day_runs(days):
+    """(starts, lengths) of the runs of consecutive ordinals in sorted, distinct `days`."""
+    days = np.asarray(days, dtype=np.int64)
+    starts = np.flatnonzero(np.diff(days, prepend=days[:1] - 2) != 1)
+    return days[starts], np.diff(np.append(starts, len(days)))
+
+def rollup(df, dims, weights):
+    """Sum `weights` (name -> per-row array; None counts rows) over rows sharing `day` and
+    `dims`, ordered by day and then by dims. Categorical dims keep their dictionaries."""
+    day = df["day"].to_numpy().astype(np.int64)
+    first_day = day.min() if len(day) else 0
+    key, sizes = day - first_day, []
+    for dim in dims:
+        col = df[dim]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # Shift codes by one so missing names (-1) become 0
+            codes, size = col.cat.codes.to_numpy() + 1, len(col.cat.categories) + 1
+        else:
+            codes = col.to_numpy()
+            size = int(codes.max()) + 1 if len(codes) else 1
+        key = key * size + codes
+        sizes.append(size)
+    keys, inverse = np.unique(key, return_inverse=True)
+    sums = {name: np.bincount(inverse, weights=w, minlength=len(keys)).astype(np.int64)
+            for name, w in weights.items()}
+    cols = {}
+    for dim, size in zip(reversed(dims), reversed(sizes)):
+        keys, codes = np.divmod(keys, size)
+        col = df[dim]
+        cols[dim] = (pd.Categorical.from_codes(codes - 1, dtype=col.dtype)
+                     if isinstance(col.dtype, pd.CategoricalDtype) else codes.astype(col.dtype))
+    day = (keys + first_day).astype(np.int32)
+    return pd.DataFrame({"day": day, "month": day_months(day), **{d: cols[d] for d in dims}, **sums})
+
+
+# ----------------------------
+# HyperLogLog distinct counts
+# ----------------------------
+# 2**11 one-byte registers per day and entity. The estimate's relative standard error
+# is about 1.04 / sqrt(2**11) ≈ 2.3% for large counts, so about 95% of estimates fall
+# within ±4.6%; for counts of a few thousand or less it is smaller still.
+HLL_PRECISION = 11
+
+def hll_registers(rows, hashes, n_rows, p=HLL_PRECISION):
+    """HyperLogLog registers (`n_rows` x 2**p, uint8) for 64-bit `hashes` filed under `rows`.
+
+    The top p bits of a hash pick the register; the register keeps the maximum rank
+    (leading zeros + 1) of the remaining bits, of which the top 52 are used so the bit
+    length is exact in float64. Needs p <= 12.
+    """
+    m = 1 << p
+    index = (hashes >> np.uint64(64 - p)).astype(np.int64)
+    rest = (hashes << np.uint64(p)) >> np.uint64(12)
+    _, bit_length = np.frexp(rest.astype(np.float64))
+    regs = np.zeros(n_rows * m, dtype=np.uint8)
+    np.maximum.at(regs, rows * m + index, (53 - bit_length).astype(np.uint8))
+    return regs.reshape(n_rows, m)
+
+def hll_estimate(registers):
+    """Cardinality estimate from a (merged) register array.
+
+    Uses Ertl's improved raw estimator ("New cardinality estimation algorithms for
+    HyperLogLog sketches", 2017), which stays unbiased from a handful of values up,
+    without the linear-counting switch-over or bias tables.
+    """
+    m, q = registers.size, 52  # ranks run 1..q+1 (see `hll_registers`)
+    counts = np.bincount(registers.ravel(), minlength=q + 2)
+    z = m * _hll_tau(1 - counts[q + 1] / m)
+    for k in range(q, 0, -1):
+        z = 0.5 * (z + counts[k])
+    z += m * _hll_sigma(counts[0] / m)
+    return int(round(m * m / (2 * np.log(2) * z))) if np.isfinite(z) else 0
+
+def _hll_sigma(x):
+    if x == 1:
+        return np.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        z_old, z = z, z + x * y
+        y += y
+        if z == z_old:
+            return z
+
+def _hll_tau(x):
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = np.sqrt(x)
+        y *= 0.5
+        z_old, z = z, z - (1 - x) ** 2 * y
+        if z == z_old:
+            return z / 3
+
+def _day_sketches(df, days):
+    """Per-day registers of the tracks, artists and albums in `df`; row i is `days[i]`."""
+    rows = np.searchsorted(days, df["day"].to_numpy())
+    artist = df[ARTIST_COL].cat.codes.to_numpy() >= 0
+    artist_hash = name_hashes(df[ARTIST_COL])
+    track = df["track_id"].notna().to_numpy()
+    album = df[ALBUM_COL].cat.codes.to_numpy() >= 0
+    entities = {
+        "tracks": (track, fmix64(artist_hash ^ fmix64(name_hashes(df[TRACK_COL])))),
+        "artists": (artist, fmix64(artist_hash.copy())),
+        "albums": (album, fmix64(name_hashes(df[ALBUM_COL]))),
+    }
+    return {name: hll_registers(rows[keep], hashes[keep], len(days))
+            for name, (keep, hashes) in entities.items()}
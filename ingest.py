@@ -0,0 +1,765 @@
+"""Ingest engine: turns a raw listening-history export into the enriched play frame.
+
+Everything here is plain pandas/NumPy (no Streamlit), so the dashboard can wrap it
+in its own caches and worker pools.
+
+Prepared frame schema (derived columns):
+
+    ts, start_ts   datetime64[ns, UTC]  play end / start
+    ms_played      uint32               negative or missing durations become 0
+    skipped        bool
+    day            int32                days since 1970-01-01 (UTC), see `to_day`/`from_day`
+    month          int16                year * 12 + month - 1, see `month_label(s)`
+    year           int16
+    dow, hour      int8                 Monday = 0; hour of day in UTC
+    names/genres   category             one sorted dictionary per column
+    track_id       Int64                packed (artist, track) codes, see `encode_track_ids`
+
+Day and month stay numeric end to end; display strings are produced only when a
+chart needs them.
+
+Loaders return frames sorted by `ts` and set `df.attrs["version"]`, a key derived from
+the source contents that per-dataset caches can be keyed on, and
+`df.attrs["duplicates_dropped"]`.
+"""
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import types
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from pathlib import Path, PurePath
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STRING_COLUMNS = ["master_metadata_track_name", "master_metadata_album_artist_name",
+                  "master_metadata_album_album_name", "genre_bucket", "artist_genres"]
+# Raw export columns the dashboard reads; anything else in the file is not loaded
+EXPORT_COLUMNS = ["ts", "ms_played", *STRING_COLUMNS, "artist_popularity", "skipped"]
+
+# On-disk cache of prepared frames (Parquet), shared across uploads and server restarts.
+# Functions taking `cache_dir` default to whatever this is set to when they are called.
+CACHE_DIR = Path(__file__).resolve().parent / ".cache" / "frames"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Persistent play stores for append mode (not evicted, unlike the cache), each opened by
+# a random key (see `new_store_key`)
+STORE_DIR = Path(__file__).resolve().parent / ".data" / "plays"
+# Store keys: 18 random bytes in URL-safe base64 (see `new_store_key`)
+STORE_KEY_BYTES = 18
+_STORE_KEY = re.compile(r"[A-Za-z0-9_-]{24}")
+
+# Working-memory budget for parsing. Exports whose parse would exceed it are read in
+# chunks sized to fit; the budget bounds transient copies, not the final frame.
+INGEST_MEMORY_BUDGET = 256 * 1024 * 1024
+# Rough in-memory bytes per CSV byte while a chunk is parsed, cleaned and derived
+_PARSE_EXPANSION = 6
+_PROBE_ROWS = 10_000
+
+NULL_TOKENS = ["nan", "none", "undefined", "null", ""]
+TRUE_TOKENS = ["true", "t", "1", "yes", "y"]
+
+
+def clean_string(s):
+    if pd.isna(s): return None
+    s = str(s).strip()
+    return None if s.lower() in NULL_TOKENS else s
+
+def _to_bool(x):
+    if isinstance(x, bool): return x
+    if pd.isna(x): return False
+    return str(x).strip().lower() in TRUE_TOKENS
+
+def _lookup(series, fn, missing, dtype=object):
+    """Evaluate `fn` once per distinct value of `series` and broadcast through the codes.
+
+    Listening histories repeat the same few thousand names millions of times, so a
+    factorize + table take replaces one Python call per row with one per unique value.
+    Missing values map to `missing`.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    table = np.array([fn(u) for u in uniques] + [missing], dtype=dtype)
+    return table[codes]
+
+def categorize_strings(s):
+    """Clean a string column into a Categorical with a sorted dictionary.
+
+    `clean_string` runs once per distinct raw value; raw spellings that clean to the
+    same name (e.g. padded whitespace) share one category, and null tokens become NaN.
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    cleaned = pd.Categorical([clean_string(u) for u in uniques])
+    table = np.append(cleaned.codes, -1).astype(cleaned.codes.dtype)
+    return pd.Series(pd.Categorical.from_codes(table[codes], dtype=cleaned.dtype),
+                     index=s.index, name=s.name)
+
+def to_bool_series(s):
+    """Vectorized `_to_bool` over a whole column."""
+    return pd.Series(_lookup(s, _to_bool, False, dtype=bool), index=s.index, name=s.name)
+
+EPOCH = date(1970, 1, 1)
+
+def to_day(d):
+    """Day ordinal (days since 1970-01-01) of a date."""
+    return (d - EPOCH).days
+
+def from_day(n):
+    """Date of a day ordinal."""
+    return EPOCH + timedelta(days=int(n))
+
+def month_index(d):
+    """Month index (year * 12 + month - 1) of a date."""
+    return d.year * 12 + d.month - 1
+
+def day_months(days):
+    """Month indexes of an array of day ordinals."""
+    months = np.asarray(days).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return (months + 1970 * 12).astype(np.int16)
+
+def month_label(m):
+    """'YYYY-MM' label of a month index."""
+    m = int(m)
+    return f"{m // 12:04d}-{m % 12 + 1:02d}"
+
+def month_labels(months):
+    """'YYYY-MM' labels for an array of month indexes, formatted once per distinct month."""
+    return _lookup(np.asarray(months), month_label, None)
+
+def encode_track_ids(df):
+    """Set `track_id` to the (artist, track) pair of dictionary codes packed into one int64.
+
+    The high 32 bits hold the artist code and the low 32 bits the track-name code, so
+    ids stay valid exactly as long as the two dictionaries do: re-derive after any
+    recoding (see `share_dictionaries`). Missing artist or track gives <NA>.
+    """
+    artist_col, track_col = "master_metadata_album_artist_name", "master_metadata_track_name"
+    if artist_col not in df.columns or track_col not in df.columns:
+        df["track_id"] = pd.array([pd.NA] * len(df), dtype="Int64")
+        return df
+    a = df[artist_col].cat.codes.to_numpy().astype(np.int64)
+    t = df[track_col].cat.codes.to_numpy().astype(np.int64)
+    missing = (a < 0) | (t < 0)
+    df["track_id"] = pd.arrays.IntegerArray(np.where(missing, 0, (a << 32) | t), missing)
+    return df
+
+def decode_track_ids(df, ids):
+    """(track names, artist names) arrays for `track_id` values of `df`."""
+    ids = np.asarray(ids, dtype=np.int64)
+    artists = df["master_metadata_album_artist_name"].cat.categories.take(ids >> 32)
+    tracks = df["master_metadata_track_name"].cat.categories.take(ids & 0xFFFFFFFF)
+    return tracks.to_numpy(), artists.to_numpy()
+
+def share_dictionaries(parts):
+    """Recode the categorical columns of every part onto one sorted dictionary per column,
+    so the parts concatenate without falling back to object strings."""
+    for c in STRING_COLUMNS:
+        present = [p for p in parts if c in p.columns]
+        if not present:
+            continue
+        categories = pd.Index(np.unique(np.concatenate(
+            [p[c].cat.categories.to_numpy(dtype=object) for p in present])))
+        for p in present:
+            if not p[c].cat.categories.equals(categories):
+                p[c] = p[c].cat.set_categories(categories)
+    return parts
+
+def read_prepared_parquet(path):
+    """Read back a prepared frame stored with `to_parquet`.
+
+    Parquet returns a categorical with an empty dictionary (a column that is missing on
+    every row, like the genres of a raw JSON export) as plain `object`, so the name and
+    genre columns are turned back into Categoricals here.
+    """
+    df = pd.read_parquet(path)
+    for c in STRING_COLUMNS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    return df
+
+def prepare_frame(df, since=None):
+    """Parse, clean and derive columns on a raw export frame (in place where possible).
+
+    Name and genre columns come out as Categoricals and `track_id` as packed integer
+    codes (see `encode_track_ids`). With `since`, rows at or before that timestamp are
+    dropped right after `ts` is parsed, before any other column is touched.
+    """
+    df["ts"] = pd.to_datetime(df["ts"], utc=True, errors="coerce")
+    keep = df["ts"].notna() if since is None else df["ts"] > since
+    if not keep.all():
+        df = df.take(np.flatnonzero(keep))
+    ms = pd.to_numeric(df["ms_played"], errors="coerce").fillna(0)
+    df["ms_played"] = ms.clip(0, np.iinfo(np.uint32).max).astype(np.uint32)
+    df["skipped"] = to_bool_series(df["skipped"])
+    df["artist_popularity"] = pd.to_numeric(df["artist_popularity"], errors="coerce")
+    ts = df["ts"]
+    df["day"] = ts.values.astype("datetime64[D]").astype(np.int64).astype(np.int32)
+    df["year"] = ts.dt.year.astype(np.int16)
+    df["month"] = (ts.dt.year * 12 + ts.dt.month - 1).astype(np.int16)
+    df["dow"] = ts.dt.dayofweek.astype(np.int8)
+    df["hour"] = ts.dt.hour.astype(np.int8)
+    df["start_ts"] = ts - pd.to_timedelta(df["ms_played"], unit="ms")
+
+    for c in STRING_COLUMNS:
+        if c in df.columns:
+            df[c] = categorize_strings(df[c])
+    return encode_track_ids(df)
+
+def fmix64(h):
+    """MurmurHash3 64-bit finalizer, in place on a uint64 array (wraps on overflow)."""
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xFF51AFD7ED558CCD)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xC4CEB9FE1A85EC53)
+    h ^= h >> np.uint64(33)
+    return h
+
+def name_hashes(col):
+    """uint64 hash of each row's name, computed once per dictionary entry (0 if missing)."""
+    table = np.append(pd.util.hash_array(col.cat.categories.to_numpy(dtype=object)), np.uint64(0))
+    return table[col.cat.codes.to_numpy()]
+
+def play_fingerprints(df):
+    """64-bit fingerprint of each play's (ts, artist, track, ms_played).
+
+    Names enter through hashes of their strings rather than category codes, so
+    fingerprints agree across frames with different dictionaries.
+    """
+    h = fmix64(df["ts"].array.asi8.view(np.uint64).copy())
+    for c in ("master_metadata_album_artist_name", "master_metadata_track_name"):
+        if c in df.columns:
+            h = fmix64(h ^ name_hashes(df[c]))
+    return fmix64(h ^ df["ms_played"].to_numpy().astype(np.uint64))
+
+def drop_duplicate_plays(df):
+    """Drop repeated (ts, track, ms_played) plays, keeping the first, in one hashed pass.
+
+    Overlapping exports and concatenated uploads repeat rows verbatim. Rows are compared
+    by `play_fingerprints`; with 64-bit fingerprints, a false match among 10M distinct
+    plays has a probability below 1e-5. The running total of dropped rows is kept in
+    `df.attrs["duplicates_dropped"]`.
+    """
+    dup = pd.Series(play_fingerprints(df)).duplicated().to_numpy()
+    dropped = int(dup.sum()) + df.attrs.get("duplicates_dropped", 0)
+    if dup.any():
+        df = df.take(np.flatnonzero(~dup))
+    df.attrs["duplicates_dropped"] = dropped
+    return df
+
+def sort_by_ts(df):
+    """Stable-sort plays by `ts` (skipped when already in order) under a fresh RangeIndex.
+
+    Every frame the loaders return is in this order, so `day` is non-decreasing and
+    any day range is one contiguous block of rows (see `dataset.DayIndex`).
+    """
+    if not df["ts"].is_monotonic_increasing:
+        df = df.take(np.argsort(df["ts"].array.asi8, kind="stable"))
+    df.index = pd.RangeIndex(len(df))
+    return df
+
+
+# ----------------------------
+# Columnar frame cache
+# ----------------------------
+def _engine_fingerprint():
+    """Hash of this module's source and the pandas version.
+
+    Any edit to the ingest code (and so any change to the prepared schema) yields a
+    new fingerprint, which orphans every cache entry written by the old code.
+    """
+    h = hashlib.blake2b(Path(__file__).read_bytes(), digest_size=8)
+    h.update(pd.__version__.encode())
+    return h.hexdigest()
+
+ENGINE_FINGERPRINT = _engine_fingerprint()
+
+def content_hash(source, chunk_size=1 << 20):
+    """Hash the raw bytes of a path or file-like object without loading it whole."""
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            while chunk := fh.read(chunk_size):
+                h.update(chunk)
+    elif hasattr(source, "getbuffer"):
+        h.update(source.getbuffer())
+    else:
+        source.seek(0)
+        while chunk := source.read(chunk_size):
+            h.update(chunk)
+        source.seek(0)
+    return h.hexdigest()
+
+def _bytes_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def combined_version(versions):
+    """Order-independent version key for a frame merged from parts with these versions."""
+    return _bytes_hash("\n".join(sorted(versions)).encode())
+
+def _cache_path(digest, cache_dir=None):
+    return Path(cache_dir or CACHE_DIR) / f"{digest}-{ENGINE_FINGERPRINT}.parquet"
+
+def _temp_path(path):
+    """A new, empty temporary file next to `path`, to be moved over it once written.
+    Every writer gets its own, so concurrent writes of one entry (the same file uploaded
+    twice, or by two sessions) never write into each other."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    os.close(fd)
+    return Path(tmp)
+
+def read_cached_frame(digest, cache_dir=None):
+    """Return the cached prepared frame for `digest`, or None on a miss."""
+    path = _cache_path(digest, cache_dir)
+    if not path.exists():
+        return None
+    try:
+        df = read_prepared_parquet(path)
+    except Exception:
+        path.unlink(missing_ok=True)
+        return None
+    os.utime(path)  # mark as recently used for eviction
+    return df
+
+def write_cached_frame(digest, df, cache_dir=None, max_bytes=CACHE_MAX_BYTES):
+    """Store a prepared frame, then evict least-recently-used entries over `max_bytes`."""
+    path = _cache_path(digest, cache_dir)
+    tmp = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = _temp_path(path)
+        df.to_parquet(tmp, compression="zstd")
+        os.replace(tmp, path)
+    except Exception:
+        if tmp is not None:
+            tmp.unlink(missing_ok=True)
+        return
+    evict_cache(cache_dir, max_bytes)
+
+def evict_cache(cache_dir=None, max_bytes=CACHE_MAX_BYTES):
+    """Drop stale-schema entries, then the oldest entries until the cache fits `max_bytes`."""
+    entries = []
+    for p in Path(cache_dir or CACHE_DIR).glob("*.parquet"):
+        if not p.stem.endswith(ENGINE_FINGERPRINT):
+            p.unlink(missing_ok=True)
+            continue
+        info = p.stat()
+        entries.append((info.st_mtime, info.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+
+def _source_size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if hasattr(source, "getbuffer"):
+        return source.getbuffer().nbytes
+    return getattr(source, "size", 0)
+
+def _read_export(source, **kwargs):
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    return pd.read_csv(source, usecols=lambda c: c in EXPORT_COLUMNS, **kwargs)
+
+def iter_prepared_chunks(source, memory_budget=INGEST_MEMORY_BUDGET, progress=None, since=None):
+    """Yield prepared frames for consecutive slices of a CSV export.
+
+    A small probe chunk measures the in-memory cost per row; later chunks are sized
+    so one raw chunk plus its derived copy stays within `memory_budget`.
+    `progress(fraction)` is called after each chunk; `since` is passed to `prepare_frame`.
+    """
+    total = _source_size(source)
+    fh = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+    try:
+        with _read_export(fh, chunksize=_PROBE_ROWS) as reader:
+            rows, probing = _PROBE_ROWS, True
+            while True:
+                try:
+                    raw = reader.get_chunk(rows)
+                except StopIteration:
+                    break
+                if probing and len(raw):
+                    n_raw, raw_bytes = len(raw), raw.memory_usage(deep=True).sum()
+                    chunk = prepare_frame(raw, since)
+                    per_row = (raw_bytes + chunk.memory_usage(deep=True).sum()) / n_raw
+                    rows, probing = max(_PROBE_ROWS, int(memory_budget // (2 * per_row))), False
+                else:
+                    chunk = prepare_frame(raw, since)
+                del raw
+                yield chunk
+                if progress is not None and total:
+                    progress(min(fh.tell() / total, 1.0))
+    finally:
+        if fh is not source:
+            fh.close()
+
+def _arrow_schema(chunk):
+    """Arrow schema for a prepared chunk, widened so every later chunk fits it: all-missing
+    columns are typed as strings and dictionaries get int32 indices."""
+    schema = pa.Schema.from_pandas(chunk, preserve_index=True)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+        elif pa.types.is_dictionary(field.type):
+            schema = schema.set(i, field.with_type(pa.dictionary(pa.int32(), pa.string())))
+    return schema
+
+def ingest_chunked(source, digest, memory_budget=INGEST_MEMORY_BUDGET, progress=None,
+                   cache_dir=None):
+    """Chunked ingest that streams prepared chunks into a temporary Parquet file next to
+    the cache entry, then reads it back as the final compact frame and stores that as the
+    entry. The chunked file itself is never published: its row groups carry chunk-local
+    dictionaries and track_id codes."""
+    path = _cache_path(digest, cache_dir)
+    writer = tmp = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = _temp_path(path)
+        for chunk in iter_prepared_chunks(source, memory_budget, progress):
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, _arrow_schema(chunk), compression="zstd")
+            writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=True))
+        if writer is None:
+            return sort_by_ts(drop_duplicate_plays(prepare_frame(_read_export(source))))
+        writer.close()
+        df = read_prepared_parquet(tmp)
+    except OSError:
+        # Cache directory not writable: keep the prepared chunks in memory instead
+        if writer is not None:
+            writer.close()
+        parts = list(iter_prepared_chunks(source, memory_budget, progress))
+        if not parts:
+            return sort_by_ts(drop_duplicate_plays(prepare_frame(_read_export(source))))
+        return sort_by_ts(drop_duplicate_plays(encode_track_ids(pd.concat(share_dictionaries(parts)))))
+    finally:
+        if tmp is not None:
+            tmp.unlink(missing_ok=True)
+    # Re-sort the unified dictionaries and re-derive the ids; only this frame becomes the
+    # cache entry (if storing it fails, there is no entry and the next load re-ingests)
+    df = drop_duplicate_plays(encode_track_ids(share_dictionaries([df])[0]))
+    df = sort_by_ts(df)
+    write_cached_frame(digest, df, cache_dir)
+    return df
+
+def load_export(source, memory_budget=None, progress=None):
+    """Load a CSV export (path or file-like), going through the on-disk frame cache.
+
+    Exports too large to parse within `memory_budget` (default `INGEST_MEMORY_BUDGET`)
+    in one go are ingested chunk by chunk (see `ingest_chunked`).
+    """
+    memory_budget = memory_budget or INGEST_MEMORY_BUDGET
+    digest = content_hash(source)
+    df = read_cached_frame(digest)
+    if df is None and _source_size(source) * _PARSE_EXPANSION > memory_budget:
+        df = ingest_chunked(source, digest, memory_budget, progress)
+    elif df is None:
+        df = sort_by_ts(drop_duplicate_plays(prepare_frame(_read_export(source))))
+        write_cached_frame(digest, df)
+    df.attrs["version"] = digest
+    return df
+
+def load_exports(sources, memory_budget=None, progress=None, max_workers=None):
+    """Load several CSV exports concurrently and merge them into one frame in `ts` order.
+
+    Each file goes through `load_export`, so each keeps its own cache entry and adding a
+    file re-parses only that file. Workers are threads: the CSV tokenizer runs without
+    the GIL, and uploaded files and frames never need pickling. The memory budget is
+    split between the workers; `progress(fraction)` is called as files finish.
+    """
+    sources = list(sources)
+    if len(sources) == 1:
+        return load_export(sources[0], memory_budget, progress)
+    workers = min(len(sources), max_workers or os.cpu_count() or 1)
+    budget = (memory_budget or INGEST_MEMORY_BUDGET) // workers
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(load_export, src, budget) for src in sources]
+        for done, _ in enumerate(as_completed(futures), 1):
+            if progress is not None:
+                progress(done / len(futures))
+        parts = [f.result() for f in futures]
+    df = merge_sorted_parts(parts)
+    df.attrs["version"] = combined_version(p.attrs["version"] for p in parts)
+    return df
+
+
+# ----------------------------
+# Spotify extended streaming history (JSON)
+# ----------------------------
+def parse_history_json(data):
+    """Prepared frame for one `Streaming_History_Audio_*.json` payload.
+
+    Raw exports carry no enrichment, so `artist_popularity`, `artist_genres` and
+    `genre_bucket` come out empty. Module-level so it can run in a worker process.
+    """
+    records = json.loads(data)
+    df = pd.DataFrame.from_records(records, columns=EXPORT_COLUMNS)
+    return prepare_frame(df)
+
+def _history_members(source):
+    """(name, bytes) for every JSON payload in an uploaded/opened file or zip archive."""
+    name = getattr(source, "name", str(source))
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            data = fh.read()
+    else:
+        data = source.getvalue() if hasattr(source, "getvalue") else source.read()
+    if not zipfile.is_zipfile(io.BytesIO(data)):
+        return [(name, data)]
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        names = [n for n in zf.namelist()
+                 if n.lower().endswith(".json") and not PurePath(n).name.startswith(".")
+                 and "__MACOSX" not in n]
+        audio = [n for n in names if PurePath(n).name.startswith("Streaming_History_Audio")]
+        return [(n, zf.read(n)) for n in sorted(audio or names)]
+
+_POOL_LOCK = threading.Lock()
+_pool = None
+
+def _worker_started(barrier):
+    barrier.wait()
+
+def _worker_pool():
+    """The process pool for CPU-bound parsing, shared by every session and started on first
+    use with `forkserver` (or `spawn`), one worker per CPU.
+
+    Never `fork`: forking the multithreaded Streamlit server copies whatever locks other
+    threads hold at that moment, and a child can deadlock on one. The other start
+    methods run the parent's `__main__` file again in every new worker, and under
+    Streamlit that is the dashboard script, so a bare stand-in takes its place in
+    `sys.modules` while the workers are launched; they then import only this module (which
+    the fork server preloads). The swap is process-wide, so pools are built one at a time
+    under `_POOL_LOCK`, and every worker is started right away (each waits in its
+    initializer until all have been launched) rather than on some later submit, after
+    the real module is back. Streamlit installs a new `__main__` on every script run; if
+    one lands mid-launch, the pool is discarded and launched again.
+    """
+    global _pool
+    with _POOL_LOCK:
+        while _pool is None:
+            workers = os.cpu_count() or 1
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if context.get_start_method() == "forkserver":
+                context.set_forkserver_preload([__name__])
+            main, stand_in = sys.modules["__main__"], types.ModuleType("__main__")
+            sys.modules["__main__"] = stand_in
+            try:
+                pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_worker_started,
+                                           initargs=(context.Barrier(workers),))
+                for started in [pool.submit(os.getpid) for _ in range(workers)]:
+                    started.result()
+            finally:
+                replaced = sys.modules["__main__"] is not stand_in
+                if not replaced:
+                    sys.modules["__main__"] = main
+            if replaced:
+                pool.shutdown(wait=False, cancel_futures=True)
+            else:
+                _pool = pool
+        return _pool
+
+def _discard_pool(pool):
+    """Forget a broken pool (a worker died), so the next parse starts a fresh one."""
+    global _pool
+    with _POOL_LOCK:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def merge_sorted_parts(parts):
+    """Combine prepared frames into one frame in `ts` order with a fresh RangeIndex.
+
+    Exports are usually already chronological per file and split into disjoint time
+    ranges, so parts are ordered by their first timestamp and simply concatenated.
+    Only when ranges overlap is a stable sort run over the concatenation; since every
+    part is a presorted run, timsort reduces that to a k-way merge of the runs. Plays
+    repeated across parts are dropped (see `drop_duplicate_plays`).
+    """
+    dropped = sum(p.attrs.get("duplicates_dropped", 0) for p in parts)
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        df = prepare_frame(pd.DataFrame(columns=EXPORT_COLUMNS))
+        df.attrs["duplicates_dropped"] = dropped
+        return df
+    parts = [p if p["ts"].is_monotonic_increasing else p.sort_values("ts", kind="stable")
+             for p in parts]
+    parts.sort(key=lambda p: p["ts"].iloc[0])
+    df = encode_track_ids(pd.concat(share_dictionaries(parts), ignore_index=True))
+    df.attrs["duplicates_dropped"] = dropped
+    return sort_by_ts(drop_duplicate_plays(df))
+
+def load_history_json(sources):
+    """Load Spotify extended streaming history from JSON files and/or zip archives.
+
+    Each JSON payload is cached on disk by content hash; the rest are parsed in the
+    shared worker pool (see `_worker_pool`) and merged in `ts` order.
+    """
+    members = [m for src in sources for m in _history_members(src)]
+    parts, pending, digests = [], {}, []
+    for name, data in members:
+        digest = _bytes_hash(data)
+        digests.append(digest)
+        cached = read_cached_frame(digest)
+        if cached is not None:
+            parts.append(cached)
+        else:
+            pending[digest] = data
+    if pending:
+        pool = _worker_pool()
+        try:
+            frames = list(pool.map(parse_history_json, pending.values()))
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+        for digest, df in zip(pending, frames):
+            write_cached_frame(digest, df)
+            parts.append(df)
+    df = merge_sorted_parts(parts)
+    df.attrs["version"] = combined_version(digests)
+    return df
+
+
+# ----------------------------
+# First listens and the persistent play store
+# ----------------------------
+ARTIST_COL, TRACK_COL = "master_metadata_album_artist_name", "master_metadata_track_name"
+
+def first_listen_tables(df):
+    """First play time per artist (indexed by name) and per track (indexed by `track_id`)."""
+    first_artist = df.groupby(ARTIST_COL, observed=True)["ts"].min()
+    first_track = df.groupby("track_id")["ts"].min()
+    return first_artist, first_track
+
+def _first_listen_names(df):
+    """`first_listen_tables` keyed by plain names, so they outlive the frame's dictionaries."""
+    first_artist, first_track = first_listen_tables(df)
+    tracks, artists = decode_track_ids(df, first_track.index)
+    return (pd.DataFrame({ARTIST_COL: first_artist.index.astype(object), "ts": first_artist.array}),
+            pd.DataFrame({ARTIST_COL: artists, TRACK_COL: tracks, "ts": first_track.array}))
+
+def new_store_key():
+    """A fresh key for a new store. Keys are random, so a store can only be opened by
+    whoever was shown its key; there is no listing and no shared default."""
+    return secrets.token_urlsafe(STORE_KEY_BYTES)
+
+def _store_dir(key, store_dir):
+    """Directory of the store `key` opens, named by a hash of the key so that paths and
+    directory listings never reveal keys. Anything `new_store_key` cannot produce is
+    refused, so a store is never addressed by a guessable name."""
+    key = key.strip()
+    if not _STORE_KEY.fullmatch(key):
+        raise ValueError("Not a saved-history key (keys are generated by the app).")
+    return Path(store_dir) / _bytes_hash(key.encode())
+
+def read_store_meta(key, store_dir=STORE_DIR):
+    """Store manifest: parts in `ts` order, row count, `ts` high-water mark and the content
+    hashes of every source already ingested."""
+    path = _store_dir(key, store_dir) / "meta.json"
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {"parts": [], "rows": 0, "high_water": None, "sources": []}
+
+def store_version(key, store_dir=STORE_DIR):
+    """Cheap key that changes whenever rows are appended to the store."""
+    meta = read_store_meta(key, store_dir)
+    return f"{meta['rows']}@{meta['high_water']}"
+
+def _replace_file(path, write):
+    tmp = _temp_path(path)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def append_to_store(key, sources, memory_budget=None, progress=None, store_dir=STORE_DIR):
+    """Append the plays in `sources` (CSV exports, JSON files or zips) that are newer than
+    the store's high-water mark, and return how many rows were added.
+
+    CSV rows are cut on `ts` as soon as it is parsed, so only new rows are cleaned and
+    derived; JSON payloads go through the regular per-file cache and are cut afterwards.
+    Plays at or before the high-water mark are taken to be in the store already, which
+    holds for successive exports of the same account. Sources seen before (by content
+    hash) are skipped without parsing.
+    """
+    memory_budget = memory_budget or INGEST_MEMORY_BUDGET
+    root = _store_dir(key, store_dir)
+    meta = read_store_meta(key, store_dir)
+    since = pd.Timestamp(meta["high_water"]) if meta["high_water"] else None
+    parts, json_sources, digests = [], [], []
+    for src in sources:
+        digest = content_hash(src)
+        if digest in meta["sources"] or digest in digests:
+            continue
+        digests.append(digest)
+        if str(getattr(src, "name", src)).lower().endswith(".csv"):
+            parts.extend(iter_prepared_chunks(src, memory_budget, progress, since))
+        else:
+            json_sources.append(src)
+    if not digests:
+        return 0
+    if json_sources:
+        df = load_history_json(json_sources)
+        parts.append(df if since is None else df[df["ts"] > since])
+    new = merge_sorted_parts(parts)
+
+    root.mkdir(parents=True, exist_ok=True)
+    if len(new):
+        name = f"part-{len(meta['parts']):05d}.parquet"
+        new.to_parquet(root / name, compression="zstd")
+        _append_first_listens(root, new)
+        meta["parts"].append(name)
+        meta["rows"] += len(new)
+        meta["high_water"] = new["ts"].iloc[-1].isoformat()
+    meta["sources"].extend(digests)
+    _replace_file(root / "meta.json", lambda p: p.write_text(json.dumps(meta)))
+    return len(new)
+
+def _append_first_listens(root, new):
+    """Fold the first plays of an appended part into the stored first-listen tables.
+
+    Every appended play is later than everything already stored, so existing entries
+    never move: only names heard for the first time are added.
+    """
+    for fname, fresh in zip(("first_artists.parquet", "first_tracks.parquet"), _first_listen_names(new)):
+        path = root / fname
+        if path.exists():
+            old = pd.read_parquet(path)
+            keys = [c for c in old.columns if c != "ts"]
+            fresh = fresh[~pd.MultiIndex.from_frame(fresh[keys]).isin(pd.MultiIndex.from_frame(old[keys]))]
+            fresh = pd.concat([old, fresh], ignore_index=True)
+        _replace_file(path, lambda p: fresh.to_parquet(p, index=False))
+
+def load_store(key, store_dir=STORE_DIR):
+    """(plays, first_artist, first_track) for the store `key` opens.
+
+    The first-listen tables are the stored ones, re-keyed onto this frame's dictionaries
+    in the shape `first_listen_tables` returns, so nothing is rescanned.
+    """
+    root = _store_dir(key, store_dir)
+    meta = read_store_meta(key, store_dir)
+    df = merge_sorted_parts([read_prepared_parquet(root / p) for p in meta["parts"]])
+    df.attrs["version"] = combined_version([root.name, store_version(key, store_dir)])
+    if not meta["parts"]:
+        return df, *first_listen_tables(df)
+    fa = pd.read_parquet(root / "first_artists.parquet")
+    ft = pd.read_parquet(root / "first_tracks.parquet")
+    first_artist = pd.Series(fa["ts"].array, index=pd.Index(fa[ARTIST_COL]), name="ts")
+    a = df[ARTIST_COL].cat.categories.get_indexer(ft[ARTIST_COL]).astype(np.int64)
+    t = df[TRACK_COL].cat.categories.get_indexer(ft[TRACK_COL]).astype(np.int64)
+    first_track = pd.Series(ft["ts"].array, index=pd.Index((a << 32) | t, name="track_id"), name="ts")
+    return df, first_artist, first_track
@@ -216,12 +216,12 @@ st.markdown(f"""
         The layout follows a <strong>top-to-bottom narrative</strong> grouped into logical rows:
     </p>
     <p>
-        <strong>Filters</strong> - global controls pinned at the top: time preset radio (30d / 90d / 180d / Year / Lifetime), date range picker, Streams/Minutes toggle, Demo data and Life events checkboxes. These affect the entire dashboard.<br>
+        <strong>Filters</strong> - global controls pinned at the top: time preset radio (30d / 90d / 180d / Year / Lifetime), date range picker, Demo data checkbox and Exact counts toggle. These affect the entire dashboard. The Streams/Minutes selector sits just below the KPIs, since it only changes the charts.<br>
         <strong>KPIs</strong> - seven headline numbers providing immediate context.<br>
         <strong>Temporal row</strong> - Listening Clock, Sessions, Calendar Heatmap (+ rank sparklines in Lifetime mode) answer "when and how long?"<br>
-        <strong>Content row</strong> - No.1 artist/track, Discovery Rate, Old vs New answer "what do I listen to and how much is new?"<br>
+        <strong>Content row</strong> - No.1 artist/track and Discovery Rate answer "what do I listen to and how much is new?"<br>
         <strong>Genre hierarchy</strong> - Sunburst and Treemap side-by-side for hierarchical exploration.<br>
-        <strong>Genre Evolution</strong> - full-width stream chart, placed under the treemap for natural genre → genre-over-time reading order.<br>
+        <strong>Over time</strong> - full-width Old vs New and Genre Evolution charts with their Life events toggle, placed under the treemap for natural genre → genre-over-time reading order.<br>
         <strong>Deep dives</strong> - Niche Score scatter plot and Billboard ranked lists.<br>
         <strong>Profile</strong> - summary cards synthesizing five key insights.
     </p>
@@ -264,7 +264,7 @@ st.markdown(f"""
         <span class="badge">Personalization</span>
     </p>
     <p>
-        <strong>Global filtering</strong> - time presets (30d / 90d / 180d / Year / Lifetime), a date range picker, and a Streams/Minutes measure toggle re-slice the entire dashboard. All charts, KPIs, and derived metrics update simultaneously. This enables temporal comparison (e.g., "Did I discover more music this summer than last year?").
+        <strong>Global filtering</strong> - time presets (30d / 90d / 180d / Year / Lifetime), and a date range picker re-slice the entire dashboard. All charts, KPIs, and derived metrics update simultaneously; the Streams/Minutes measure selector recounts the charts. This enables temporal comparison (e.g., "Did I discover more music this summer than last year?").
     </p>
     <p>
         <strong>Heatmap direct manipulation</strong> - the GitHub-style heatmap supports box-select: dragging over a range of days filters all charts below to show only that selection. This makes the heatmap both a visualization <em>and</em> a filter control - a direct manipulation pattern where the same element serves double duty.
@@ -372,10 +372,10 @@ st.markdown(f"""
         <strong>Genre bucketing</strong>: Genre buckets are manually mapped from Spotify's freeform tags. This involves subjective choices and some artists span multiple buckets. The "Others" bucket is a catch-all for genres that don't fit neatly.
     </p>
     <p>
-        <strong>Streamlit constraints</strong>: As a Streamlit app, layout switching between Lifetime and filtered modes causes a full page re-render (no smooth CSS transitions). The heatmap box-select uses Plotly's event system which can vary across browsers.
+        <strong>Streamlit constraints</strong>: As a Streamlit app, layout switching between Lifetime and filtered modes causes a full page re-render (no smooth CSS transitions). Controls inside the charts (measure, session gap, life events, heatmap selection) only rerun their own fragment of the page, but a fragment cannot trigger another one: a heatmap selection redraws the whole dashboard, including the charts over time. The heatmap box-select uses Plotly's event system which can vary across browsers.
     </p>
     <p>
-        <strong>Privacy</strong>: The demo dataset ships with the dashboard. Users uploading their own data keep it local to their session - nothing is stored server-side.
+        <strong>Privacy</strong>: The demo dataset ships with the dashboard. Uploaded exports are parsed on the server, and the prepared plays are cached there as Parquet files under <code>.cache/frames</code>, named by a hash of the upload's contents, so the same file loads instantly next time. That cache is shared by every session on the server and survives restarts; entries stay until it grows past 512 MB and the least recently used ones are deleted. With <em>Save &amp; append</em> on, the plays are also kept in a saved history under <code>.data/plays</code>, together with first-listen tables and the content hashes of every file added. Each saved history is opened by a random key that the app generates and shows once, when the history is created; its directory is named by a hash of that key, and names you make up are refused, so nobody can open your history without your key (and you cannot either, if you lose it). Saved histories are never evicted. Run the app yourself if your history should not be kept on a shared server.
     </p>
 </div>
 """, unsafe_allow_html=True)
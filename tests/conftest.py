@@ -0,0 +1,11 @@
+import pytest
+
+import ingest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Point the frame cache at a fresh directory, so tests never see or fill the real one."""
+    path = tmp_path / "frames"
+    monkeypatch.setattr(ingest, "CACHE_DIR", path)
+    return path
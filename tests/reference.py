@@ -0,0 +1,99 @@
+"""The row-wise ingest the dashboard used before `ingest.prepare_frame`, and the
+discovery, sessionization and streak computations it used before `dataset`.
+
+Kept verbatim (minus the file reading and Streamlit caching) as the oracle for the
+equivalence tests and the baseline for `bench/bench_ingest.py`.
+"""
+import pandas as pd
+
+from ingest import _to_bool, clean_string
+
+
+def reference_prepare(df):
+    df["ts"] = pd.to_datetime(df["ts"], utc=True, errors="coerce")
+    df = df.dropna(subset=["ts"])
+    df["ms_played"] = pd.to_numeric(df["ms_played"], errors="coerce").fillna(0).astype(int)
+    df["skipped"] = df["skipped"].apply(_to_bool)
+    df["artist_popularity"] = pd.to_numeric(df["artist_popularity"], errors="coerce")
+    df["date"] = df["ts"].dt.date
+    df["year"] = df["ts"].dt.year
+    df["month"] = df["ts"].dt.to_period("M").astype(str)
+    df["dow"] = df["ts"].dt.dayofweek
+    df["hour"] = df["ts"].dt.hour
+    df["start_ts"] = df["ts"] - pd.to_timedelta(df["ms_played"], unit="ms")
+
+    for c in ["master_metadata_track_name", "master_metadata_album_artist_name",
+              "master_metadata_album_album_name", "genre_bucket", "artist_genres"]:
+        if c in df.columns:
+            df[c] = df[c].apply(clean_string)
+
+    df["track_id"] = df.apply(
+        lambda r: f"{r['master_metadata_album_artist_name']}§{r['master_metadata_track_name']}"
+        if r.get('master_metadata_track_name') and r.get('master_metadata_album_artist_name') else None, axis=1)
+    return df
+
+
+def reference_discovery(df_full, df_filtered):
+    first_artist = df_full.dropna(subset=["master_metadata_album_artist_name"]).groupby("master_metadata_album_artist_name")["ts"].min()
+    first_track = df_full.dropna(subset=["track_id"]).groupby("track_id")["ts"].min()
+    period_start = df_filtered["ts"].min()
+    period_end = df_filtered["ts"].max()
+    new_artists = first_artist[(first_artist >= period_start) & (first_artist <= period_end)]
+    new_tracks = first_track[(first_track >= period_start) & (first_track <= period_end)]
+    period_artists = df_filtered["master_metadata_album_artist_name"].dropna().nunique()
+    period_tracks = df_filtered["track_id"].dropna().nunique()
+    pct_new_artists = (len(new_artists) / period_artists * 100) if period_artists > 0 else 0
+    pct_new_tracks = (len(new_tracks) / period_tracks * 100) if period_tracks > 0 else 0
+    return pct_new_artists, pct_new_tracks, len(new_artists), len(new_tracks)
+
+
+def reference_old_vs_new_monthly(df_full, start_date, end_date):
+    df_clean = df_full.dropna(subset=["track_id"]).copy()
+    if len(df_clean) == 0: return pd.DataFrame()
+    first_listen = df_clean.groupby("track_id")["ts"].min().reset_index()
+    first_listen.columns = ["track_id", "first_listen_ts"]
+    first_listen["first_listen_month"] = pd.to_datetime(first_listen["first_listen_ts"]).dt.to_period("M").astype(str)
+    track_months = df_clean.groupby(["month", "track_id"]).size().reset_index(name="play_count")
+    track_months = track_months.merge(first_listen[["track_id", "first_listen_month"]], on="track_id")
+    track_months["is_new"] = track_months["month"] == track_months["first_listen_month"]
+    monthly_counts = track_months.groupby(["month", "is_new"]).agg(unique_tracks=("track_id", "nunique")).reset_index()
+    pivot = monthly_counts.pivot(index="month", columns="is_new", values="unique_tracks").fillna(0)
+    if False in pivot.columns and True in pivot.columns:
+        pivot.columns = ["Revisited tracks", "New discoveries"]
+    elif True in pivot.columns:
+        pivot.columns = ["New discoveries"]
+        pivot["Revisited tracks"] = 0
+    elif False in pivot.columns:
+        pivot.columns = ["Revisited tracks"]
+        pivot["New discoveries"] = 0
+    pivot = pivot.reset_index()
+    start_month = pd.Timestamp(start_date).to_period("M").strftime("%Y-%m")
+    end_month = pd.Timestamp(end_date).to_period("M").strftime("%Y-%m")
+    pivot = pivot[(pivot["month"] >= start_month) & (pivot["month"] <= end_month)]
+    return pivot
+
+
+def reference_sessionize(df, gap_minutes=15):
+    if len(df) == 0: return df
+    d = df.sort_values("start_ts").copy()
+    gap = pd.Timedelta(minutes=gap_minutes)
+    prev_end = d["ts"].shift(1)
+    new_session = (d["start_ts"] - prev_end) > gap
+    d["session_id"] = new_session.cumsum().fillna(0).astype(int)
+    session_len = d.groupby("session_id")["ms_played"].sum() / 60000
+    d["session_minutes"] = d["session_id"].map(session_len)
+    return d
+
+
+def reference_streaks(df_filtered):
+    """Compute the longest listening streak (consecutive days)."""
+    dates_active = sorted(df_filtered["date"].unique())
+    if len(dates_active) == 0: return 0, 0
+    max_streak = 1; current_streak = 1
+    for i in range(1, len(dates_active)):
+        if (dates_active[i] - dates_active[i-1]).days == 1:
+            current_streak += 1
+            max_streak = max(max_streak, current_streak)
+        else:
+            current_streak = 1
+    return max_streak, current_streak
@@ -0,0 +1,120 @@
+import json
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from streamlit.runtime.fragment import MemoryFragmentStorage
+from streamlit.runtime.scriptrunner import RerunData
+from streamlit.testing.v1 import AppTest, local_script_runner
+
+import ingest
+from tests.synthetic import synthetic_export
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+
+
+class Session:
+    """`AppTest` of the dashboard, with the fragment reruns a browser session makes.
+
+    `AppTest` starts every run with empty fragment storage and always reruns the whole
+    script. Here one storage is kept for the session, as the server keeps it, and
+    `rerun_fragment` reruns only the named fragment with the current widget values, as
+    a widget inside it does.
+    """
+
+    def __init__(self, monkeypatch):
+        self.storage = MemoryFragmentStorage()
+        self.fragment = {}
+        monkeypatch.setattr(local_script_runner, "MemoryFragmentStorage", lambda: self.storage)
+        monkeypatch.setattr(local_script_runner, "RerunData",
+                            lambda **kwargs: RerunData(**kwargs, **self.fragment))
+        self.at = AppTest.from_file(str(APP), default_timeout=120).run()
+
+    def fragment_id(self, name):
+        for fragment_id, run in self.storage._fragments.items():
+            if any(getattr(cell.cell_contents, "__name__", None) == name for cell in run.__closure__):
+                return fragment_id
+        raise KeyError(name)
+
+    def rerun_fragment(self, name):
+        self.fragment = {"fragment_id_queue": [self.fragment_id(name)], "is_fragment_scoped_rerun": True}
+        try:
+            self.at.run()
+        finally:
+            self.fragment = {}
+        assert not self.at.exception
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    # The demo data is read from the working directory
+    synthetic_export(20_000, seed=7).to_csv(tmp_path / "music_data.csv", index=False)
+    (tmp_path / "life_events.csv").write_text((APP.parent / "life_events.csv").read_text())
+    monkeypatch.chdir(tmp_path)
+    return Session(monkeypatch)
+
+
+def charts(at):
+    """Plotly figures drawn, by chart id."""
+    return {c.proto.id: json.loads(c.proto.spec) for c in at.get("plotly_chart")}
+
+
+def calendar_weeks(at):
+    """First and last week (Monday) columns of the calendar heatmap."""
+    (calendar,) = [spec for chart_id, spec in charts(at).items() if "calendar" in chart_id]
+    weeks = calendar["data"][0]["x"]
+    return weeks[0], weeks[-1]
+
+
+def rank_captions(at):
+    return [c.value for c in at.caption if "rank over time" in c.value]
+
+
+def test_dashboard_reruns_with_the_current_range(session):
+    at = session.at
+    assert calendar_weeks(at) == ("2021-03-01", "2024-09-23")
+    assert rank_captions(at)
+
+    at.radio[0].set_value("30 days").run()
+    assert calendar_weeks(at) == ("2024-08-26", "2024-09-23")
+
+    # The measure is inside the dashboard fragment: only the fragment reruns
+    at.selectbox(key="measure").set_value("Minutes")
+    session.rerun_fragment("dashboard")
+    assert calendar_weeks(at) == ("2024-08-26", "2024-09-23")
+    assert not rank_captions(at)
+    assert any("Discovery Rate" in m.value for m in at.markdown)
+
+
+@pytest.mark.parametrize("fragment, change", [
+    ("sessions_panel", lambda at: at.select_slider(key="session_gap").set_value(30)),
+    ("over_time", lambda at: at.checkbox(key="show_events").check()),
+    ("dashboard", lambda at: at.selectbox(key="calendar_artist").set_value("Artist 1")),
+])
+def test_fragment_reruns_draw_what_a_full_run_draws(session, fragment, change):
+    at = session.at
+    at.radio[0].set_value("90 days").run()
+    change(at)
+    session.rerun_fragment(fragment)
+    drawn = charts(at)
+    assert drawn
+    at.run()
+    assert drawn.items() <= charts(at).items()
+
+
+def test_rank_sparklines_rank_partial_months_on_the_range(session):
+    at = session.at
+    first, last = date(2022, 1, 10), date(2023, 6, 20)
+    at.date_input[0].set_value((first, last)).run()
+    drawn = charts(at)
+    df = ingest.load_export("music_data.csv")
+    df = df[(df["day"] >= ingest.to_day(first)) & (df["day"] <= ingest.to_day(last))]
+    # The baseline: streams per month and entity over the range's plays, ranked with pandas
+    for chart, col in [("rank_artist", ingest.ARTIST_COL), ("rank_track", "track_id")]:
+        no1 = df.groupby(col, observed=True)["ms_played"].sum().idxmax()
+        monthly = df.groupby(["month", col], observed=True).size()
+        ranks = monthly.groupby(level=0).rank(ascending=False, method="min").xs(no1, level=1)
+        (figure,) = [spec for chart_id, spec in drawn.items() if chart in chart_id]
+        assert figure["data"][0]["x"] == list(ingest.month_labels(ranks.index))
+        assert figure["data"][0]["y"] == ranks.astype(int).tolist()
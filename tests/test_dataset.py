@@ -0,0 +1,316 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from dataset import (ALBUM_COL, CUBE_MEASURES, DAY_NAMES, GENRE_COL, MONTH_NAMES, SUBGENRES_COL, CalendarGrid,
+                     DayIndex, FirstSeenIndex, RollupCube, TopTotals, day_bitmaps, day_runs, hll_estimate,
+                     hll_registers, sessionize)
+from tests.reference import (reference_discovery, reference_old_vs_new_monthly, reference_prepare,
+                             reference_sessionize, reference_streaks)
+from tests.synthetic import synthetic_export
+
+# The reference month labels go through Period, which warns that it drops the timezone
+pytestmark = pytest.mark.filterwarnings("ignore:Converting to PeriodArray:UserWarning")
+
+# (first, last) date ranges: several years, a few months, mid-month edges, a single day
+RANGES = [(date(2021, 3, 1), date(2024, 9, 30)), (date(2022, 1, 10), date(2023, 6, 20)),
+          (date(2023, 2, 1), date(2023, 2, 28)), (date(2024, 5, 17), date(2024, 5, 17))]
+
+
+@pytest.fixture(scope="module")
+def frames():
+    """The same synthetic export as a `reference_prepare` frame and as a prepared frame,
+    both in `ts` order."""
+    export = synthetic_export(20_000, seed=8)
+    expected = reference_prepare(export.copy()).sort_values("ts", kind="stable")
+    return expected, ingest.sort_by_ts(ingest.prepare_frame(export.copy()))
+
+
+@pytest.fixture(scope="module")
+def plays(frames):
+    return frames[1]
+
+
+@pytest.fixture(scope="module")
+def cube(plays):
+    return RollupCube(plays)
+
+
+def days_of(first, last):
+    return ingest.to_day(first), ingest.to_day(last)
+
+
+def plays_between(df, first, last):
+    """Plays from day ordinal `first` through `last`, filtered directly."""
+    return df[(df["day"] >= first) & (df["day"] <= last)]
+
+
+def measures(df):
+    """The cube's measures of each play."""
+    return pd.DataFrame({"streams": 1, "ms_played": df["ms_played"].astype(np.int64),
+                         "skips": df["skipped"].astype(np.int64),
+                         "skip_ms": df["ms_played"].where(df["skipped"], 0).astype(np.int64)}, index=df.index)
+
+
+# Ranges of day ordinals: the RANGES, a stretch without plays, and an inverted range
+DAY_RANGES = [days_of(first, last) for first, last in RANGES] + [
+    days_of(date(2020, 1, 1), date(2020, 12, 31)), days_of(date(2023, 5, 2), date(2023, 5, 1))]
+
+
+@pytest.mark.parametrize("first, last", RANGES)
+def test_first_seen_index_matches_the_baseline(frames, first, last):
+    expected, df = frames
+    index = FirstSeenIndex(df, *ingest.first_listen_tables(df))
+    in_range = expected[(expected["date"] >= first) & (expected["date"] <= last)]
+    assert len(in_range)
+    _, _, new_artists, new_tracks = reference_discovery(expected, in_range)
+    assert index.first_heard(in_range["ts"].iloc[0], in_range["ts"].iloc[-1]) == (new_artists, new_tracks)
+
+    baseline = reference_old_vs_new_monthly(expected, first, last)
+    months, new, revisited = index.monthly_tracks(ingest.month_index(first), ingest.month_index(last))
+    assert list(ingest.month_labels(months)) == list(baseline["month"])
+    np.testing.assert_array_equal(new, baseline["New discoveries"].to_numpy(int))
+    np.testing.assert_array_equal(revisited, baseline["Revisited tracks"].to_numpy(int))
+
+
+@pytest.mark.parametrize("n", [10, 100, 1_000, 20_000, 100_000])
+def test_distinct_estimates_stay_within_the_stated_error(n):
+    # Independent sets of n distinct values, one per register row
+    sets = 100 if n < 100_000 else 20
+    hashes = ingest.fmix64(np.arange(1, sets * n + 1, dtype=np.uint64))
+    registers = hll_registers(np.repeat(np.arange(sets), n), hashes, sets)
+    errors = np.array([hll_estimate(r) for r in registers]) / n - 1
+    # About 2.3% standard error, about 95% of estimates within ±4.6%
+    assert errors.std() <= 0.025
+    assert np.mean(np.abs(errors) <= 0.046) >= 0.9
+    assert np.all(np.abs(errors) * n <= max(0.069 * n, 1))
+
+
+DISTINCT = [("tracks", "track_id"), ("artists", ingest.ARTIST_COL), ("albums", ALBUM_COL)]
+
+
+@pytest.mark.parametrize("first, last", [*RANGES, (date(2020, 1, 1), date(2020, 12, 31))])
+def test_cube_distinct_counts_match_nunique(plays, cube, first, last):
+    in_range = plays_between(plays, *days_of(first, last))
+    part = cube.range(*days_of(first, last))
+    for name, col in DISTINCT:
+        exact = in_range[col].nunique()
+        assert abs(part.distinct(name) - exact) <= 0.046 * exact, name
+
+
+def test_cube_distinct_counts_of_scattered_days(plays, cube):
+    days = np.unique(plays["day"])[::5]
+    picked = plays[plays["day"].isin(days)]
+    for name, col in DISTINCT:
+        exact = picked[col].nunique()
+        assert abs(cube.select(days).distinct(name) - exact) <= 0.046 * exact, name
+
+
+CUBE_VIEWS = [(), ("hour",), (GENRE_COL,), (ingest.ARTIST_COL,), ("hour", GENRE_COL, ingest.ARTIST_COL),
+              (GENRE_COL, SUBGENRES_COL)]
+
+
+def assert_rolls_up(view, df, dims):
+    """`view` (a cube table) sums the measures of `df` by day and `dims`, as pandas does."""
+    expected = measures(df).groupby([df["day"], *(df[d] for d in dims)], observed=True, dropna=False).sum()
+    got = view.set_index(["day", *dims])[list(CUBE_MEASURES)]
+    pd.testing.assert_frame_equal(got.sort_index(), expected.sort_index(), check_dtype=False,
+                                  check_index_type=False, check_categorical=False)
+    np.testing.assert_array_equal(view["month"], ingest.day_months(view["day"]))
+
+
+@pytest.mark.parametrize("first, last", DAY_RANGES)
+def test_cube_views_match_a_groupby_of_the_plays(plays, cube, first, last):
+    part = cube.range(first, last)
+    in_range = plays_between(plays, first, last)
+    for dims in CUBE_VIEWS:
+        assert_rolls_up(part.by(*dims), in_range, dims)
+    assert len(part) == in_range["day"].nunique()
+
+
+def test_cube_views_of_scattered_days(plays, cube):
+    days = np.unique(plays["day"])[::7]
+    part = cube.select(np.append(days, days[-1] + 10_000))
+    for dims in CUBE_VIEWS:
+        assert_rolls_up(part.by(*dims), plays[plays["day"].isin(days)], dims)
+
+
+@pytest.mark.parametrize("first, last", DAY_RANGES)
+def test_range_totals_match_sums_of_the_plays(plays, cube, first, last):
+    expected = measures(plays_between(plays, first, last)).sum().to_dict()
+    assert cube.totals(first, last) == expected
+    part = cube.range(first, last)
+    assert {m: part.total(m) for m in CUBE_MEASURES} == expected
+    # Summing the selected days, without the prefix sums, gives the same totals
+    days = np.arange(first, last + 1)
+    assert {m: cube.select(days).total(m) for m in CUBE_MEASURES} == expected
+
+
+@pytest.mark.parametrize("gap", [0, 15, 60])
+def test_sessions_match_the_baseline(frames, gap):
+    expected, df = frames
+    plays = reference_sessionize(expected, gap).groupby("session_id")
+    baseline = pd.DataFrame({"start": plays["start_ts"].min(), "end": plays["ts"].max(),
+                             "minutes": plays["session_minutes"].first(), "plays": plays.size(),
+                             "skips": plays["skipped"].sum()}).reset_index(drop=True)
+    sessions = sessionize(df, gap)
+    pd.testing.assert_frame_equal(sessions.drop(columns="day"), baseline, check_dtype=False)
+    assert [ingest.from_day(d) for d in sessions["day"]] == list(baseline["start"].dt.date)
+
+    # Ranges take whole sessions by start day
+    index = DayIndex(sessions)
+    for first, last in DAY_RANGES:
+        in_range = sessions[(sessions["day"] >= first) & (sessions["day"] <= last)]
+        pd.testing.assert_frame_equal(index.range(first, last), in_range)
+    days = np.unique(sessions["day"])[::3]
+    pd.testing.assert_frame_equal(index.select(days).reset_index(drop=True),
+                                  sessions[sessions["day"].isin(days)].reset_index(drop=True))
+
+
+def test_sessions_of_no_plays_and_one_play(plays):
+    assert sessionize(plays.iloc[:0], 15).empty
+    (session,) = sessionize(plays.iloc[:1], 15).itertuples()
+    assert (session.start, session.end, session.plays) == (plays["start_ts"].iloc[0], plays["ts"].iloc[0], 1)
+
+
+def runs_of(days):
+    """(starts, lengths) of the runs of consecutive days among `days`, with pandas."""
+    days = pd.Series(np.unique(days))
+    runs = days.groupby((days.diff() != 1).cumsum())
+    return runs.first().to_numpy(), runs.size().to_numpy()
+
+
+def assert_same_runs(got, expected):
+    for g, e in zip(got, expected):
+        np.testing.assert_array_equal(g, e)
+
+
+@pytest.mark.parametrize("first, last", DAY_RANGES)
+def test_streaks_match_the_active_days(frames, cube, first, last):
+    expected, df = frames
+    runs = runs_of(plays_between(df, first, last)["day"])
+    assert_same_runs(cube.runs(first, last), runs)
+    assert_same_runs(cube.range(first, last).runs(), runs)
+    starts, lengths = runs
+    in_range = expected[(expected["date"] >= ingest.from_day(first)) & (expected["date"] <= ingest.from_day(last))]
+    assert reference_streaks(in_range) == ((lengths.max(), lengths[-1]) if len(lengths) else (0, 0))
+
+
+def test_streaks_of_scattered_days(plays, cube):
+    days = np.unique(plays["day"])
+    days = np.unique(np.concatenate([days[::3], days[1::3], days[:40]]))
+    assert_same_runs(cube.select(days).runs(), runs_of(plays["day"][plays["day"].isin(days)]))
+    assert_same_runs(day_runs([]), ([], []))
+    assert_same_runs(day_runs([7]), ([7], [1]))
+
+
+def ranked(totals, n, by):
+    """The top `n` rows of a (streams, ms_played) table by `by`, ties in table order."""
+    return totals.sort_values(by, ascending=False, kind="stable").head(n).reset_index()
+
+
+@pytest.mark.parametrize("first, last", DAY_RANGES)
+def test_top_totals_match_a_groupby(plays, cube, first, last):
+    in_range = plays_between(plays, first, last)
+    top = TopTotals(in_range, cube.range(first, last).by(ingest.ARTIST_COL))
+    with_track = in_range[in_range["track_id"].notna()]
+    # Artists tie in name order, tracks in order of first play
+    artists = in_range.groupby(ingest.ARTIST_COL, observed=True)["ms_played"].agg(streams="size", ms_played="sum")
+    tracks = with_track.groupby("track_id", sort=False)["ms_played"].agg(streams="size", ms_played="sum")
+    track_artists = (with_track.groupby(ingest.ARTIST_COL, observed=True)["ms_played"]
+                     .agg(streams="size", ms_played="sum"))
+    no1 = artists["ms_played"].idxmax() if len(artists) else None
+    for n in [1, 10, 100_000]:
+        for by in ["streams", "ms_played"]:
+            for got, expected in [
+                (top.artists(n, by), ranked(artists, n, by)),
+                (top.tracks(n, by), ranked(tracks, n, by)),
+                (top.track_artists(n, by), ranked(track_artists, n, by)),
+            ]:
+                pd.testing.assert_frame_equal(got, expected, check_dtype=False, check_categorical=False)
+            if no1 is not None:
+                mine = with_track[with_track[ingest.ARTIST_COL] == no1]
+                pd.testing.assert_frame_equal(
+                    top.tracks(n, by, artist=no1),
+                    ranked(mine.groupby("track_id", sort=False)["ms_played"].agg(streams="size", ms_played="sum"), n, by),
+                    check_dtype=False)
+
+
+def cell_labels(first, last, mode):
+    """(day, x, y) axis labels of each day's calendar cell, from the dates."""
+    days = np.arange(first, last + 1)
+    dates = pd.DatetimeIndex(days.astype("datetime64[D]"))
+    if mode == "day":
+        x = (dates - pd.to_timedelta(dates.dayofweek, unit="D")).strftime("%Y-%m-%d")
+        y = np.array(DAY_NAMES)[dates.dayofweek]
+    elif mode == "week":
+        iso = dates.isocalendar()
+        x, y = iso["week"].astype(str), iso["year"].astype(str)
+    else:
+        x, y = np.array(MONTH_NAMES)[dates.month - 1], dates.year.astype(str)
+    return pd.DataFrame({"day": days, "x": list(x), "y": list(y)})
+
+
+# (first, last, mode) with daily cells up to 400 days and weekly ones up to 1000
+CALENDARS = [(date(2024, 5, 17), date(2024, 5, 17), "day"), (date(2023, 1, 30), date(2023, 4, 2), "day"),
+             (date(2022, 6, 20), date(2024, 1, 10), "week"), (date(2021, 3, 1), date(2024, 9, 30), "month")]
+
+
+@pytest.mark.parametrize("first, last, mode", CALENDARS)
+def test_calendar_selections_match_the_cell_labels(first, last, mode):
+    grid = CalendarGrid(*days_of(first, last), 400, 1000)
+    assert grid.mode == mode
+    cells = cell_labels(*days_of(first, last), mode)
+    cells["col"], cells["row"] = cells["x"].map(grid.x.index), cells["y"].map(grid.y.index)
+    np.testing.assert_array_equal(grid.cols, cells["col"])
+    np.testing.assert_array_equal(grid.rows, cells["row"])
+
+    # Clicked cells, in click order, plus labels outside the grid
+    labels = list(cells[["x", "y"]].drop_duplicates().itertuples(index=False, name=None))[::-3]
+    expected = [d for label in labels for d in cells["day"][(cells["x"] == label[0]) & (cells["y"] == label[1])]]
+    np.testing.assert_array_equal(grid.points([*labels, ("1999-01-04", "Mon"), ("54", "2023"), ("Jan", "1999")]),
+                                  expected)
+    assert len(grid.points([])) == 0
+
+    # A box from the second column to the middle and over the first half of the rows,
+    # its edges off the cell centres and in either order
+    last_col = cells["col"].max()
+    col_min, col_max = min(1, last_col), min(last_col // 2 + 1, last_col)
+    row_min, row_max = 0, cells["row"].max() // 2
+    if mode == "day":
+        x_range = [pd.Timestamp(grid.x[col_min]) + pd.Timedelta(days=2),
+                   pd.Timestamp(grid.x[col_max]) - pd.Timedelta(days=3)]
+    else:
+        x_range = [col_min + 0.3, col_max - 0.4]
+    in_box = cells["day"][cells["col"].between(col_min, col_max) & cells["row"].between(row_min, row_max)]
+    for xs, ys in [(x_range, [row_min - 0.4, row_max + 0.3]), (x_range[::-1], [row_max + 0.3, row_min - 0.4])]:
+        np.testing.assert_array_equal(grid.box(xs, ys), in_box)
+    assert len(grid.box(x_range, [len(grid.y) + 1, len(grid.y) + 2])) == 0
+    # Edges from another mode's axis select nothing
+    other_x = [3.2, 5.7] if mode == "day" else ["2023-01-30", "2023-02-20"]
+    assert len(grid.box(other_x, [0, 1])) == 0
+
+    # Per-day values sum into their cells
+    sums = cells.groupby(["row", "col"])["day"].sum()
+    matrix = grid.values(cells["day"].to_numpy())
+    np.testing.assert_array_equal(matrix[sums.index.get_level_values(0), sums.index.get_level_values(1)], sums)
+    assert np.isnan(matrix).sum() == matrix.size - len(sums)
+
+
+def test_artist_day_counts_match_distinct_play_dates(plays):
+    bitmaps = day_bitmaps(plays)
+    artists = plays[ingest.ARTIST_COL]
+    expected = plays["ts"].dt.normalize().groupby(artists, observed=True).nunique()
+    assert {a: bitmaps.count(a) for a in expected.index} == expected.to_dict()
+    for artist in expected.index[:20]:
+        np.testing.assert_array_equal(bitmaps.days(artist), np.unique(plays["day"][artists == artist]))
+
+    active = np.unique(plays["day"])
+    selections = [np.arange(first, last + 1) for first, last in DAY_RANGES] + [active[::4], active[:1], []]
+    for days in selections:
+        picked = plays[plays["day"].isin(days)]
+        in_days = picked["ts"].dt.normalize().groupby(picked[ingest.ARTIST_COL], observed=True).nunique().to_dict()
+        assert {a: bitmaps.count(a, days) for a in expected.index} == {a: in_days.get(a, 0) for a in expected.index}
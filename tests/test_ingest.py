@@ -0,0 +1,189 @@
+import io
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from tests.reference import reference_prepare
+from tests.synthetic import history_json_payloads, synthetic_export
+
+# The reference month labels go through Period, which warns that it drops the timezone
+pytestmark = pytest.mark.filterwarnings("ignore:Converting to PeriodArray:UserWarning")
+
+
+def assert_same_plays(expected, df):
+    """`df` (a prepared frame) holds the same plays as `expected` (a `reference_prepare`
+    frame), compared through the prepared schema's encodings."""
+    assert len(df) == len(expected)
+    for c in ["ts", "start_ts", "skipped", "artist_popularity", "year", "dow", "hour"]:
+        np.testing.assert_array_equal(df[c].to_numpy(), expected[c].to_numpy(), err_msg=c)
+    np.testing.assert_array_equal(df["ms_played"].to_numpy(np.int64), expected["ms_played"].to_numpy())
+    assert [ingest.from_day(d) for d in df["day"]] == list(expected["date"])
+    assert list(ingest.month_labels(df["month"])) == list(expected["month"])
+    for c in ingest.STRING_COLUMNS:
+        assert isinstance(df[c].dtype, pd.CategoricalDtype), c
+        assert df[c].cat.categories.is_monotonic_increasing, c
+        names = df[c].astype(object)
+        assert list(names.where(names.notna(), None)) == list(expected[c]), c
+    has_id = df["track_id"].notna().to_numpy()
+    np.testing.assert_array_equal(has_id, expected["track_id"].notna().to_numpy())
+    tracks, artists = ingest.decode_track_ids(df, df["track_id"][has_id])
+    assert list(artists + "§" + tracks) == list(expected["track_id"][has_id])
+
+
+@pytest.fixture(scope="module")
+def export():
+    return synthetic_export(5_000, seed=1)
+
+
+def test_prepare_frame_matches_reference(export):
+    expected = reference_prepare(export.copy())
+    df = ingest.prepare_frame(export.copy())
+    assert_same_plays(expected, df)
+    pd.testing.assert_index_equal(df.index, expected.index)
+
+
+def test_load_export_matches_reference(export, tmp_path):
+    path = tmp_path / "export.csv"
+    export.to_csv(path, index=False)
+    expected = reference_prepare(pd.read_csv(path)).sort_values("ts", kind="stable")
+    assert_same_plays(expected, ingest.sort_by_ts(ingest.prepare_frame(ingest._read_export(path))))
+
+
+def test_lookups_clean_each_distinct_value_once():
+    raw = pd.Series(["  A ", "A", "null", None, "B", "  A "])
+    cleaned = ingest.categorize_strings(raw)
+    assert list(cleaned.cat.categories) == ["A", "B"]
+    assert list(cleaned.astype(object).where(cleaned.notna(), None)) == ["A", "A", None, None, "B", "A"]
+    flags = ingest.to_bool_series(pd.Series(["True", "no", None, "1", "Y"]))
+    assert flags.tolist() == [True, False, False, True, True]
+
+
+def test_concurrent_cache_writes_of_one_entry(export, cache_dir):
+    df = ingest.prepare_frame(export.copy())
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda _: ingest.write_cached_frame("same", df), range(8)))
+    assert [p.name for p in cache_dir.iterdir()] == [ingest._cache_path("same").name]
+    pd.testing.assert_frame_equal(ingest.read_cached_frame("same"), df)
+
+
+@pytest.fixture(scope="module")
+def large_export(tmp_path_factory):
+    """An export big enough to be read in several chunks under a 1 MB budget."""
+    path = tmp_path_factory.mktemp("exports") / "large.csv"
+    synthetic_export(40_000, seed=2).to_csv(path, index=False)
+    return path
+
+
+def test_chunked_ingest_round_trips_through_the_cache(large_export):
+    expected = reference_prepare(pd.read_csv(large_export)).sort_values("ts", kind="stable")
+    chunked = ingest.load_export(large_export, memory_budget=2**20)
+    assert_same_plays(expected, chunked)
+    cached = ingest.load_export(large_export, memory_budget=2**20)
+    assert_same_plays(expected, cached)
+    pd.testing.assert_frame_equal(cached, chunked)
+
+
+def test_chunked_ingest_publishes_nothing_when_storing_fails(large_export, cache_dir, monkeypatch):
+    expected = reference_prepare(pd.read_csv(large_export)).sort_values("ts", kind="stable")
+
+    def disk_full(*args, **kwargs):
+        raise OSError(28, "No space left on device")
+
+    # The final frame cannot be written: the load still succeeds, without a cache entry
+    with monkeypatch.context() as m:
+        m.setattr(pd.DataFrame, "to_parquet", disk_full)
+        assert_same_plays(expected, ingest.load_export(large_export, memory_budget=2**20))
+    assert list(cache_dir.iterdir()) == []
+
+    def out_of_memory(*args, **kwargs):
+        raise MemoryError
+
+    with monkeypatch.context() as m:
+        m.setattr(ingest, "write_cached_frame", out_of_memory)
+        with pytest.raises(MemoryError):
+            ingest.load_export(large_export, memory_budget=2**20)
+    assert list(cache_dir.iterdir()) == []
+    assert_same_plays(expected, ingest.load_export(large_export, memory_budget=2**20))
+
+
+def test_all_missing_columns_stay_categorical_through_the_cache():
+    export = synthetic_export(500, seed=3)
+    export["genre_bucket"] = None
+    export["artist_genres"] = ""
+    df = ingest.prepare_frame(export)
+    ingest.write_cached_frame("sparse", df)
+    cached = ingest.read_cached_frame("sparse")
+    for c in ingest.STRING_COLUMNS:
+        assert isinstance(cached[c].dtype, pd.CategoricalDtype), c
+    merged = ingest.merge_sorted_parts([cached, df.copy()])
+    assert merged["genre_bucket"].isna().all() and len(merged) == len(df)
+
+
+def _uploads(payloads):
+    files = []
+    for name, data in payloads:
+        f = io.BytesIO(data)
+        f.name = name
+        files.append(f)
+    return files
+
+
+def test_history_json_loads_again_from_the_cache():
+    payloads = history_json_payloads(synthetic_export(6_000, seed=4), 12)
+    expected = ingest.merge_sorted_parts([ingest.parse_history_json(data) for _, data in payloads])
+    first = ingest.load_history_json(_uploads(payloads))
+    pd.testing.assert_frame_equal(first, expected)
+    again = ingest.load_history_json(_uploads(payloads))
+    pd.testing.assert_frame_equal(again, expected)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for name, data in reversed(payloads):
+            zf.writestr(f"MyData/{name}", data)
+    archive.name = "my_spotify_data.zip"
+    pd.testing.assert_frame_equal(ingest.load_history_json([archive]), expected)
+    assert again.attrs["version"] == first.attrs["version"]
+
+
+def test_sessions_parsing_at_once_share_one_pool():
+    main = sys.modules["__main__"]
+    batches = [history_json_payloads(synthetic_export(2_000, seed=10 + i), 3) for i in range(4)]
+    with ThreadPoolExecutor(4) as threads:
+        loaded = list(threads.map(lambda payloads: ingest.load_history_json(_uploads(payloads)), batches))
+    for payloads, df in zip(batches, loaded):
+        expected = ingest.merge_sorted_parts([ingest.parse_history_json(data) for _, data in payloads])
+        pd.testing.assert_frame_equal(df, expected)
+    assert sys.modules["__main__"] is main
+    assert ingest._worker_pool() is ingest._worker_pool()
+
+
+def test_profile_appended_from_json_loads_again(tmp_path):
+    payloads = history_json_payloads(synthetic_export(6_000, seed=5), 12)
+    expected = ingest.merge_sorted_parts([ingest.parse_history_json(data) for _, data in payloads])
+    store, key = tmp_path / "plays", ingest.new_store_key()
+    added = [ingest.append_to_store(key, _uploads(batch), store_dir=store)
+             for batch in (payloads[:6], payloads[4:])]
+    assert sum(added) == len(expected)
+    df, first_artist, first_track = ingest.load_store(f" {key}\n", store_dir=store)
+    pd.testing.assert_frame_equal(df, expected)
+    # The stored first-listen tables (in append order) match a rescan of the plays
+    scanned_artist, scanned_track = ingest.first_listen_tables(df)
+    assert first_artist.sort_index().to_dict() == scanned_artist.to_dict()
+    assert first_track.sort_index().to_dict() == scanned_track.to_dict()
+
+
+def test_stores_open_only_with_their_generated_key(tmp_path):
+    store, key = tmp_path / "plays", ingest.new_store_key()
+    payloads = history_json_payloads(synthetic_export(500, seed=6), 1)
+    ingest.append_to_store(key, _uploads(payloads), store_dir=store)
+    # The directory is named by a hash of the key, never by the key itself
+    (root,) = store.iterdir()
+    assert key not in root.name
+    assert ingest.store_version(ingest.new_store_key(), store_dir=store) == "0@None"
+    for guess in ["default", "", "me", key[:-1]]:
+        with pytest.raises(ValueError):
+            ingest.load_store(guess, store_dir=store)